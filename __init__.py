@@ -17,7 +17,7 @@ bl_info = {
 	,'category': 'Rigging'
 }
 
-extra_modules = ['extras_cartoony_max.py', 'vehicle_utils.py', 'extras_space_rover.py', 'extras_cyberbike.py']
+extra_modules = ['extras_cartoony_max.py', 'vehicle_utils.py', 'extras_space_rover.py', 'extras_cyberbike.py', 'optimizer_utils.py']
 
 missing_modules = []
 for module in extra_modules:
@@ -42,6 +42,7 @@ else:
  
 
 reload_list = [
+                'optimizer_utils',
                 'ui_panel',
                 'update',
                 'extras_cartoony_max',
@@ -56,6 +57,7 @@ for module in reload_list:
     if module in locals():
         reload(sys.modules[__name__ + '.' + module])
     else:
+        from . import optimizer_utils
         from . import ui_panel
         from . import update
         from . import extras_cartoony_max
@@ -97,12 +99,15 @@ class_list = {
     ui_panel.POSE_OT_rigify_switch_parent_bake,
     ui_panel.POSE_OT_rigify_finger_fk2ik,
     ui_panel.POSE_OT_rigify_finger_fk2ik_bake,
+    ui_panel.POSE_OT_rigify_batch_bake,
     ui_panel.POSE_OT_rig_change_resolution,
     ui_panel.POSE_OT_rig_set_mask,
     update.TORigUIAddonUpdate,
     TORigUIPreferences,
     extras_cartoony_max.POSE_OT_MaxCartoonyToggleVisibility,
+    extras_cartoony_max.POSE_OT_MaxCartoonySetupVisibilitySets,
     vehicle_utils.POSE_OT_VehicleTogglePath,
+    vehicle_utils.POSE_OT_VehicleSetupPathVisibility,
     vehicle_utils.POSE_OT_VehicleSetFloor,
     vehicle_utils.POSE_OT_VehicleClearFloor,
     extras_setpiece.POSE_OT_SetToggleVisibility,
@@ -116,8 +121,13 @@ def register():
     register_class(extras_space_rover.VIEW3D_PT_TORigUI_SpaceRoverUI)
     register_class(extras_cyberbike.VIEW3D_PT_TORigUI_CyberbikeUI)
     register_class(extras_setpiece.VIEW3D_PT_TORigUI_SetUI)
+    register_class(ui_panel.VIEW3D_PT_TORigUI_BakeSettings)
+
+    ui_panel.register_handlers()
 
 def unregister():
+    ui_panel.unregister_handlers()
+
     for cls in class_list:
         unregister_class(cls)
 
@@ -125,3 +135,4 @@ def unregister():
     unregister_class(extras_space_rover.VIEW3D_PT_TORigUI_SpaceRoverUI)
     unregister_class(extras_cyberbike.VIEW3D_PT_TORigUI_CyberbikeUI)
     unregister_class(extras_setpiece.VIEW3D_PT_TORigUI_SetUI)
+    unregister_class(ui_panel.VIEW3D_PT_TORigUI_BakeSettings)
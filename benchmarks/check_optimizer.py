@@ -0,0 +1,115 @@
+"""Sanity checks for the scalar minimization helpers used by the IK/FK snapping.
+
+optimizer_utils has no Blender dependencies, so this runs with any Python 3:
+
+Usage:
+    python benchmarks/check_optimizer.py
+
+Each check prints its name, the result and the number of evaluations, and the
+script exits with status 1 if any of them fails.
+"""
+
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from optimizer_utils import (
+    EvaluationBudgetExceeded, MemoizedFunction,
+    bracket_minimum, brent_minimize, golden_section_search, minimize_scalar,
+)
+
+
+def quadratic(center):
+    return lambda x: (x - center) ** 2 + 1
+
+
+def check_golden_section():
+    result = golden_section_search(quadratic(0.3), -1, 2, tolerance=1e-6)
+    assert result.converged and result.reason == 'tolerance', result
+    assert abs(result.x - 0.3) < 1e-5, result
+    return result
+
+
+def check_brent():
+    result = brent_minimize(quadratic(-0.7), -2, 1, tolerance=1e-6)
+    assert result.converged and result.reason == 'tolerance', result
+    assert abs(result.x + 0.7) < 1e-5, result
+    # Parabolic steps land on a quadratic's minimum almost immediately
+    golden = golden_section_search(quadratic(-0.7), -2, 1, tolerance=1e-6)
+    assert result.evaluations < golden.evaluations, (result, golden)
+    return result
+
+
+def check_brent_with_bracket():
+    f = quadratic(1.2)
+    bracket = bracket_minimum(f, 0, math.pi / 8)
+    assert bracket and bracket[0] <= 1.2 <= bracket[2], bracket
+    result = brent_minimize(f, bracket[0], bracket[2], x=bracket[1], tolerance=1e-6)
+    assert abs(result.x - 1.2) < 1e-5, result
+    return result
+
+
+def check_minimize_scalar():
+    result = minimize_scalar(lambda x: math.cos(x - 0.5), math.pi, math.pi / 8, tolerance=1e-6)
+    assert result.converged, result
+    assert abs(result.x - (0.5 + math.pi)) < 1e-4, result
+    return result
+
+
+def check_memo_cache():
+    calls = []
+    f = MemoizedFunction(lambda x: calls.append(x) or x * x)
+    f(1.0), f(1.0), f(1.0 + 1e-15), f(2.0)
+    assert f.evaluations == 2 and len(calls) == 2, calls
+    assert f.best == (1.0, 1.0), f.best
+    return f.best
+
+
+def check_memo_budget():
+    f = MemoizedFunction(quadratic(0), budget=3)
+    f(1), f(2), f(3), f(1)
+    try:
+        f(4)
+    except EvaluationBudgetExceeded:
+        pass
+    else:
+        raise AssertionError("budget not enforced")
+
+    result = golden_section_search(quadratic(0.3), -1, 2, tolerance=1e-9, budget=5)
+    assert not result.converged and result.reason == 'budget', result
+    assert result.evaluations == 5, result
+
+    result = minimize_scalar(quadratic(100), 0, 0.1, budget=4)
+    assert result.reason == 'budget', result
+    return result
+
+
+CHECKS = [
+    check_golden_section,
+    check_brent,
+    check_brent_with_bracket,
+    check_minimize_scalar,
+    check_memo_cache,
+    check_memo_budget,
+]
+
+
+def main():
+    failed = 0
+
+    for check in CHECKS:
+        try:
+            result = check()
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL  {check.__name__}: {e}")
+        else:
+            print(f"ok    {check.__name__}: {result}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
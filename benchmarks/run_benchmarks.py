@@ -0,0 +1,717 @@
+"""Headless benchmarks for the TORigUI snapping and baking operators.
+
+Builds a synthetic TOAnimate style rig carrying the custom properties the panel expects,
+keys it, and times every operator in the add-on's class_list as well as the panel draw.
+
+Usage:
+    blender -b -P benchmarks/run_benchmarks.py -- [options]
+
+Options:
+    --limbs N           Number of limbs, alternating left and right, arms then legs (default 4)
+    --fingers N         Number of fingers on each arm (default 2)
+    --frames N          Length of the keyed animation (default 120)
+    --key-step N        Distance between keys in frames (default 4)
+    --meshes N          Number of subdivided meshes deformed by the rig (default 4)
+    --repeat N          Number of timed runs per benchmark (default 3)
+    --only TEXT         Only run benchmarks whose name contains TEXT
+    --output PATH       Write the JSON results to PATH instead of stdout
+    --baseline PATH     Compare the results with a previous JSON output
+    --threshold X       Relative slowdown reported as a regression (default 0.1)
+    --fail-on-regression  Exit with status 1 if any benchmark regressed
+
+Progress, warnings and the baseline comparison table go to stderr, so that without --output
+stdout only carries the JSON results.
+
+The add-on is loaded from this checkout under the name TORigUI, taking precedence over
+any installed copy. Bake operators run with profiling enabled, so the results include
+the frame_set, view_layer.update and written key counters of each bake.
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+import addon_utils
+import bpy
+from mathutils import Matrix, Vector
+
+ADDON_NAME = "TORigUI"
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RIG_NAME = "RIG-Bench"
+GEO_NAME = "Bench"
+
+SKIPPED_OPERATORS = {
+    "pose.to_rigui_update_addon": "downloads from the network",
+    "pose.max_cartoony_toggle_vis": "needs the Lil Max production rig",
+    "pose.max_cartoony_setup_visibility_sets": "needs the Lil Max production rig",
+    "pose.toggle_vehicle_path": "needs a vehicle production rig",
+    "pose.vehicle_setup_path_visibility": "needs a vehicle production rig",
+    "pose.vehiclesetfloor": "needs a vehicle production rig",
+    "pose.vehicleclearfloor": "needs a vehicle production rig",
+    "pose.toggle_set_visibility": "needs a set piece production rig",
+}
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog="run_benchmarks.py")
+    parser.add_argument("--limbs", type=int, default=4)
+    parser.add_argument("--fingers", type=int, default=2)
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--key-step", type=int, default=4)
+    parser.add_argument("--meshes", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", default="")
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args(argv)
+
+
+def load_addon():
+    "Enable the add-on from this checkout under its release name."
+    staging = tempfile.mkdtemp(prefix="torigui_bench_")
+    target = os.path.join(staging, ADDON_NAME)
+
+    try:
+        os.symlink(REPO_DIR, target, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        shutil.copytree(REPO_DIR, target, ignore=shutil.ignore_patterns(".git", "__pycache__", "benchmarks"))
+
+    sys.path.insert(0, staging)
+
+    module = addon_utils.enable(ADDON_NAME, default_set=True, handle_error=None)
+    if module is None:
+        raise RuntimeError("Could not enable the add-on from " + REPO_DIR)
+    return module
+
+
+##############################
+## Synthetic rig generation ##
+##############################
+
+LIMB_NAMES = {
+    'arm': ("upper_arm", "forearm", "hand"),
+    'leg': ("thigh", "shin", "foot"),
+}
+
+
+class LimbSpec:
+    "Bone names and custom properties of one synthetic limb."
+
+    def __init__(self, index):
+        self.side = 'L' if index % 2 == 0 else 'R'
+        self.pair = index // 2
+        self.kind = 'arm' if self.pair % 2 == 0 else 'leg'
+        self.sign = 1 if self.side == 'L' else -1
+
+        sfx = f".{self.pair:03d}.{self.side}"
+        upper, lower, end = LIMB_NAMES[self.kind]
+
+        self.settings = f"{self.kind}_settings{sfx}"
+        self.fk = [f"{upper}_fk{sfx}", f"{lower}_fk{sfx}", f"{end}_fk{sfx}"]
+        self.ik = [f"{upper}_ik{sfx}", f"MCH-{lower}_ik{sfx}", f"MCH-{end}_ik{sfx}"]
+        self.ctrl = [f"{upper}_ik{sfx}", f"{upper}_ik_target{sfx}", f"{end}_ik{sfx}"]
+        self.heel = f"{end}_heel_ik{sfx}" if self.kind == 'leg' else None
+        self.extra = [self.heel] if self.heel else []
+        self.fingers = []
+
+    def points(self):
+        "Joint positions from the shoulder or hip to the tip of the hand or foot."
+        s, level = self.sign, self.pair // 2
+
+        if self.kind == 'arm':
+            z = 1.5 - level * 0.1
+            return [Vector(p) for p in ((s * 0.2, 0, z), (s * 0.5, 0.04, z), (s * 0.8, 0, z), (s * 0.95, 0, z))]
+        else:
+            x = s * (0.1 + level * 0.1)
+            return [Vector(p) for p in ((x, 0, 1.0), (x, -0.04, 0.55), (x, 0, 0.1), (x, -0.15, 0.0))]
+
+    def pole_offset(self):
+        return Vector((0, 0.5, 0)) if self.kind == 'arm' else Vector((0, -0.5, 0))
+
+    def settings_props(self):
+        parents = ["None", "Root"]
+        return {
+            "IK_FK": 0.0,
+            "IK_parent": 0,
+            "pole_parent": 0,
+            "pole_vector": 1 if self.side == 'L' else 0,
+            "fk_bones": self.fk,
+            "ik_bones": self.ik,
+            "ctrl_bones": self.ctrl,
+            "extra_ctrls": self.extra,
+            "ik_parentswitch_ctrlbone": self.ctrl[-1],
+            "ik_parentswitch_parentnames": parents,
+            "ik_poleparentswitch_ctrlbone": self.ctrl[1],
+            "ik_poleparentswitch_parentnames": parents,
+        }
+
+
+class FingerSpec:
+    "Bone names and custom properties of one synthetic finger."
+
+    def __init__(self, limb, index):
+        sfx = f".{limb.pair:03d}.{limb.side}"
+        base = f"f_{index}"
+
+        self.limb = limb
+        self.index = index
+        self.master = f"{base}_master{sfx}"
+        self.fk = [f"{base}.{k:02d}_fk{sfx}" for k in range(1, 5)]
+        self.ik = [f"MCH-{base}.{k:02d}_ik{sfx}" for k in range(1, 4)]
+        self.ik_control = f"{base}_ik{sfx}"
+
+    def points(self):
+        hand = self.limb.points()[-1]
+        offset = Vector((0, (self.index - 1) * 0.02, 0))
+        step = Vector((self.limb.sign * 0.025, 0, -0.003))
+        return [hand + offset + step * k for k in range(5)]
+
+    def master_props(self):
+        return {
+            "IK_FK": 0.0,
+            "IK_parent": 0,
+            "finger_curve": 0.0,
+            "fk_master": self.master,
+            "fk_chain": self.fk,
+            "ik_chain": self.ik,
+            "ik_control": self.ik_control,
+            "constraint_bone": self.ik[-1],
+            "axis": "+X",
+            "ik_parentswitch_parentnames": ["None", "Hand"],
+        }
+
+
+def add_bone(ebones, name, head, tail, parent=None, connect=False):
+    bone = ebones.new(name)
+    bone.head = head
+    bone.tail = tail
+    if parent:
+        bone.parent = ebones[parent]
+        bone.use_connect = connect
+    return bone
+
+
+def build_bones(rig, limbs):
+    ebones = rig.data.edit_bones
+
+    add_bone(ebones, "root", (0, 0, 0), (0, 0.5, 0))
+    add_bone(ebones, "head", (0, 0, 1.6), (0, 0, 1.8), parent="root")
+
+    for limb in limbs:
+        pts = limb.points()
+        pole = pts[1] + limb.pole_offset()
+
+        add_bone(ebones, limb.settings, pts[0] + Vector((0, 0, 0.1)), pts[0] + Vector((0, 0, 0.2)), parent="root")
+
+        for i, name in enumerate(limb.fk):
+            add_bone(ebones, name, pts[i], pts[i + 1], parent=limb.fk[i - 1] if i else "root", connect=bool(i))
+
+        for i, name in enumerate(limb.ik):
+            add_bone(ebones, name, pts[i], pts[i + 1], parent=limb.ik[i - 1] if i else "root", connect=bool(i))
+
+        add_bone(ebones, limb.ctrl[1], pole, pole + Vector((0, 0, 0.05)), parent="root")
+        add_bone(ebones, limb.ctrl[2], pts[2], pts[3], parent="root")
+
+        if limb.heel:
+            add_bone(ebones, limb.heel, pts[3], pts[3] + Vector((0, 0.1, 0)), parent=limb.ctrl[2])
+
+        for finger in limb.fingers:
+            fpts = finger.points()
+            add_bone(ebones, finger.master, fpts[0], fpts[3], parent=limb.fk[-1])
+            add_bone(ebones, finger.ik_control, fpts[3], fpts[4], parent=limb.fk[-1])
+
+            for k, name in enumerate(finger.fk):
+                add_bone(ebones, name, fpts[k], fpts[k + 1], parent=finger.fk[k - 1] if k else limb.fk[-1], connect=bool(k))
+
+            for k, name in enumerate(finger.ik):
+                add_bone(ebones, name, fpts[k], fpts[k + 1], parent=finger.ik[k - 1] if k else limb.fk[-1], connect=bool(k))
+
+
+def setup_pose(rig, limbs):
+    pbones = rig.pose.bones
+
+    pbones["head"]["parent_names"] = ["None", "Root"]
+    pbones["head"]["parent_space"] = 0
+    pbones["head"].rotation_mode = 'XYZ'
+
+    for limb in limbs:
+        for key, value in limb.settings_props().items():
+            pbones[limb.settings][key] = value
+
+        for name in limb.fk:
+            pbones[name].rotation_mode = 'XYZ'
+
+        ik = pbones[limb.ik[1]].constraints.new('IK')
+        ik.target = rig
+        ik.subtarget = limb.ctrl[2]
+        ik.pole_target = rig
+        ik.pole_subtarget = limb.ctrl[1]
+        ik.pole_angle = -math.pi / 2
+        ik.chain_count = 2
+
+        copy = pbones[limb.ik[2]].constraints.new('COPY_ROTATION')
+        copy.target = rig
+        copy.subtarget = limb.ctrl[2]
+
+        if limb.heel:
+            pbones[limb.heel].rotation_mode = 'ZXY'
+
+        for finger in limb.fingers:
+            for key, value in finger.master_props().items():
+                pbones[finger.master][key] = value
+
+            for name in [finger.master, *finger.fk]:
+                pbones[name].rotation_mode = 'XYZ'
+
+            con = pbones[finger.ik[-1]].constraints.new('IK')
+            con.name = "FingerIK"
+            con.target = rig
+            con.subtarget = finger.ik_control
+            con.chain_count = len(finger.ik)
+
+
+def add_curve(action, data_path, index, group, frames, values):
+    curve = action.fcurves.new(data_path, index=index, action_group=group)
+    curve.keyframe_points.add(len(frames))
+    curve.keyframe_points.foreach_set("co", [v for key in zip(frames, values) for v in key])
+    curve.update()
+
+
+def wave(frames, amplitude, phase, base=0.0):
+    return [base + amplitude * math.sin(frame * 0.1 + phase) for frame in frames]
+
+
+def key_rig(rig, limbs, args):
+    action = bpy.data.actions.new("Bench-Action")
+    rig.animation_data_create().action = action
+
+    frames = list(range(1, args.frames + 1, max(1, args.key_step)))
+
+    def key_rotation(bone, amplitude, phase):
+        path = f'pose.bones["{bone}"].rotation_euler'
+        for i in range(3):
+            add_curve(action, path, i, bone, frames, wave(frames, amplitude, phase + i))
+
+    def key_location(bone, amplitude, phase):
+        path = f'pose.bones["{bone}"].location'
+        for i in range(3):
+            add_curve(action, path, i, bone, frames, wave(frames, amplitude, phase + i))
+
+    key_rotation("head", 0.2, 0.0)
+
+    for n, limb in enumerate(limbs):
+        for i, name in enumerate(limb.fk):
+            key_rotation(name, 0.3, n + i)
+
+        key_location(limb.ctrl[1], 0.05, n)
+        key_location(limb.ctrl[2], 0.1, n + 0.5)
+
+        path = f'pose.bones["{limb.ctrl[2]}"].rotation_quaternion'
+        add_curve(action, path, 0, limb.ctrl[2], frames, [1.0] * len(frames))
+        for i in range(1, 4):
+            add_curve(action, path, i, limb.ctrl[2], frames, wave(frames, 0.1, n + i))
+
+        path = f'pose.bones["{limb.settings}"]["IK_FK"]'
+        add_curve(action, path, 0, limb.settings, frames, [0.0] * len(frames))
+
+        for finger in limb.fingers:
+            key_rotation(finger.master, 0.2, n + finger.index)
+            for k, name in enumerate(finger.fk[:-1]):
+                key_rotation(name, 0.2, n + finger.index + k)
+            key_location(finger.ik_control, 0.01, n + finger.index)
+
+    return action
+
+
+def build_geometry(rig, args):
+    "Create the geometry collections of the rig and subdivided meshes deformed by it."
+    scene = bpy.context.scene
+    geo = bpy.data.collections.new(GEO_NAME + "-GEO")
+    scene.collection.children.link(geo)
+
+    for level in ("High", "Medium", "Low"):
+        geo.children.link(bpy.data.collections.new(f"{GEO_NAME}-GEO-{level}"))
+
+    meshes = []
+
+    for i in range(max(1, args.meshes)):
+        mesh = bpy.data.meshes.new(f"{GEO_NAME}-mesh-{i}")
+        size = 0.1
+        verts = [(x * size, y * size, z * size + i * 0.2) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)]
+        faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+        mesh.from_pydata(verts, [], faces)
+
+        obj = bpy.data.objects.new(f"{GEO_NAME}-body-{i}", mesh)
+        geo.children[f"{GEO_NAME}-GEO-High"].objects.link(obj)
+        obj.parent = rig
+
+        arm = obj.modifiers.new("Armature", 'ARMATURE')
+        arm.object = rig
+        subdiv = obj.modifiers.new("Subdivision", 'SUBSURF')
+        subdiv.levels = 3
+        obj.modifiers.new("mask_body", 'MASK')
+
+        meshes.append(obj.name)
+
+    return meshes
+
+
+def build_rig(args):
+    scene = bpy.context.scene
+
+    data = bpy.data.armatures.new(RIG_NAME)
+    data["rig_id"] = "benchmark"
+    data["is_toanimate_rig"] = True
+    data["rig_version"] = "benchmark"
+
+    rig = bpy.data.objects.new(RIG_NAME, data)
+    scene.collection.objects.link(rig)
+    bpy.context.view_layer.objects.active = rig
+    rig.select_set(True)
+
+    limbs = [LimbSpec(i) for i in range(args.limbs)]
+    for limb in limbs:
+        if limb.kind == 'arm':
+            limb.fingers = [FingerSpec(limb, j) for j in range(args.fingers)]
+
+    bpy.ops.object.mode_set(mode='EDIT')
+    build_bones(rig, limbs)
+    bpy.ops.object.mode_set(mode='POSE')
+
+    setup_pose(rig, limbs)
+    action = key_rig(rig, limbs, args)
+    meshes = build_geometry(rig, args)
+
+    scene.frame_start = 1
+    scene.frame_end = args.frames
+
+    return rig, limbs, action, meshes
+
+
+###########################
+## Operator benchmarking ##
+###########################
+
+def limb_snap_props(limb):
+    return dict(
+        output_bones=json.dumps(limb.fk), input_bones=json.dumps(limb.ik), ctrl_bones=json.dumps(limb.ctrl),
+    )
+
+
+def limb_ik2fk_props(limb):
+    return dict(
+        prop_bone=limb.settings, fk_bones=json.dumps(limb.fk), ik_bones=json.dumps(limb.ik),
+        ctrl_bones=json.dumps(limb.ctrl), tail_bones='[]', extra_ctrls=json.dumps(limb.extra),
+    )
+
+
+def finger_props(finger):
+    return dict(
+        fk_master=finger.master, fk_chain=json.dumps(finger.fk), ik_chain=json.dumps(finger.ik),
+        ik_control=finger.ik_control, constraint_bone=finger.ik[-1], axis="+X",
+    )
+
+
+def switch_parent_props(limb):
+    return dict(
+        bone=limb.ctrl[2], prop_bone=limb.settings, prop_id="IK_parent",
+        parent_names=json.dumps(["None", "Root"]), selected='0',
+    )
+
+
+def get_operator_cases(limbs, meshes):
+    "Returns a dictionary from operator idname to a list of (case name, props) pairs."
+    arms = [limb for limb in limbs if limb.kind == 'arm']
+    legs = [limb for limb in limbs if limb.kind == 'leg']
+    fingers = [finger for limb in arms for finger in limb.fingers]
+
+    cases = {
+        "rigify.get_frame_range": [("scene", {})],
+        "pose.rig_change_resolution": [(res, {"resolution": res}) for res in ("low", "high", "subdiv")],
+        "pose.rig_set_mask": [("body", {"objects": json.dumps(meshes), "mask": "mask_body"})],
+        "pose.rigify_batch_bake": [
+            ("all_ik2fk", {"direction": 'IK2FK'}),
+            ("all_fk2ik", {"direction": 'FK2IK'}),
+        ],
+    }
+
+    if arms:
+        arm = arms[0]
+        cases["pose.rigify_generic_snap"] = [("arm_fk2ik", limb_snap_props(arm))]
+        cases["pose.rigify_generic_snap_bake"] = [("arm_fk2ik", limb_snap_props(arm))]
+        cases["pose.rigify_limb_ik2fk"] = [("arm", limb_ik2fk_props(arm))]
+        cases["pose.rigify_limb_ik2fk_bake"] = [("arm", limb_ik2fk_props(arm))]
+        cases["pose.rigify_switch_parent"] = [("arm_ik", switch_parent_props(arm))]
+        cases["pose.rigify_switch_parent_bake"] = [("arm_ik", switch_parent_props(arm))]
+        cases["pose.rigify_clear_keyframes"] = [("arm_fk", {"bones": json.dumps(arm.fk)})]
+
+        if len(arms) > 1:
+            cases["pose.rigify_limb_ik2fk"].append(("arm_no_pole", limb_ik2fk_props(arms[1])))
+            cases["pose.rigify_limb_ik2fk_bake"].append(("arm_no_pole", limb_ik2fk_props(arms[1])))
+
+    if legs:
+        leg = legs[0]
+        leg_roll = dict(limb_ik2fk_props(leg), heel_control=leg.heel)
+        cases.setdefault("pose.rigify_limb_ik2fk_bake", []).append(("leg", limb_ik2fk_props(leg)))
+        cases["pose.rigify_leg_roll_ik2fk"] = [("leg", leg_roll)]
+        cases["pose.rigify_leg_roll_ik2fk_bake"] = [("leg", leg_roll)]
+
+    if fingers:
+        cases["pose.rigify_finger_fk2ik"] = [("finger", finger_props(fingers[0]))]
+        cases["pose.rigify_finger_fk2ik_bake"] = [("finger", finger_props(fingers[0]))]
+
+    return cases
+
+
+class BenchState:
+    "Restores the rig to the pristine keyed state between runs."
+
+    def __init__(self, rig, action, limbs, ui_panel):
+        self.rig = rig
+        self.ui_panel = ui_panel
+        self.pristine = action.copy()
+        self.pristine.use_fake_user = True
+        self.settings_props = {
+            limb.settings: dict(IK_parent=0, pole_parent=0) for limb in limbs
+        }
+
+    def reset(self, frame):
+        rig = self.rig
+        old = rig.animation_data.action
+        rig.animation_data.action = self.pristine.copy()
+        bpy.data.actions.remove(old)
+        self.ui_panel.invalidate_curve_tables()
+
+        for bone in rig.pose.bones:
+            bone.matrix_basis = Matrix.Identity(4)
+
+        for name, props in self.settings_props.items():
+            for key, value in props.items():
+                rig.pose.bones[name][key] = value
+
+        bpy.context.scene.frame_set(frame)
+
+
+def get_operator(idname):
+    category, name = idname.split(".")
+    return getattr(getattr(bpy.ops, category), name)
+
+
+def run_operator_case(state, idname, props, args, ui_panel):
+    rig = state.rig
+    context = bpy.context
+    op = get_operator(idname)
+    times = []
+    counters = None
+
+    for _ in range(args.repeat):
+        state.reset(args.frames // 2)
+        history = len(ui_panel.bake_profile_history)
+
+        with context.temp_override(active_object=rig, object=rig, selected_objects=[rig]):
+            start = time.perf_counter()
+            result = op('EXEC_DEFAULT', **props)
+            times.append(time.perf_counter() - start)
+
+        if 'FINISHED' not in result:
+            return {"error": f"operator returned {sorted(result)}"}
+
+        if len(ui_panel.bake_profile_history) > history:
+            counters = ui_panel.bake_profile_history[-1]["counters"]
+
+    result = {
+        "median": statistics.median(times),
+        "min": min(times),
+        "runs": times,
+    }
+    if counters is not None:
+        result["counters"] = counters
+    return result
+
+
+class NullLayout:
+    "Stand-in for UILayout that accepts and ignores all drawing calls."
+
+    def __getattr__(self, name):
+        return self.ignore
+
+    def __setattr__(self, name, value):
+        pass
+
+    def ignore(self, *args, **kwargs):
+        return self
+
+
+def run_panel_case(rig, bone_name, args, panel_class, before_draw=None):
+    context = bpy.context
+    panel = types.SimpleNamespace(layout=NullLayout())
+    bone = rig.pose.bones[bone_name]
+    times = []
+
+    with context.temp_override(active_object=rig, object=rig, active_pose_bone=bone):
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for _ in range(10):
+                if before_draw:
+                    before_draw()
+                panel_class.draw(panel, bpy.context)
+            times.append((time.perf_counter() - start) / 10)
+
+    return {"median": statistics.median(times), "min": min(times), "runs": times}
+
+
+def run_benchmarks(args):
+    addon = load_addon()
+    ui_panel = sys.modules[ADDON_NAME + ".ui_panel"]
+
+    rig, limbs, action, meshes = build_rig(args)
+    state = BenchState(rig, action, limbs, ui_panel)
+
+    wm = bpy.context.window_manager
+    wm.rigify_transfer_profile = True
+    wm.rigify_transfer_use_modal = False
+
+    cases = get_operator_cases(limbs, meshes)
+    results = {}
+
+    def selected(name):
+        return args.only in name
+
+    for cls in sorted(addon.class_list, key=lambda cls: cls.__name__):
+        if issubclass(cls, bpy.types.Panel):
+            panel_bones = [("root", "root"), ("head", "head")]
+            if limbs:
+                panel_bones.append(("settings", limbs[0].settings))
+            fingers = [finger for limb in limbs for finger in limb.fingers]
+            if fingers:
+                panel_bones.append(("finger", fingers[0].master))
+
+            for case, bone_name in panel_bones:
+                name = f"draw:{cls.__name__}:{case}"
+                if selected(name):
+                    print("Running", name, file=sys.stderr)
+                    results[name] = run_panel_case(rig, bone_name, args, cls)
+
+                # The same draw with the cached layout plans dropped before every redraw
+                name += ":uncached"
+                if cls is ui_panel.VIEW3D_PT_TORigUI and selected(name):
+                    print("Running", name, file=sys.stderr)
+                    results[name] = run_panel_case(
+                        rig, bone_name, args, cls, before_draw=ui_panel.invalidate_panel_layout_plans
+                    )
+            continue
+
+        idname = getattr(cls, "bl_idname", None)
+        if not issubclass(cls, bpy.types.Operator):
+            continue
+
+        if idname in SKIPPED_OPERATORS or idname not in cases:
+            name = f"op:{idname}"
+            if selected(name):
+                results[name] = {"skipped": SKIPPED_OPERATORS.get(idname, "no synthetic setup")}
+            continue
+
+        for case, props in cases[idname]:
+            name = f"op:{idname}:{case}"
+            if not selected(name):
+                continue
+
+            print("Running", name, file=sys.stderr)
+            try:
+                results[name] = run_operator_case(state, idname, props, args, ui_panel)
+            except Exception as e:
+                results[name] = {"error": str(e)}
+
+    return results
+
+
+#########################
+## Baseline comparison ##
+#########################
+
+def compare_with_baseline(results, baseline, threshold):
+    rows = []
+
+    for name, result in sorted(results.items()):
+        old = baseline.get("results", {}).get(name)
+        if not old or "median" not in old or "median" not in result:
+            continue
+
+        ratio = result["median"] / max(old["median"], 1e-12)
+        rows.append({
+            "name": name,
+            "baseline": old["median"],
+            "current": result["median"],
+            "ratio": ratio,
+            "regression": ratio > 1 + threshold,
+        })
+
+    return rows
+
+
+def print_comparison(rows):
+    width = max((len(row["name"]) for row in rows), default=10)
+
+    print(f"{'benchmark':<{width}}  {'baseline':>10}  {'current':>10}  {'ratio':>7}", file=sys.stderr)
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(
+            f"{row['name']:<{width}}  {row['baseline'] * 1000:>8.2f}ms  {row['current'] * 1000:>8.2f}ms  "
+            f"{row['ratio']:>6.2f}x{flag}",
+            file=sys.stderr,
+        )
+
+
+def main():
+    args = parse_args()
+    config = {key: getattr(args, key) for key in ("limbs", "fingers", "frames", "key_step", "meshes", "repeat")}
+
+    output = {
+        "blender": bpy.app.version_string,
+        "config": config,
+        "results": run_benchmarks(args),
+    }
+
+    status = 0
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+
+        if baseline.get("config") != config:
+            print(
+                "Warning: the baseline was recorded with a different configuration:", baseline.get("config"),
+                file=sys.stderr,
+            )
+
+        rows = compare_with_baseline(output["results"], baseline, args.threshold)
+        output["comparison"] = rows
+        print_comparison(rows)
+
+        if args.fail_on_regression and any(row["regression"] for row in rows):
+            status = 1
+
+    text = json.dumps(output, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(text)
+    else:
+        print(text)
+
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,229 @@
 import bpy
+import numpy as np
+
+from .ui_panel import (
+    get_action_curve_table, get_bone_structure_serial,
+    can_nest_bone_collections, get_visibility_set, has_visibility_sets, setup_visibility_sets,
+)
+
+# Sculptor bones and geometry toggled by the buttons of the Lil Max panel. Other cartoony rigs
+# can store their own tables in the "sculptor_groups" and "geometry_groups" custom properties
+# of the armature data, mapping each group name to a list of bone or object names.
+LIL_MAX_SCULPTOR_GROUPS = {
+    'left_thumb': [
+        'thumb_deformer_01.L', 'thumb_deformer_03.L', 'thumb_deformer_05.L', 'thumb_deformer_07.L',
+        'thumb_deformer_02.L', 'thumb_deformer_04.L', 'thumb_deformer_06.L', 'thumb_deformer_08.L',
+    ],
+    'left_index_f': [
+        'f_index_deformer_01.L', 'f_index_deformer_04.L', 'f_index_deformer_07.L', 'f_index_deformer_010.L',
+        'f_index_deformer_02.L', 'f_index_deformer_05.L', 'f_index_deformer_08.L', 'f_index_deformer_011.L',
+        'f_index_deformer_03.L', 'f_index_deformer_06.L', 'f_index_deformer_09.L', 'f_index_deformer_012.L',
+    ],
+    'left_middle_f': [
+        'f_middle_deformer_01.L', 'f_middle_deformer_04.L', 'f_middle_deformer_07.L',
+        'f_middle_deformer_010.L', 'f_middle_deformer_02.L', 'f_middle_deformer_05.L',
+        'f_middle_deformer_08.L', 'f_middle_deformer_011.L', 'f_middle_deformer_03.L',
+        'f_middle_deformer_06.L', 'f_middle_deformer_09.L', 'f_middle_deformer_012.L',
+    ],
+    'left_pinky_f': [
+        'f_pinky_deformer_01.L', 'f_pinky_deformer_04.L', 'f_pinky_deformer_07.L', 'f_pinky_deformer_010.L',
+        'f_pinky_deformer_02.L', 'f_pinky_deformer_05.L', 'f_pinky_deformer_08.L', 'f_pinky_deformer_011.L',
+        'f_pinky_deformer_03.L', 'f_pinky_deformer_06.L', 'f_pinky_deformer_09.L', 'f_pinky_deformer_012.L',
+    ],
+    'right_thumb': [
+        'thumb_deformer_01.R', 'thumb_deformer_03.R', 'thumb_deformer_05.R', 'thumb_deformer_07.R',
+        'thumb_deformer_02.R', 'thumb_deformer_04.R', 'thumb_deformer_06.R', 'thumb_deformer_08.R',
+    ],
+    'right_index_f': [
+        'f_index_deformer_01.R', 'f_index_deformer_04.R', 'f_index_deformer_07.R', 'f_index_deformer_010.R',
+        'f_index_deformer_02.R', 'f_index_deformer_05.R', 'f_index_deformer_08.R', 'f_index_deformer_011.R',
+        'f_index_deformer_03.R', 'f_index_deformer_06.R', 'f_index_deformer_09.R', 'f_index_deformer_012.R',
+    ],
+    'right_middle_f': [
+        'f_middle_deformer_01.R', 'f_middle_deformer_04.R', 'f_middle_deformer_07.R',
+        'f_middle_deformer_010.R', 'f_middle_deformer_02.R', 'f_middle_deformer_05.R',
+        'f_middle_deformer_08.R', 'f_middle_deformer_011.R', 'f_middle_deformer_03.R',
+        'f_middle_deformer_06.R', 'f_middle_deformer_09.R', 'f_middle_deformer_012.R',
+    ],
+    'right_pinky_f': [
+        'f_pinky_deformer_01.R', 'f_pinky_deformer_04.R', 'f_pinky_deformer_07.R', 'f_pinky_deformer_010.R',
+        'f_pinky_deformer_02.R', 'f_pinky_deformer_05.R', 'f_pinky_deformer_08.R', 'f_pinky_deformer_011.R',
+        'f_pinky_deformer_03.R', 'f_pinky_deformer_06.R', 'f_pinky_deformer_09.R', 'f_pinky_deformer_012.R',
+    ],
+    'head': [
+        'head_deformer_02.L', 'head_deformer_02_mid', 'head_deformer_07_mid', 'head_deformer_06.L',
+        'head_deformer_09.L', 'head_deformer_02.R', 'head_deformer_06.R', 'head_deformer_09.R',
+        'head_deformer_03_mid', 'head_deformer_04_mid', 'head_deformer_05_mid', 'head_deformer_06_mid',
+        'head_deformer_03.L', 'head_deformer_04.L', 'head_deformer_07.L', 'head_deformer_10.L',
+        'head_deformer_03.R', 'head_deformer_04.R', 'head_deformer_07.R', 'head_deformer_10.R',
+        'head_deformer_01_mid', 'head_deformer_08_mid', 'head_deformer_01.L', 'head_deformer_05.L',
+        'head_deformer_08.L', 'head_deformer_01.R', 'head_deformer_05.R', 'head_deformer_08.R',
+        'head_deformer_11_mid', 'head_deformer_10_mid', 'head_deformer_09_mid', 'head_deformer_11.L',
+        'head_deformer_12.L', 'head_deformer_13.L', 'head_deformer_11.R', 'head_deformer_12.R',
+        'head_deformer_13.R',
+    ],
+    'torso': [
+        'torso_deformer_01.L', 'torso_deformer_04_mid', 'torso_deformer_01_mid', 'torso_deformer_01.R',
+        'torso_deformer_02.L', 'torso_deformer_05_mid', 'torso_deformer_02_mid', 'torso_deformer_02.R',
+        'torso_deformer_03.L', 'torso_deformer_06_mid', 'torso_deformer_03_mid', 'torso_deformer_03.R',
+    ],
+    'right_arm': [
+        'arm_deformer_05.R', 'arm_deformer_010.R', 'arm_deformer_015.R', 'arm_deformer_020.R',
+        'arm_deformer_04.R', 'arm_deformer_09.R', 'arm_deformer_014.R', 'arm_deformer_019.R',
+        'arm_deformer_03.R', 'arm_deformer_08.R', 'arm_deformer_013.R', 'arm_deformer_018.R',
+        'arm_deformer_02.R', 'arm_deformer_07.R', 'arm_deformer_012.R', 'arm_deformer_017.R',
+        'arm_deformer_01.R', 'arm_deformer_06.R', 'arm_deformer_011.R', 'arm_deformer_016.R',
+    ],
+    'left_arm': [
+        'arm_deformer_01.L', 'arm_deformer_06.L', 'arm_deformer_011.L', 'arm_deformer_016.L',
+        'arm_deformer_02.L', 'arm_deformer_07.L', 'arm_deformer_012.L', 'arm_deformer_017.L',
+        'arm_deformer_03.L', 'arm_deformer_08.L', 'arm_deformer_013.L', 'arm_deformer_018.L',
+        'arm_deformer_05.L', 'arm_deformer_010.L', 'arm_deformer_015.L', 'arm_deformer_020.L',
+        'arm_deformer_04.L', 'arm_deformer_09.L', 'arm_deformer_014.L', 'arm_deformer_019.L',
+    ],
+    'right_leg': [
+        'foot_deformer_012.R', 'foot_deformer_013.R', 'foot_deformer_014.R', 'foot_deformer_015.R',
+        'foot_deformer_07.R', 'foot_deformer_09.R', 'foot_deformer_010.R', 'foot_deformer_011.R',
+        'foot_deformer_01.R', 'foot_deformer_02.R', 'foot_deformer_03.R', 'foot_deformer_04.R',
+        'leg_deformer_013.R', 'leg_deformer_014.R', 'leg_deformer_015.R', 'leg_deformer_016.R',
+        'foot_deformer_05.R', 'foot_deformer_06.R', 'foot_deformer_08.R', 'leg_deformer_09.R',
+        'leg_deformer_010.R', 'leg_deformer_011.R', 'leg_deformer_012.R', 'leg_deformer_05.R',
+        'leg_deformer_06.R', 'leg_deformer_07.R', 'leg_deformer_08.R', 'leg_deformer_01.R',
+        'leg_deformer_02.R', 'leg_deformer_03.R', 'leg_deformer_04.R',
+    ],
+    'left_leg': [
+        'leg_deformer_01.L', 'leg_deformer_02.L', 'leg_deformer_03.L', 'leg_deformer_04.L',
+        'leg_deformer_05.L', 'leg_deformer_06.L', 'leg_deformer_07.L', 'leg_deformer_08.L',
+        'leg_deformer_013.L', 'leg_deformer_014.L', 'leg_deformer_015.L', 'leg_deformer_016.L',
+        'foot_deformer_012.L', 'foot_deformer_013.L', 'foot_deformer_014.L', 'foot_deformer_015.L',
+        'foot_deformer_07.L', 'foot_deformer_09.L', 'foot_deformer_010.L', 'foot_deformer_011.L',
+        'foot_deformer_01.L', 'foot_deformer_02.L', 'foot_deformer_03.L', 'foot_deformer_04.L',
+        'foot_deformer_05.L', 'foot_deformer_06.L', 'foot_deformer_08.L', 'leg_deformer_09.L',
+        'leg_deformer_010.L', 'leg_deformer_011.L', 'leg_deformer_012.L',
+    ],
+    'left_hand_stretch': [
+        'hand_stretch_base.L', 'hand_stretch_end.L',
+    ],
+    'right_hand_stretch': [
+        'hand_stretch_base.R', 'hand_stretch_end.R',
+    ],
+    'head_tweakers': [
+        'head_deformer_03_mid', 'head_deformer_04_mid', 'head_deformer_05_mid', 'head_deformer_06_mid',
+        'head_deformer_03.L', 'head_deformer_04.L', 'head_deformer_07.L', 'head_deformer_10.L',
+        'head_deformer_03.R', 'head_deformer_04.R', 'head_deformer_07.R', 'head_deformer_10.R',
+        'head_deformer_02.L', 'head_deformer_02_mid', 'head_deformer_07_mid', 'head_deformer_06.L',
+        'head_deformer_09.L', 'head_deformer_02.R', 'head_deformer_06.R', 'head_deformer_09.R',
+        'head_deformer_01_mid', 'head_deformer_08_mid', 'head_deformer_01.L', 'head_deformer_05.L',
+        'head_deformer_08.L', 'head_deformer_01.R', 'head_deformer_05.R', 'head_deformer_08.R',
+        'head_deformer_11_mid', 'head_deformer_10_mid', 'head_deformer_09_mid', 'head_deformer_11.L',
+        'head_deformer_12.L', 'head_deformer_13.L', 'head_deformer_11.R', 'head_deformer_12.R',
+        'head_deformer_13.R',
+    ],
+}
+
+LIL_MAX_GEOMETRY_GROUPS = {
+    'left_leg': [
+        'mc_shorts_geo.L', 'mc_legs_geo.L', 'mc_shoe_geo.L', 'mc_shoe_logo_geo.L', 'mc_shoe_geo_multiple.L',
+        'mc_legs_geo_multiple1.L', 'mc_shorts_geo_multiple1.L', 'mc_shoe_logo_geo_multiple1.L',
+        'mc_shoe_geo_multiple2.L', 'mc_shoe_logo_geo_multiple2.L', 'mc_legs_geo_multiple2.L',
+        'mc_shorts_geo_multiple2.L',
+    ],
+    'right_leg': [
+        'mc_shorts_geo.R', 'mc_legs_geo.R', 'mc_shoe_geo.R', 'mc_shoe_logo_geo.R', 'mc_legs_geo_multiple1.R',
+        'mc_shoe_geo_multiple.R', 'mc_shorts_geo_multiple1.R', 'mc_legs_geo_multiple2.R',
+        'mc_shoe_geo_multiple2.R', 'mc_shorts_geo_multiple2.R', 'mc_shoe_logo_geo_multiple1.R',
+        'mc_shoe_logo_geo_multiple2.R',
+    ],
+    'left_arm': [
+        'mc_arms_geo.L', 'mc_hands_geo.L', 'mc_hand_detail_geo.L', 'mc_arms_geo_multiple1.L',
+        'mc_hand_detail_geo_multiple1.L', 'mc_hands_geo_multiple1.L', 'mc_arms_geo_multiple2.L',
+        'mc_hand_detail_geo_multiple2.L', 'mc_hands_geo_multiple2.L',
+    ],
+    'right_arm': [
+        'mc_arms_geo.R', 'mc_hands_geo.R', 'mc_hand_detail_geo.R', 'mc_arms_geo_multiple2.R',
+        'mc_hands_geo_multiple2.R', 'mc_hand_detail_geo_multiple2.R', 'mc_arms_geo_multiple1.R',
+        'mc_hands_geo_multiple1.R', 'mc_hand_detail_geo_multiple1.R',
+    ],
+    'torso': [
+        'mc_torso_geo', 'mc_torso_detail_geo', 'mc_neck_geo',
+    ],
+    'head': [
+        'mc_head_base_open_mouth_geo', 'mc_lower_teeth_geo', 'mc_upper_teeth_geo', 'mc_tongue_geo',
+        'mc_nose_geo', 'mc_ears_geo.L', 'mc_ears_geo.R', 'mc_eyes_geo.L', 'mc_eyes_geo.R', 'mc_brows_geo',
+        'mc_hair_side_geo', 'mc_hair_top_geo', 'mc_head_base_closed_mouth_geo', 'mc_mouth_closed',
+        'mc_freckles_geo',
+    ],
+}
+
+# Finger sculptor buttons of the panel: text and group name without the side
+FINGER_SCULPTOR_BUTTONS = [('Thumb', 'thumb'), ('Index', 'index_f'), ('Middle', 'middle_f'), ('Pinky', 'pinky_f')]
+
+def get_group_names(armature, prop, defaults, group):
+    "Returns the names in the group from the table stored on the armature, or the default table."
+    table = armature.get(prop)
+    names = table.get(group) if table is not None else defaults.get(group)
+    if names is None:
+        raise KeyError(f"Unknown group '{group}'")
+    return list(names)
+
+# Resolved bone groups, keyed by the armature pointer and the group name
+_group_indices = {}
+
+def get_group_indices(key, items, names):
+    """Resolve the names into an array of indices into the bone collection, skipping missing
+    ones, and cache it until the bones or the names change. Returns (names, indices)."""
+    fingerprint = (get_bone_structure_serial(), len(items), names)
+    entry = _group_indices.get(key)
+
+    if entry is None or entry[0] != fingerprint:
+        found = [(name, items.find(name)) for name in dict.fromkeys(names)]
+        found = [(name, index) for name, index in found if index >= 0]
+        entry = _group_indices[key] = (
+            fingerprint, [name for name, _ in found], np.array([index for _, index in found], dtype=np.int64)
+        )
+
+    return entry[1], entry[2]
+
+def toggle_bone_group(bones, coll, indices, shown=None, *, deselect=False):
+    """Toggle a group of bones, living in the managed collection coll if it has been set up
+    (otherwise None). If the collection is hidden or any of the shown bones (all of the group
+    by default) has its hide flag set, show and select the shown bones, hiding the rest of the
+    group with their flags; otherwise hide the shown bones, which is a single collection write
+    when they are the whole group. Flags are read and written for all bones in one batch."""
+    if shown is None:
+        shown = indices
+
+    coll_visible = coll is None or coll.is_visible
+
+    hide = np.empty(len(bones), dtype=bool)
+    bones.foreach_get('hide', hide)
+    hidden = not coll_visible or bool(hide[shown].any())
+
+    if hidden:
+        if deselect:
+            bpy.ops.pose.select_all(action='DESELECT')
+
+        new_hide = hide.copy()
+        if not coll_visible:
+            new_hide[indices] = True
+        new_hide[shown] = False
+        if (new_hide != hide).any():
+            bones.foreach_set('hide', new_hide)
+        if not coll_visible:
+            coll.is_visible = True
+
+        select = np.empty(len(bones), dtype=bool)
+        bones.foreach_get('select', select)
+        select[shown] = True
+        bones.foreach_set('select', select)
+
+    elif coll is not None and len(shown) == len(indices):
+        coll.is_visible = False
+
+    else:
+        hide[shown] = True
+        bones.foreach_set('hide', hide)
+
 
 class POSE_OT_MaxCartoonyToggleVisibility(bpy.types.Operator):
     """Lil MaxToggle Visibility"""
@@ -10,381 +235,81 @@ class POSE_OT_MaxCartoonyToggleVisibility(bpy.types.Operator):
     keyed_only: bpy.props.BoolProperty(default=True)
     
     def execute(self,context):
-        
-        if self.hide_bones == "left_thumb":
-            bones = ['thumb_deformer_01.L', 
-                    'thumb_deformer_03.L', 
-                    'thumb_deformer_05.L', 
-                    'thumb_deformer_07.L', 
-                    'thumb_deformer_02.L', 
-                    'thumb_deformer_04.L', 
-                    'thumb_deformer_06.L', 
-                    'thumb_deformer_08.L']
-        
-        elif self.hide_bones == "left_index_f":
-            bones = ['f_index_deformer_01.L', 
-                     'f_index_deformer_04.L', 
-                     'f_index_deformer_07.L', 
-                     'f_index_deformer_010.L', 
-                     'f_index_deformer_02.L', 
-                     'f_index_deformer_05.L', 
-                     'f_index_deformer_08.L', 
-                     'f_index_deformer_011.L', 
-                     'f_index_deformer_03.L', 
-                     'f_index_deformer_06.L', 
-                     'f_index_deformer_09.L', 
-                     'f_index_deformer_012.L']
-        
-        elif self.hide_bones == "left_middle_f":
-            bones = ['f_middle_deformer_01.L',
-                     'f_middle_deformer_04.L', 
-                     'f_middle_deformer_07.L', 
-                     'f_middle_deformer_010.L', 
-                     'f_middle_deformer_02.L', 
-                     'f_middle_deformer_05.L', 
-                     'f_middle_deformer_08.L', 
-                     'f_middle_deformer_011.L', 
-                     'f_middle_deformer_03.L', 
-                     'f_middle_deformer_06.L', 
-                     'f_middle_deformer_09.L', 
-                     'f_middle_deformer_012.L']
-            
-        elif self.hide_bones == "left_pinky_f":
-            bones = ['f_pinky_deformer_01.L',
-                     'f_pinky_deformer_04.L', 
-                     'f_pinky_deformer_07.L', 
-                     'f_pinky_deformer_010.L', 
-                     'f_pinky_deformer_02.L', 
-                     'f_pinky_deformer_05.L', 
-                     'f_pinky_deformer_08.L', 
-                     'f_pinky_deformer_011.L', 
-                     'f_pinky_deformer_03.L', 
-                     'f_pinky_deformer_06.L', 
-                     'f_pinky_deformer_09.L', 
-                     'f_pinky_deformer_012.L']
-        
-        elif self.hide_bones == "right_thumb":
-            bones = ['thumb_deformer_01.R',
-                     'thumb_deformer_03.R', 
-                     'thumb_deformer_05.R', 
-                     'thumb_deformer_07.R', 
-                     'thumb_deformer_02.R',
-                     'thumb_deformer_04.R', 
-                     'thumb_deformer_06.R', 
-                     'thumb_deformer_08.R']
-        
-        elif self.hide_bones == "right_index_f":
-            bones = ['f_index_deformer_01.R',
-                     'f_index_deformer_04.R', 
-                     'f_index_deformer_07.R', 
-                     'f_index_deformer_010.R', 
-                     'f_index_deformer_02.R', 
-                     'f_index_deformer_05.R', 
-                     'f_index_deformer_08.R', 
-                     'f_index_deformer_011.R', 
-                     'f_index_deformer_03.R', 
-                     'f_index_deformer_06.R', 
-                     'f_index_deformer_09.R', 
-                     'f_index_deformer_012.R']
-        
-        elif self.hide_bones == "right_middle_f":
-            bones = ['f_middle_deformer_01.R',
-                     'f_middle_deformer_04.R', 
-                     'f_middle_deformer_07.R', 
-                     'f_middle_deformer_010.R', 
-                     'f_middle_deformer_02.R', 
-                     'f_middle_deformer_05.R', 
-                     'f_middle_deformer_08.R', 
-                     'f_middle_deformer_011.R', 
-                     'f_middle_deformer_03.R', 
-                     'f_middle_deformer_06.R', 
-                     'f_middle_deformer_09.R', 
-                     'f_middle_deformer_012.R']
-        
-        elif self.hide_bones == "right_pinky_f":
-            bones = ['f_pinky_deformer_01.R',
-                     'f_pinky_deformer_04.R', 
-                     'f_pinky_deformer_07.R', 
-                     'f_pinky_deformer_010.R', 
-                     'f_pinky_deformer_02.R', 
-                     'f_pinky_deformer_05.R', 
-                     'f_pinky_deformer_08.R', 
-                     'f_pinky_deformer_011.R', 
-                     'f_pinky_deformer_03.R', 
-                     'f_pinky_deformer_06.R', 
-                     'f_pinky_deformer_09.R', 
-                     'f_pinky_deformer_012.R']
-                     
-        elif self.hide_bones == "head":
-            bones = ['head_deformer_02.L',
-                     'head_deformer_02_mid', 
-                     'head_deformer_07_mid', 
-                     'head_deformer_06.L', 
-                     'head_deformer_09.L', 
-                     'head_deformer_02.R', 
-                     'head_deformer_06.R', 
-                     'head_deformer_09.R', 
-                     'head_deformer_03_mid', 
-                     'head_deformer_04_mid', 
-                     'head_deformer_05_mid', 
-                     'head_deformer_06_mid', 
-                     'head_deformer_03.L', 
-                     'head_deformer_04.L', 
-                     'head_deformer_07.L', 
-                     'head_deformer_10.L', 
-                     'head_deformer_03.R', 
-                     'head_deformer_04.R', 
-                     'head_deformer_07.R', 
-                     'head_deformer_10.R', 
-                     'head_deformer_01_mid', 
-                     'head_deformer_08_mid', 
-                     'head_deformer_01.L', 
-                     'head_deformer_05.L', 
-                     'head_deformer_08.L', 
-                     'head_deformer_01.R', 
-                     'head_deformer_05.R', 
-                     'head_deformer_08.R', 
-                     'head_deformer_11_mid', 
-                     'head_deformer_10_mid', 
-                     'head_deformer_09_mid', 
-                     'head_deformer_11.L', 
-                     'head_deformer_12.L', 
-                     'head_deformer_13.L', 
-                     'head_deformer_11.R', 
-                     'head_deformer_12.R', 
-                     'head_deformer_13.R']
-
-        elif self.hide_bones == "torso":
-            bones = ['torso_deformer_01.L',
-                     'torso_deformer_04_mid', 
-                     'torso_deformer_01_mid', 
-                     'torso_deformer_01.R', 
-                     'torso_deformer_02.L', 
-                     'torso_deformer_05_mid', 
-                     'torso_deformer_02_mid', 
-                     'torso_deformer_02.R', 
-                     'torso_deformer_03.L', 
-                     'torso_deformer_06_mid', 
-                     'torso_deformer_03_mid', 
-                     'torso_deformer_03.R']
-        
-        elif self.hide_bones == "right_arm":
-            bones = ['arm_deformer_05.R',
-                     'arm_deformer_010.R', 
-                     'arm_deformer_015.R', 
-                     'arm_deformer_020.R', 
-                     'arm_deformer_04.R', 
-                     'arm_deformer_09.R', 
-                     'arm_deformer_014.R', 
-                     'arm_deformer_019.R', 
-                     'arm_deformer_03.R', 
-                     'arm_deformer_08.R', 
-                     'arm_deformer_013.R', 
-                     'arm_deformer_018.R', 
-                     'arm_deformer_02.R', 
-                     'arm_deformer_07.R', 
-                     'arm_deformer_012.R', 
-                     'arm_deformer_017.R', 
-                     'arm_deformer_01.R', 
-                     'arm_deformer_06.R', 
-                     'arm_deformer_011.R', 
-                     'arm_deformer_016.R']
-
-        elif self.hide_bones == "left_arm":
-            bones = ['arm_deformer_01.L',
-                     'arm_deformer_06.L', 
-                     'arm_deformer_011.L', 
-                     'arm_deformer_016.L', 
-                     'arm_deformer_02.L', 
-                     'arm_deformer_07.L', 
-                     'arm_deformer_012.L', 
-                     'arm_deformer_017.L', 
-                     'arm_deformer_03.L', 
-                     'arm_deformer_08.L', 
-                     'arm_deformer_013.L', 
-                     'arm_deformer_018.L', 
-                     'arm_deformer_05.L', 
-                     'arm_deformer_010.L', 
-                     'arm_deformer_015.L', 
-                     'arm_deformer_020.L', 
-                     'arm_deformer_04.L', 
-                     'arm_deformer_09.L', 
-                     'arm_deformer_014.L', 
-                     'arm_deformer_019.L']
-
-        elif self.hide_bones == "right_leg":
-            bones = ['foot_deformer_012.R',
-                     'foot_deformer_013.R', 
-                     'foot_deformer_014.R', 
-                     'foot_deformer_015.R', 
-                     'foot_deformer_07.R', 
-                     'foot_deformer_09.R', 
-                     'foot_deformer_010.R', 
-                     'foot_deformer_011.R', 
-                     'foot_deformer_01.R', 
-                     'foot_deformer_02.R', 
-                     'foot_deformer_03.R', 
-                     'foot_deformer_04.R', 
-                     'leg_deformer_013.R', 
-                     'leg_deformer_014.R', 
-                     'leg_deformer_015.R', 
-                     'leg_deformer_016.R', 
-                     'foot_deformer_05.R', 
-                     'foot_deformer_06.R', 
-                     'foot_deformer_08.R', 
-                     'leg_deformer_09.R', 
-                     'leg_deformer_010.R', 
-                     'leg_deformer_011.R', 
-                     'leg_deformer_012.R', 
-                     'leg_deformer_05.R', 
-                     'leg_deformer_06.R', 
-                     'leg_deformer_07.R', 
-                     'leg_deformer_08.R', 
-                     'leg_deformer_01.R', 
-                     'leg_deformer_02.R', 
-                     'leg_deformer_03.R', 
-                     'leg_deformer_04.R']
-        
-        elif self.hide_bones == "left_leg":
-            bones = ['leg_deformer_01.L',
-                     'leg_deformer_02.L', 
-                     'leg_deformer_03.L', 
-                     'leg_deformer_04.L', 
-                     'leg_deformer_05.L', 
-                     'leg_deformer_06.L', 
-                     'leg_deformer_07.L', 
-                     'leg_deformer_08.L', 
-                     'leg_deformer_013.L', 
-                     'leg_deformer_014.L', 
-                     'leg_deformer_015.L', 
-                     'leg_deformer_016.L', 
-                     'foot_deformer_012.L', 
-                     'foot_deformer_013.L', 
-                     'foot_deformer_014.L', 
-                     'foot_deformer_015.L', 
-                     'foot_deformer_07.L', 
-                     'foot_deformer_09.L', 
-                     'foot_deformer_010.L',
-                     'foot_deformer_011.L', 
-                     'foot_deformer_01.L', 
-                     'foot_deformer_02.L', 
-                     'foot_deformer_03.L', 
-                     'foot_deformer_04.L', 
-                     'foot_deformer_05.L', 
-                     'foot_deformer_06.L', 
-                     'foot_deformer_08.L', 
-                     'leg_deformer_09.L', 
-                     'leg_deformer_010.L', 
-                     'leg_deformer_011.L', 
-                     'leg_deformer_012.L']
-                     
-        elif self.hide_bones == "left_hand_stretch":
-            bones = ['hand_stretch_base.L', 'hand_stretch_end.L']
-        
-        elif self.hide_bones == "right_hand_stretch":
-            bones = ['hand_stretch_base.R', 'hand_stretch_end.R']
-            
-        elif self.hide_bones == "head_tweakers":
-            bones = ['head_deformer_03_mid', 'head_deformer_04_mid', 'head_deformer_05_mid', 'head_deformer_06_mid', 'head_deformer_03.L', 'head_deformer_04.L', 'head_deformer_07.L', 'head_deformer_10.L', 'head_deformer_03.R', 'head_deformer_04.R', 'head_deformer_07.R', 'head_deformer_10.R', 'head_deformer_02.L', 'head_deformer_02_mid', 'head_deformer_07_mid', 'head_deformer_06.L', 'head_deformer_09.L', 'head_deformer_02.R', 'head_deformer_06.R', 'head_deformer_09.R', 'head_deformer_01_mid', 'head_deformer_08_mid', 'head_deformer_01.L', 'head_deformer_05.L', 'head_deformer_08.L', 'head_deformer_01.R', 'head_deformer_05.R', 'head_deformer_08.R', 'head_deformer_11_mid', 'head_deformer_10_mid', 'head_deformer_09_mid', 'head_deformer_11.L', 'head_deformer_12.L', 'head_deformer_13.L', 'head_deformer_11.R', 'head_deformer_12.R', 'head_deformer_13.R']
-        
-        if self.hide_geo == "left_leg":
-            geo = ['mc_shorts_geo.L', 'mc_legs_geo.L', 'mc_shoe_geo.L', 'mc_shoe_logo_geo.L', 'mc_shoe_geo_multiple.L', 'mc_legs_geo_multiple1.L', 'mc_shorts_geo_multiple1.L', 'mc_shoe_logo_geo_multiple1.L', 'mc_shoe_geo_multiple2.L', 'mc_shoe_logo_geo_multiple2.L', 'mc_legs_geo_multiple2.L', 'mc_shorts_geo_multiple2.L']
-        
-        elif self.hide_geo == "right_leg":
-            geo = ['mc_shorts_geo.R', 'mc_legs_geo.R', 'mc_shoe_geo.R', 'mc_shoe_logo_geo.R', 'mc_legs_geo_multiple1.R', 'mc_shoe_geo_multiple.R', 'mc_shorts_geo_multiple1.R', 'mc_legs_geo_multiple2.R', 'mc_shoe_geo_multiple2.R', 'mc_shorts_geo_multiple2.R', 'mc_shoe_logo_geo_multiple1.R', 'mc_shoe_logo_geo_multiple2.R']
-            
-        elif self.hide_geo == "left_arm":
-            geo = ['mc_arms_geo.L', 'mc_hands_geo.L', 'mc_hand_detail_geo.L', 'mc_arms_geo_multiple1.L', 'mc_hand_detail_geo_multiple1.L', 'mc_hands_geo_multiple1.L', 'mc_arms_geo_multiple2.L', 'mc_hand_detail_geo_multiple2.L', 'mc_hands_geo_multiple2.L', 'mc_arms_geo_multiple1.L', 'mc_hand_detail_geo_multiple1.L', 'mc_hands_geo_multiple1.L', 'mc_arms_geo_multiple2.L', 'mc_hand_detail_geo_multiple2.L', 'mc_hands_geo_multiple2.L']
-            
-        elif self.hide_geo == "right_arm":
-            geo = ['mc_arms_geo.R', 'mc_hands_geo.R', 'mc_hand_detail_geo.R', 'mc_arms_geo_multiple2.R', 'mc_hands_geo_multiple2.R', 'mc_hand_detail_geo_multiple2.R', 'mc_arms_geo_multiple1.R', 'mc_hands_geo_multiple1.R', 'mc_hand_detail_geo_multiple1.R', 'mc_arms_geo_multiple2.R', 'mc_hands_geo_multiple2.R', 'mc_hand_detail_geo_multiple2.R']
-            
-        elif self.hide_geo == "torso":
-            geo = ['mc_torso_geo', 'mc_torso_detail_geo', 'mc_neck_geo']
-            
-        elif self.hide_geo == "head":
-            geo = ['mc_head_base_open_mouth_geo', 'mc_lower_teeth_geo', 'mc_upper_teeth_geo', 'mc_tongue_geo', 'mc_nose_geo', 'mc_nose_geo', 'mc_ears_geo.L', 'mc_ears_geo.R', 'mc_eyes_geo.L', 'mc_eyes_geo.R', 'mc_brows_geo', 'mc_hair_side_geo', 'mc_hair_top_geo', 'mc_head_base_closed_mouth_geo', 'mc_mouth_closed', 'mc_freckles_geo']
-        
+        obj = context.active_object
+
         if not self.hide_bones == "":
-            
-            MC = context.active_object.data
-            
+            armature = obj.data
+            names = get_group_names(armature, "sculptor_groups", LIL_MAX_SCULPTOR_GROUPS, self.hide_bones)
+            names, indices = get_group_indices((armature.as_pointer(), self.hide_bones), armature.bones, names)
+            coll = get_visibility_set(armature, self.hide_bones)
+
             if self.keyed_only == False:
-                hidden = False
-                for bone in bones:
-                    if MC.bones[bone].hide == True:
-                        hidden = True
-                        break          
-             
-                if hidden:
-                    bpy.ops.pose.select_all(action='DESELECT') 
-            
-                for bone in bones:
-                    if hidden:
-                        MC.bones[bone].hide = False
-                        MC.bones[bone].select = True
-                    else:
-                        MC.bones[bone].hide = True
+                toggle_bone_group(armature.bones, coll, indices, deselect=True)
             else:
-                
-                action = context.active_object.animation_data.action
-                hidden = False
-                keyed_bones = []
+                action = obj.animation_data and obj.animation_data.action
+
                 if not action == None:
-                    for bone in bones:
-                        for i in range(3):
-                            loc = action.fcurves.find('pose.bones["' + bone + '"].location', index=i) is not None
-                            rot = action.fcurves.find('pose.bones["' + bone + '"].rotation_euler', index=i) is not None
-                            scale = action.fcurves.find('pose.bones["' + bone + '"].scale', index=i) is not None
-                            
-                            if loc or rot or scale:
-                                has_keys = True
-                                break
-                            else:
-                                has_keys = False
-                                continue
-                        
-                        
-                        if has_keys:
-                            keyed_bones.append(bone)
-                    
-                    if not keyed_bones == []:
-                        for bone in keyed_bones:  
-                            if MC.bones[bone].hide == True:
-                                hidden = True
-                        
-                        for bone in keyed_bones:
-                            if hidden:
-                                MC.bones[bone].hide = False
-                                MC.bones[bone].select = True
-                            else:
-                                MC.bones[bone].hide = True
+                    # The table and its keyed set are shared across clicks until the action changes
+                    keyed = get_action_curve_table(action).get_keyed_bone_subset(names)
+                    keyed_indices = indices[np.fromiter((name in keyed for name in names), dtype=bool, count=len(names))]
+
+                    if len(keyed_indices):
+                        toggle_bone_group(armature.bones, coll, indices, keyed_indices)
                     else:
                         self.report({'ERROR'}, "Sculptors have no keys set")
                 else:
                     self.report({'ERROR'}, "This rig has no keys set")
-        
-        
+
+            # Flags written with foreach_set don't send the usual updates
+            armature.update_tag()
+            for area in context.screen.areas:
+                if area.type == 'VIEW_3D':
+                    area.tag_redraw()
+
         if not self.hide_geo == "":
-            MC = bpy.data.objects
-        
-            hidden = False
-            for ob in geo:
-                if MC[ob].hide_viewport == True:
-                    hidden = True
-                    break
-                    
-            for ob in geo:
-                if hidden:
-                    MC[ob].hide_viewport = False
-                else:
-                    MC[ob].hide_viewport = True
-        
-        
+            objects = bpy.data.objects
+            names = get_group_names(obj.data, "geometry_groups", LIL_MAX_GEOMETRY_GROUPS, self.hide_geo)
+
+            # Objects are kept sorted by name, so renames shift their indices: look them up by name.
+            # Object visibility needs the depsgraph update of the property, so it is set one by one
+            group = [ob for ob in map(objects.get, names) if ob is not None]
+            hidden = any(ob.hide_viewport for ob in group)
+
+            for ob in group:
+                ob.hide_viewport = not hidden
+
         self.hide_bones = ""
         self.hide_geo = ""
         return {'FINISHED'}
 
+class POSE_OT_MaxCartoonySetupVisibilitySets(bpy.types.Operator):
+    """Move each group of sculptor bones into its own bone collection, nested under the
+    collection the bones are in, so that toggling a group only changes that collection.
+    Needs Blender 4.1 or later and is done once per rig; nothing is migrated automatically,
+    so rigs that are not set up (and all rigs on 4.0) keep toggling the bone hide flags"""
+    bl_idname = "pose.max_cartoony_setup_visibility_sets"
+    bl_label = "Set Up Sculptor Visibility Sets"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.type == 'ARMATURE' and can_nest_bone_collections()
+
+    def execute(self, context):
+        armature = context.active_object.data
+        table = armature.get("sculptor_groups")
+        if table is None:
+            table = LIL_MAX_SCULPTOR_GROUPS
+
+        done, skipped = setup_visibility_sets(armature, {group: list(names) for group, names in table.items()})
+
+        if skipped:
+            self.report({'WARNING'}, f"Set up {len(done)} groups, kept hide flags for: {', '.join(skipped)}")
+        else:
+            self.report({'INFO'}, f"Set up {len(done)} groups")
+        return {'FINISHED'}
+
 class VIEW3D_PT_TORigUI_CartoonyMax(bpy.types.Panel):
     
     bl_space_type = 'VIEW_3D'
@@ -404,6 +329,10 @@ class VIEW3D_PT_TORigUI_CartoonyMax(bpy.types.Panel):
 
     def draw(self, context):
         layout = self.layout
+
+        if can_nest_bone_collections() and not has_visibility_sets(context.object.data):
+            layout.operator('pose.max_cartoony_setup_visibility_sets', icon='GROUP_BONE')
+
         row = layout.row(align=True)
         bone = context.active_pose_bone
 
@@ -439,41 +368,15 @@ class VIEW3D_PT_TORigUI_CartoonyMax(bpy.types.Panel):
 
             layout.label(text="Toggle Finger Sculptors:")
             col = layout.column(align=True)
-            row = col.row(align=True)
-            
-            op = row.operator('pose.max_cartoony_toggle_vis',text = 'Thumb', icon='SCULPTMODE_HLT')
-            op.hide_bones = side+"_thumb"
-            op.keyed_only = False
-            op = row.operator('pose.max_cartoony_toggle_vis',text = 'Keyed', icon='KEYFRAME')
-            op.hide_bones = side+"_thumb"
-            op.keyed_only = True
-            
-            row = col.row(align=True)
-            
-            op = row.operator('pose.max_cartoony_toggle_vis',text = 'Index', icon='SCULPTMODE_HLT')
-            op.hide_bones = side+"_index_f"
-            op.keyed_only = False
-            op = row.operator('pose.max_cartoony_toggle_vis',text = 'Keyed', icon='KEYFRAME')
-            op.hide_bones = side+"_index_f"
-            op.keyed_only = True
-            
-            row = col.row(align=True)
-            
-            op = row.operator('pose.max_cartoony_toggle_vis',text = 'Middle', icon='SCULPTMODE_HLT')
-            op.hide_bones = side+"_middle_f"
-            op.keyed_only = False
-            op = row.operator('pose.max_cartoony_toggle_vis',text = 'Keyed', icon='KEYFRAME')
-            op.hide_bones = side+"_index_f"
-            op.keyed_only = True
-            
-            row = col.row(align=True)
-           
-            op = row.operator('pose.max_cartoony_toggle_vis',text = 'Pinky', icon='SCULPTMODE_HLT')
-            op.hide_bones = side+"_pinky_f"
-            op.keyed_only = False
-            op = row.operator('pose.max_cartoony_toggle_vis',text = 'Keyed', icon='KEYFRAME')
-            op.hide_bones = side+"_pinky_f"
-            op.keyed_only = True
+
+            for text, finger in FINGER_SCULPTOR_BUTTONS:
+                row = col.row(align=True)
+                op = row.operator('pose.max_cartoony_toggle_vis',text = text, icon='SCULPTMODE_HLT')
+                op.hide_bones = side+"_"+finger
+                op.keyed_only = False
+                op = row.operator('pose.max_cartoony_toggle_vis',text = 'Keyed', icon='KEYFRAME')
+                op.hide_bones = side+"_"+finger
+                op.keyed_only = True
 
         elif 'head' in bone.name:
             row = layout.row(align=True)
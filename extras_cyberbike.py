@@ -1,6 +1,8 @@
 
 import bpy
 
+from .ui_panel import can_nest_bone_collections, get_visibility_set
+
 class VIEW3D_PT_TORigUI_CyberbikeUI(bpy.types.Panel):
     
     bl_space_type = 'VIEW_3D'
@@ -20,6 +22,8 @@ class VIEW3D_PT_TORigUI_CyberbikeUI(bpy.types.Panel):
             layout = self.layout
             row = layout.row()
             row.operator("pose.toggle_vehicle_path", text="Toggle Path")
+            if can_nest_bone_collections() and get_visibility_set(ob.data, "vehicle_path") is None:
+                row.operator("pose.vehicle_setup_path_visibility", text="", icon='GROUP_BONE')
 
             row = layout.row()
             try:
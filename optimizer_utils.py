@@ -0,0 +1,242 @@
+import math
+from collections import namedtuple
+
+###########################
+## Scalar function cache ##
+###########################
+
+class EvaluationBudgetExceeded(Exception):
+    "Raised by MemoizedFunction when the evaluation budget is used up."
+
+
+class MemoizedFunction:
+    """ Wraps a scalar function of one variable, caching its values and
+        counting distinct evaluations against an optional budget.
+        Evaluations are expected to be expensive (e.g. a depsgraph update),
+        so any repeated argument is served from the cache.
+    """
+
+    def __init__(self, func, budget=None, *, digits=12):
+        self.func = func
+        self.budget = budget
+        self.digits = digits
+        self.cache = {}
+        self.best = None
+        self.last = None
+
+    @property
+    def evaluations(self):
+        return len(self.cache)
+
+    def __call__(self, x):
+        key = round(x, self.digits)
+
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+
+        if self.budget is not None and len(self.cache) >= self.budget:
+            raise EvaluationBudgetExceeded()
+
+        value = self.cache[key] = self.func(x)
+        self.last = x
+
+        if self.best is None or value < self.best[1]:
+            self.best = (x, value)
+
+        return value
+
+
+def memoize(func, budget=None):
+    "Wrap func in MemoizedFunction, unless it already is one (then budget is ignored)."
+    if isinstance(func, MemoizedFunction):
+        return func
+    return MemoizedFunction(func, budget)
+
+
+# Result of a minimization:
+#   x, fun: best argument found and its value
+#   evaluations: number of distinct function evaluations made so far
+#   converged: whether the requested tolerance was reached
+#   reason: 'tolerance', 'budget', 'no_bracket' or 'max_iterations'
+OptimizeResult = namedtuple('OptimizeResult', ['x', 'fun', 'evaluations', 'converged', 'reason'])
+
+def make_result(func, reason, x=None):
+    if x is None:
+        x, fun = func.best
+    else:
+        fun = func(x)
+    return OptimizeResult(x, fun, func.evaluations, reason == 'tolerance', reason)
+
+
+##########################
+## Minimization methods ##
+##########################
+
+GOLDEN_RATIO = (3 - math.sqrt(5)) / 2
+
+def bracket_minimum(f, start, step, *, max_distance=2*math.pi, budget=None):
+    """ Walks from start in steps of the given size, in the descending direction,
+        until the middle of three consecutive samples is the smallest one.
+        Returns (left, center, right), or None if no bracket is found within
+        max_distance of start.
+    """
+    f = memoize(f, budget)
+
+    try:
+        if f(start + step) > f(start):
+            if f(start - step) >= f(start):
+                return (start - step, start, start + step)
+            step = -step
+
+        count = int(max_distance / abs(step))
+
+        for i in range(1, count):
+            center = start + i * step
+            value = f(center)
+
+            if value <= f(start + (i - 1) * step) and value <= f(start + (i + 1) * step):
+                return tuple(sorted((center - step, center, center + step)))
+
+    except EvaluationBudgetExceeded:
+        pass
+
+    return None
+
+
+def golden_section_search(f, left, right, *, tolerance=1e-5, budget=None):
+    """ Minimizes a unimodal function in [left, right] by golden-section search,
+        which needs one new evaluation per iteration. Stops when the bracket
+        is narrower than tolerance.
+    """
+    f = memoize(f, budget)
+
+    a, b = left, right
+    c = b - (1 - GOLDEN_RATIO) * (b - a)
+    d = a + (1 - GOLDEN_RATIO) * (b - a)
+
+    try:
+        while abs(b - a) >= tolerance:
+            if f(c) > f(d):
+                a, c = c, d
+                d = a + (1 - GOLDEN_RATIO) * (b - a)
+            else:
+                b, d = d, c
+                c = b - (1 - GOLDEN_RATIO) * (b - a)
+
+    except EvaluationBudgetExceeded:
+        return make_result(f, 'budget')
+
+    return make_result(f, 'tolerance', c if f(c) <= f(d) else d)
+
+
+def brent_minimize(f, left, right, *, x=None, tolerance=1e-5, budget=None):
+    """ Minimizes a unimodal function in [left, right] with Brent's method:
+        parabolic interpolation through the three best points, falling back
+        to golden-section steps. If x is given it should be an interior point
+        with a value lower than both ends, e.g. the center from bracket_minimum.
+        Stops when the bracket extends less than tolerance on each side of the result.
+    """
+    f = memoize(f, budget)
+
+    a, b = left, right
+    if x is None:
+        x = a + GOLDEN_RATIO * (b - a)
+
+    tol1 = tolerance / 2
+    tol2 = tolerance
+    d = e = 0.0
+
+    try:
+        w = v = x
+        fx = fw = fv = f(x)
+
+        while True:
+            m = (a + b) / 2
+
+            if abs(x - m) <= tol2 - (b - a) / 2:
+                return make_result(f, 'tolerance', x)
+
+            if abs(e) > tol1:
+                # Fit a parabola through x, w and v
+                r = (x - w) * (fx - fv)
+                q = (x - v) * (fx - fw)
+                p = (x - v) * q - (x - w) * r
+                q = 2 * (q - r)
+                if q > 0:
+                    p = -p
+                q = abs(q)
+                e_prev, e = e, d
+
+                if abs(p) >= abs(q * e_prev / 2) or p <= q * (a - x) or p >= q * (b - x):
+                    e = (a - x) if x >= m else (b - x)
+                    d = GOLDEN_RATIO * e
+                else:
+                    d = p / q
+                    if (x + d) - a < tol2 or b - (x + d) < tol2:
+                        d = math.copysign(tol1, m - x)
+            else:
+                e = (a - x) if x >= m else (b - x)
+                d = GOLDEN_RATIO * e
+
+            u = x + d if abs(d) >= tol1 else x + math.copysign(tol1, d)
+            fu = f(u)
+
+            if fu <= fx:
+                if u >= x:
+                    a = x
+                else:
+                    b = x
+                v, w, x = w, x, u
+                fv, fw, fx = fw, fx, fu
+            else:
+                if u < x:
+                    a = u
+                else:
+                    b = u
+                if fu <= fw or w == x:
+                    v, w = w, u
+                    fv, fw = fw, fu
+                elif fu <= fv or v == x or v == w:
+                    v, fv = u, fu
+
+    except EvaluationBudgetExceeded:
+        return make_result(f, 'budget')
+
+
+def minimize_scalar(f, start, step, *, tolerance=1e-5, max_distance=2*math.pi, budget=None):
+    """ Finds a local minimum of f near start: brackets it by walking in steps,
+        then refines the bracket with Brent's method, sharing evaluations.
+    """
+    f = memoize(f, budget)
+    bracket = bracket_minimum(f, start, step, max_distance=max_distance)
+
+    if bracket is None:
+        reason = 'budget' if f.budget is not None and f.evaluations >= f.budget else 'no_bracket'
+        return make_result(f, reason)
+
+    return brent_minimize(f, bracket[0], bracket[2], x=bracket[1], tolerance=tolerance)
+
+
+#########################
+## Fixed point solving ##
+#########################
+
+def fixed_point_iteration(measure, correct, is_converged, *, max_iterations=3):
+    """ Repeatedly measures a state and applies a correction until it converges.
+        Convergence is checked before each correction, so a state that already
+        matches costs no corrections. Returns an OptimizeResult with the final
+        measurement as x and the number of corrections as evaluations.
+    """
+    value = measure()
+
+    for i in range(max_iterations):
+        if is_converged(value):
+            return OptimizeResult(value, None, i, True, 'tolerance')
+
+        correct(value)
+        value = measure()
+
+    converged = is_converged(value)
+    return OptimizeResult(value, None, max_iterations, converged, 'tolerance' if converged else 'max_iterations')
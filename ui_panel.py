@@ -1,13 +1,24 @@
 import bpy
 import math
+import ast
 import json
+import time
+import bisect
+import re
+import contextlib
 import collections
 import traceback
+import zlib
+import numpy as np
 from math import pi
 from bpy.props import StringProperty, BoolProperty
 from mathutils import Euler, Matrix, Quaternion, Vector
 from rna_prop_ui import rna_idprop_quote_path
 
+from .optimizer_utils import (
+    MemoizedFunction, minimize_scalar, fixed_point_iteration,
+)
+
 ############################
 ## Math utility functions ##
 ############################
@@ -30,49 +41,6 @@ def perpendicular_vector(v):
     return v.cross(tv)
 
 
-def rotation_difference(mat1, mat2):
-    """ Returns the shortest-path rotational difference between two
-        matrices.
-    """
-    q1 = mat1.to_quaternion()
-    q2 = mat2.to_quaternion()
-    angle = math.acos(min(1,max(-1,q1.dot(q2)))) * 2
-    if angle > pi:
-        angle = -angle + (2*pi)
-    return angle
-
-def find_min_range(f,start_angle,delta=pi/8):
-    """ finds the range where lies the minimum of function f applied on bone_ik and bone_fk
-        at a certain angle.
-    """
-    angle = start_angle
-    while (angle > (start_angle - 2*pi)) and (angle < (start_angle + 2*pi)):
-        l_dist = f(angle-delta)
-        c_dist = f(angle)
-        r_dist = f(angle+delta)
-        if min((l_dist,c_dist,r_dist)) == c_dist:
-            return (angle-delta,angle+delta)
-        else:
-            angle=angle+delta
-
-def ternarySearch(f, left, right, absolutePrecision):
-    """
-    Find minimum of uni-modal function f() within [left, right]
-    To find the maximum, revert the if/else statement or revert the comparison.
-    """
-    while True:
-        #left and right are the current bounds; the maximum is between them
-        if abs(right - left) < absolutePrecision:
-            return (left + right)/2
-
-        leftThird = left + (right - left)/3
-        rightThird = right - (right - left)/3
-
-        if f(leftThird) > f(rightThird):
-            left = leftThird
-        else:
-            right = rightThird
-
 ######################
 ## Keyframing tools ##
 ######################
@@ -118,19 +86,200 @@ def get_4d_rot_lock(bone):
     else:
         return [all(bone.lock_rotation)] * 4
 
+class KeyframeBatchWriter:
+    """Context manager that collects the keyframes inserted via insert_keyframe in memory,
+    and on flush or exit writes every F-Curve in one batch with keyframe_points.add and
+    foreach_set, instead of going through RNA and tagging the action for every single key.
+    Bake passes flush after every frame, so that evaluating the next frame sees the keys
+    already baked, exactly as with immediate insertion."""
+
+    # Flags that need Blender's own insertion logic; keys using them are inserted immediately.
+    UNSUPPORTED_FLAGS = frozenset(['INSERTKEY_CYCLE_AWARE', 'INSERTKEY_REPLACE', 'INSERTKEY_NEEDED'])
+
+    # Distance under which keys are considered to be on the same frame (as in Blender).
+    FRAME_THRESHOLD = 0.01
+
+    active = None
+
+    def __init__(self, context):
+        prefs = context.preferences.edit
+        self.scene = context.scene
+        self.interpolation = prefs.keyframe_new_interpolation_type
+        self.handle_type = prefs.keyframe_new_handle_type
+        self.key_type = context.scene.tool_settings.keyframe_type
+        self.curves = {}
+        self.keys_written = 0
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = KeyframeBatchWriter.active
+        KeyframeBatchWriter.active = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        KeyframeBatchWriter.active = self.previous
+        if exc_type is None:
+            self.flush()
+
+    @contextlib.contextmanager
+    def suspended(self):
+        "Temporarily deactivate the writer while control is returned to other code."
+        KeyframeBatchWriter.active = self.previous
+        try:
+            yield
+        finally:
+            KeyframeBatchWriter.active = self
+
+    def accepts(self, keyflags):
+        return not (keyflags & self.UNSUPPORTED_FLAGS)
+
+    def add(self, ptr, prop_path, index, group, keyflags):
+        "Record the current value of the property as a key on the current frame."
+        obj = ptr.id_data
+        data_path = ptr.path_from_id(prop_path)
+        value = ptr.path_resolve(prop_path)
+        frame = nla_tweak_to_scene(obj.animation_data, self.scene.frame_current, invert=True)
+
+        if isinstance(value, (int, float)):
+            items = [(max(index, 0), value)]
+        elif index < 0:
+            items = list(enumerate(value))
+        else:
+            items = [(index, value[index])]
+
+        for i, item in items:
+            entry = self.curves.get((obj, data_path, i))
+            if entry is None:
+                entry = self.curves[(obj, data_path, i)] = (group, set(keyflags), {})
+            entry[1].update(keyflags)
+            entry[2][frame] = float(item)
+
+    def discard_frame(self, frame):
+        "Drop all keys collected on the given action frame."
+        for key, (group, flags, keys) in list(self.curves.items()):
+            keys.pop(frame, None)
+            if not keys:
+                del self.curves[key]
+
+    def flush(self):
+        "Write all collected keys to their curves."
+        actions = set()
+        written = self.keys_written
+
+        for (obj, data_path, index), (group, flags, keys) in self.curves.items():
+            action = self.write_curve(obj, data_path, index, group, flags, keys)
+            if action:
+                actions.add(action)
+
+        for action in actions:
+            action.update_tag()
+
+        count_bake_event('keys_written', self.keys_written - written)
+        self.curves.clear()
+
+    def write_curve(self, obj, data_path, index, group, flags, keys):
+        action = find_action(obj)
+
+        if action is None:
+            if 'INSERTKEY_AVAILABLE' in flags:
+                return None
+            anim_data = obj.animation_data or obj.animation_data_create()
+            action = anim_data.action = bpy.data.actions.new(obj.name + "Action")
+
+        curve = action.fcurves.find(data_path, index=index)
+
+        if curve is None:
+            if 'INSERTKEY_AVAILABLE' in flags:
+                return None
+            curve = action.fcurves.new(data_path, index=index, action_group=group)
+            invalidate_curve_tables(action)
+            if 'INSERTKEY_XYZ_TO_RGB' in flags:
+                if data_path.endswith(('location', 'rotation_euler', 'scale')):
+                    curve.color_mode = 'AUTO_RGB'
+                elif data_path.endswith(('rotation_quaternion', 'rotation_axis_angle')):
+                    curve.color_mode = 'AUTO_YRGB'
+
+        points = curve.keyframe_points
+        count = len(points)
+
+        co = [0.0] * (count * 2)
+        left = [0.0] * (count * 2)
+        right = [0.0] * (count * 2)
+        points.foreach_get('co', co)
+        points.foreach_get('handle_left', left)
+        points.foreach_get('handle_right', right)
+
+        existing = co[0::2]
+        new_co = []
+
+        for frame, value in sorted(keys.items()):
+            pos = bisect.bisect_left(existing, frame - self.FRAME_THRESHOLD)
+
+            if pos < count and abs(existing[pos] - frame) < self.FRAME_THRESHOLD:
+                # Replace the existing key, moving its handles along
+                delta = value - co[pos * 2 + 1]
+                co[pos * 2 + 1] = value
+                left[pos * 2 + 1] += delta
+                right[pos * 2 + 1] += delta
+                self.keys_written += 1
+                continue
+
+            new_co.append((frame, value))
+
+        added = len(new_co)
+
+        if added:
+            points.add(added)
+            flat = [v for key in new_co for v in key]
+            co += flat
+            left += flat
+            right += flat
+
+        points.foreach_set('co', co)
+        points.foreach_set('handle_left', left)
+        points.foreach_set('handle_right', right)
+
+        if added and (self.interpolation != 'BEZIER' or self.handle_type != 'AUTO_CLAMPED'
+                      or self.key_type != 'KEYFRAME'):
+            for i in range(count, count + added):
+                key = points[i]
+                key.interpolation = self.interpolation
+                key.handle_left_type = key.handle_right_type = self.handle_type
+                key.type = self.key_type
+
+        curve.update()
+
+        self.keys_written += added
+        return action
+
+def insert_keyframe(ptr, prop_path, keyflags, *, index=-1, group=""):
+    "Keyframe the property, deferring to the active KeyframeBatchWriter when there is one."
+    writer = KeyframeBatchWriter.active
+
+    if writer and writer.accepts(keyflags):
+        writer.add(ptr, prop_path, index, group, keyflags)
+    elif ptr.keyframe_insert(prop_path, index=index, group=group, options=keyflags):
+        value = ptr.path_resolve(prop_path)
+        count_bake_event('keys_written', 1 if index >= 0 or isinstance(value, (int, float)) else len(value))
+
+def get_pose_bone(obj, bone):
+    "Returns the pose bone with the given name, or the bone itself if it already is a pose bone."
+    return obj.pose.bones[bone] if isinstance(bone, str) else bone
+
 def keyframe_transform_properties(obj, bone_name, keyflags, *,
                                   ignore_locks=False, no_loc=False, no_rot=False, no_scale=False):
     "Keyframe transformation properties, taking flags and mode into account, and avoiding keying locked channels."
-    bone = obj.pose.bones[bone_name]
+    bone = get_pose_bone(obj, bone_name)
+    bone_name = bone.name
 
     def keyframe_channels(prop, locks):
         if ignore_locks or not all(locks):
             if ignore_locks or not any(locks):
-                bone.keyframe_insert(prop, group=bone_name, options=keyflags)
+                insert_keyframe(bone, prop, keyflags, group=bone_name)
             else:
                 for i, lock in enumerate(locks):
                     if not lock:
-                        bone.keyframe_insert(prop, index=i, group=bone_name, options=keyflags)
+                        insert_keyframe(bone, prop, keyflags, index=i, group=bone_name)
 
     if not (no_loc or bone.bone.use_connect):
         keyframe_channels('location', bone.lock_location)
@@ -202,6 +351,323 @@ def undo_copy_scale_constraints(obj, bone, matrix):
             matrix = undo_copy_scale_with_offset(obj, bone, con, matrix)
     return matrix
 
+def get_constraint_target_objects(con):
+    "Iterate over all objects referenced by the constraint as targets."
+    for attr in ('target', 'pole_target'):
+        target = getattr(con, attr, None)
+        if isinstance(target, bpy.types.Object):
+            yield target
+    # Armature constraints keep their targets in a list
+    for tgt in getattr(con, 'targets', ()):
+        if isinstance(tgt.target, bpy.types.Object):
+            yield tgt.target
+
+####################
+## Bake profiling ##
+####################
+
+# Records of the recent profiled bakes, newest last
+bake_profile_history = collections.deque(maxlen=100)
+
+class BakeProfiler:
+    """Context manager that accumulates the time spent in each phase of a bake, excluding
+    the pauses between the steps of a modal bake, and counts frame changes, view layer
+    updates and written keys while it is active."""
+
+    active = None
+
+    def __init__(self, operator):
+        self.operator = operator.bl_idname
+        self.phases = collections.defaultdict(float)
+        self.counters = collections.Counter()
+        self.phase = 'init'
+        self.mark = None
+
+    def __enter__(self):
+        BakeProfiler.active = self
+        self.mark = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.add_time()
+        self.mark = None
+        BakeProfiler.active = None
+
+    def add_time(self):
+        now = time.perf_counter()
+        if self.mark is not None:
+            self.phases[self.phase] += now - self.mark
+        self.mark = now
+
+    def set_phase(self, name):
+        self.add_time()
+        self.phase = name
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def get_record(self, rigs, frame_count):
+        return {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'operator': self.operator,
+            'rigs': [rig.name for rig in rigs],
+            'frames': frame_count,
+            'total': sum(self.phases.values()),
+            'phases': dict(self.phases),
+            'counters': dict(self.counters),
+        }
+
+    @staticmethod
+    def format_record(record):
+        phases = ', '.join(f"{name} {value:.2f}s" for name, value in record['phases'].items())
+        counters = record['counters']
+        return (
+            f"Bake profile: {record['total']:.2f}s ({phases}); "
+            f"{counters.get('frame_set', 0)} frame_set, "
+            f"{counters.get('view_layer_update', 0)} view_layer.update, "
+            f"{counters.get('keys_written', 0)} keys written, "
+            f"{counters.get('bake_state_bytes', 0) / 1024:.1f} KiB saved state"
+        )
+
+def set_bake_phase(name):
+    "Mark the start of a new phase in the active bake profiler, if any."
+    if BakeProfiler.active:
+        BakeProfiler.active.set_phase(name)
+
+def count_bake_event(name, amount=1):
+    "Count an event in the active bake profiler, if any."
+    if BakeProfiler.active:
+        BakeProfiler.active.count(name, amount)
+
+def scene_frame_set(scene, frame):
+    "Change the current frame, counting the call for profiling."
+    count_bake_event('frame_set')
+    scene.frame_set(frame)
+
+def update_view_layer(view_layer):
+    "Update the view layer, counting the call for profiling."
+    count_bake_event('view_layer_update')
+    view_layer.update()
+
+############################
+## Scene evaluation tools ##
+############################
+
+def get_driver_target_objects(anim_data):
+    "Iterate over all objects read by the driver variables of the animation data."
+    if anim_data is None:
+        return
+    for fcu in anim_data.drivers:
+        for var in fcu.driver.variables:
+            for tgt in var.targets:
+                if isinstance(tgt.id, bpy.types.Object):
+                    yield tgt.id
+
+def get_object_dependencies(obj):
+    """Returns the set of objects the evaluated state of obj depends on, including itself:
+    parents, constraint targets, modifier objects, driver targets and bone custom shapes."""
+    result = set()
+    queue = [obj]
+
+    while queue:
+        cur = queue.pop()
+        if cur in result:
+            continue
+        result.add(cur)
+
+        if cur.parent:
+            queue.append(cur.parent)
+
+        for con in cur.constraints:
+            queue.extend(get_constraint_target_objects(con))
+
+        for mod in cur.modifiers:
+            if isinstance(getattr(mod, 'object', None), bpy.types.Object):
+                queue.append(mod.object)
+
+        if cur.pose:
+            for bone in cur.pose.bones:
+                for con in bone.constraints:
+                    queue.extend(get_constraint_target_objects(con))
+                if bone.custom_shape:
+                    queue.append(bone.custom_shape)
+
+        queue.extend(get_driver_target_objects(cur.animation_data))
+        queue.extend(get_driver_target_objects(getattr(cur.data, 'animation_data', None)))
+
+        shape_keys = getattr(cur.data, 'shape_keys', None)
+        if shape_keys:
+            queue.extend(get_driver_target_objects(shape_keys.animation_data))
+
+    return result
+
+class RigOnlyEvaluation:
+    """Context manager that temporarily hides every object in the view layer that the rigs
+    do not depend on, so that frame changes only evaluate the rigs, their constraint targets
+    and the objects their drivers read. The objects are hidden in this view layer only, which
+    leaves their hide_viewport flag, other view layers and other scenes untouched."""
+
+    def __init__(self, context, *rigs):
+        self.view_layer = context.view_layer
+        self.rigs = rigs
+        self.hidden = []
+        self.total = 0
+        self.evaluated_count = 0
+
+    def __enter__(self):
+        keep = set().union(*(get_object_dependencies(rig) for rig in self.rigs))
+        objects = list(self.view_layer.objects)
+        self.total = len(objects)
+
+        try:
+            for obj in objects:
+                if obj in keep or obj.hide_get(view_layer=self.view_layer):
+                    continue
+                try:
+                    obj.hide_set(True, view_layer=self.view_layer)
+                except RuntimeError:
+                    continue
+                self.hidden.append(obj)
+        except BaseException:
+            self.restore()
+            raise
+
+        self.evaluated_count = self.total - len(self.hidden)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.restore()
+
+    def restore(self):
+        "Show the objects hidden on entry again."
+        try:
+            for obj in self.hidden:
+                try:
+                    obj.hide_set(False, view_layer=self.view_layer)
+                except (ReferenceError, RuntimeError):
+                    pass
+        finally:
+            self.hidden = []
+
+POSE_BONE_PATH_RE = re.compile(r'^pose\.bones\["((?:[^"\\]|\\.)*)"\]')
+
+def get_pose_bone_name_from_path(data_path):
+    "Extract the bone name from a pose bone property path, or None if it is not one."
+    match = POSE_BONE_PATH_RE.match(data_path)
+    if match:
+        return bpy.utils.unescape_identifier(match.group(1))
+    return None
+
+def get_bone_dependency_map(obj):
+    """Returns a dictionary from pose bone name to the set of names of bones in the same
+    armature it directly depends on via parenting, constraints and drivers. A None entry
+    in the set means the bone depends on some other object that itself depends on the rig."""
+    dependencies = collections.defaultdict(set)
+    external_cache = {}
+
+    def depends_on_rig(target):
+        if target not in external_cache:
+            external_cache[target] = obj in get_object_dependencies(target)
+        return external_cache[target]
+
+    def add_target(names, target, subtarget):
+        if target == obj:
+            if subtarget:
+                for name in names:
+                    dependencies[name].add(subtarget)
+        elif isinstance(target, bpy.types.Object) and depends_on_rig(target):
+            for name in names:
+                dependencies[name].add(None)
+
+    def add_constraint_targets(names, con):
+        add_target(names, getattr(con, 'target', None), getattr(con, 'subtarget', None))
+        add_target(names, getattr(con, 'pole_target', None), getattr(con, 'pole_subtarget', None))
+        for tgt in getattr(con, 'targets', ()):
+            add_target(names, tgt.target, tgt.subtarget)
+
+    for bone in obj.pose.bones:
+        if bone.parent:
+            dependencies[bone.name].add(bone.parent.name)
+
+        for con in bone.constraints:
+            names = [bone.name]
+
+            # IK constraints also move the parents within the chain length
+            if con.type in {'IK', 'SPLINE_IK'}:
+                parent = bone.parent
+                count = con.chain_count - 1 if con.chain_count else -1
+                while parent and count != 0:
+                    names.append(parent.name)
+                    dependencies[parent.name].add(bone.name)
+                    parent = parent.parent
+                    count -= 1
+
+            add_constraint_targets(names, con)
+
+    if obj.animation_data:
+        for fcu in obj.animation_data.drivers:
+            name = get_pose_bone_name_from_path(fcu.data_path)
+            if not name:
+                continue
+
+            for var in fcu.driver.variables:
+                for tgt in var.targets:
+                    if tgt.id in (obj, obj.data):
+                        if var.type == 'SINGLE_PROP':
+                            subtarget = get_pose_bone_name_from_path(tgt.data_path)
+                        else:
+                            subtarget = tgt.bone_target
+                        add_target([name], obj, subtarget)
+                    else:
+                        add_target([name], tgt.id, None)
+
+    return dependencies
+
+def bones_depend_on(dependencies, inputs, outputs):
+    "Check if any of the input bones depends directly or indirectly on any of the output bones."
+    outputs = set(outputs)
+    visited = set()
+    queue = list(inputs)
+
+    while queue:
+        name = queue.pop()
+        if name is None or name in outputs:
+            return True
+        if name not in visited:
+            visited.add(name)
+            queue.extend(dependencies.get(name, ()))
+
+    return False
+
+class BoneUpdatePlanner:
+    """Decides where pose updates are needed while assigning a sequence of bones: before
+    a bone is assigned, the pose only has to be re-evaluated if the bone depends on one
+    of the bones assigned since the last update. Plans are cached by bone list."""
+
+    def __init__(self, obj):
+        self.dependencies = get_bone_dependency_map(obj)
+        self.plans = {}
+
+    def get_plan(self, bone_names):
+        "Returns a tuple of flags telling whether to update the pose before assigning each bone."
+        key = tuple(bone_names)
+        plan = self.plans.get(key)
+
+        if plan is None:
+            plan = []
+            pending = set()
+
+            for name in key:
+                need_update = bool(pending) and bones_depend_on(self.dependencies, [name], pending)
+                if need_update:
+                    pending.clear()
+                plan.append(need_update)
+                pending.add(name)
+
+            plan = self.plans[key] = tuple(plan)
+
+        return plan
+
 ###############################
 ## Assign and keyframe tools ##
 ###############################
@@ -213,11 +679,11 @@ def set_custom_property_value(obj, bone_name, prop, value, *, keyflags=None):
     bone[prop] = value
     rna_idprop_ui_prop_update(bone, prop)
     if keyflags is not None:
-        bone.keyframe_insert(rna_idprop_quote_path(prop), group=bone.name, options=keyflags)
+        insert_keyframe(bone, rna_idprop_quote_path(prop), keyflags, group=bone.name)
 
 def get_transform_matrix(obj, bone_name, *, space='POSE', with_constraints=True):
     "Retrieve the matrix of the bone before or after constraints in the given space."
-    bone = obj.pose.bones[bone_name]
+    bone = get_pose_bone(obj, bone_name)
     if with_constraints:
         return obj.convert_space(pose_bone=bone, matrix=bone.matrix, from_space='POSE', to_space=space)
     else:
@@ -230,7 +696,7 @@ def set_transform_from_matrix(obj, bone_name, matrix, *, space='POSE', undo_copy
                               ignore_locks=False, no_loc=False, no_rot=False, no_scale=False, keyflags=None):
     """Apply the matrix to the transformation of the bone, taking locked channels, mode and certain
     constraints into account, and optionally keyframe it."""
-    bone = obj.pose.bones[bone_name]
+    bone = get_pose_bone(obj, bone_name)
 
     def restore_channels(prop, old_vec, locks, extra_lock):
         if extra_lock or (not ignore_locks and all(locks)):
@@ -282,14 +748,23 @@ def set_transform_from_matrix(obj, bone_name, matrix, *, space='POSE', undo_copy
     # Keyframe properties
     if keyflags is not None:
         keyframe_transform_properties(
-            obj, bone_name, keyflags, ignore_locks=ignore_locks,
+            obj, bone, keyflags, ignore_locks=ignore_locks,
             no_loc=no_loc, no_rot=no_rot, no_scale=no_scale
         )
 
-def set_chain_transforms_from_matrices(context, obj, bone_names, matrices, **options):
-    for bone, matrix in zip(bone_names, matrices):
+def set_chain_transforms_from_matrices(context, obj, bones, matrices, *, planner, **options):
+    """Apply the matrices to the bones (pose bones or names) in order, updating the pose only when
+    a bone depends on bones assigned before it, and once at the end. The planner is the
+    BoneUpdatePlanner of obj, built once per operator run."""
+    bones = bones[:len(matrices)]
+    plan = planner.get_plan([bone if isinstance(bone, str) else bone.name for bone in bones])
+
+    for bone, matrix, need_update in zip(bones, matrices, plan):
+        if need_update:
+            update_view_layer(context.view_layer)
         set_transform_from_matrix(obj, bone, matrix, **options)
-        context.view_layer.update()
+
+    update_view_layer(context.view_layer)
 
 
 ###########################
@@ -309,31 +784,142 @@ def flatten_curve_set(curves):
         for sub in curves:
             yield from flatten_curve_set(sub)
 
+# Keyframe attributes copied when rebuilding keyframe_points, with their array layouts.
+KEYFRAME_ATTRIBUTES = (
+    ('co', np.float32, 2),
+    ('handle_left', np.float32, 2),
+    ('handle_right', np.float32, 2),
+    ('interpolation', np.int32, 1),
+    ('easing', np.int32, 1),
+    ('handle_left_type', np.int32, 1),
+    ('handle_right_type', np.int32, 1),
+    ('type', np.int32, 1),
+    ('amplitude', np.float32, 1),
+    ('back', np.float32, 1),
+    ('period', np.float32, 1),
+    ('select_control_point', bool, 1),
+    ('select_left_handle', bool, 1),
+    ('select_right_handle', bool, 1),
+)
+
+def get_keyframe_enum_value(prop, identifier):
+    "Returns the integer value of a Keyframe enum property item, as used by foreach_get/set."
+    return bpy.types.Keyframe.bl_rna.properties[prop].enum_items[identifier].value
+
+def get_curve_key_times(curve):
+    "Read the times of all keys of the curve into an array."
+    points = curve.keyframe_points
+    co = np.empty(len(points) * 2, dtype=np.float64)
+    points.foreach_get('co', co)
+    return co[0::2]
+
+def get_key_range_mask(times, key_range):
+    "Compute a boolean mask of the key times that are within the range."
+    if key_range is None:
+        return np.ones(len(times), dtype=bool)
+    return (times >= key_range[0]) & (times <= key_range[1])
+
+def read_keyframe_data(curve):
+    "Read all attributes of all keys of the curve into a dictionary of arrays."
+    points = curve.keyframe_points
+    count = len(points)
+    data = {}
+    for attr, dtype, size in KEYFRAME_ATTRIBUTES:
+        array = np.empty(count * size, dtype=dtype)
+        points.foreach_get(attr, array)
+        data[attr] = array.reshape(count, size) if size > 1 else array
+    return data
+
+def write_keyframe_data(curve, data, mask=None):
+    "Replace all keys of the curve with the keys from the data arrays, optionally filtered by a mask."
+    points = curve.keyframe_points
+    points.clear()
+
+    count = len(data['co']) if mask is None else np.count_nonzero(mask)
+    if count:
+        points.add(count)
+        for attr, dtype, size in KEYFRAME_ATTRIBUTES:
+            array = data[attr] if mask is None else data[attr][mask]
+            points.foreach_set(attr, np.ascontiguousarray(array, dtype=dtype).ravel())
+
+    curve.update()
+
 def flatten_curve_key_set(curves, key_range=None):
     "Iterate over all keys of the given fcurves in the specified range."
     for curve in flatten_curve_set(curves):
-        for key in curve.keyframe_points:
-            if key_range is None or key_range[0] <= key.co[0] <= key_range[1]:
-                yield key
+        points = curve.keyframe_points
+        if key_range is None:
+            yield from points
+        else:
+            for i in np.flatnonzero(get_key_range_mask(get_curve_key_times(curve), key_range)):
+                yield points[int(i)]
 
 def get_curve_frame_set(curves, key_range=None):
     "Compute a set of all time values with existing keys in the given curves and range."
-    return set(key.co[0] for key in flatten_curve_key_set(curves, key_range))
+    frames = []
+    for curve in flatten_curve_set(curves):
+        times = get_curve_key_times(curve)
+        frames.append(times[get_key_range_mask(times, key_range)])
+    if not frames:
+        return set()
+    return set(np.unique(np.concatenate(frames)).tolist())
 
 def set_curve_key_interpolation(curves, ipo, key_range=None):
     "Assign the given interpolation value to all curve keys in range."
-    for key in flatten_curve_key_set(curves, key_range):
-        key.interpolation = ipo
+    value = get_keyframe_enum_value('interpolation', ipo)
+    for curve in flatten_curve_set(curves):
+        points = curve.keyframe_points
+        ipos = np.empty(len(points), dtype=np.int32)
+        points.foreach_get('interpolation', ipos)
+        ipos[get_key_range_mask(get_curve_key_times(curve), key_range)] = value
+        points.foreach_set('interpolation', ipos)
 
 def delete_curve_keys_in_range(curves, key_range=None):
     "Delete all keys of the given curves within the given range."
     for curve in flatten_curve_set(curves):
+        if key_range is None:
+            curve.keyframe_points.clear()
+            curve.update()
+            continue
+
+        keep = ~get_key_range_mask(get_curve_key_times(curve), key_range)
+
+        if keep.all():
+            curve.update()
+        elif not keep.any():
+            curve.keyframe_points.clear()
+            curve.update()
+        else:
+            write_keyframe_data(curve, read_keyframe_data(curve), keep)
+
+def delete_curve_keys_at_frames(curves, frames):
+    "Delete the keys of the given curves located at any of the given whole frames."
+    frames = np.array(sorted(frames), dtype=np.float64)
+    for curve in flatten_curve_set(curves):
+        remove = np.isin(np.round(get_curve_key_times(curve)), frames)
+        if remove.any():
+            write_keyframe_data(curve, read_keyframe_data(curve), ~remove)
+
+def get_signed_crc32(data):
+    "Compute the CRC32 of the bytes as a signed 32 bit integer, which fits into an ID property."
+    return zlib.crc32(data) - (1 << 31)
+
+def get_curve_frame_fingerprints(curves, frames):
+    "Compute a fingerprint of the values of all the curves at each of the frames."
+    values = np.empty((len(frames), len(curves)), dtype=np.float32)
+    for i, curve in enumerate(curves):
+        values[:, i] = [curve.evaluate(frame) for frame in frames]
+    return [get_signed_crc32(row.tobytes()) for row in values]
+
+def get_curve_keys_fingerprint(curves):
+    "Compute a fingerprint of the keys of all the curves: their paths, counts, frames and values."
+    data = []
+    for curve in sorted(curves, key=lambda curve: (curve.data_path, curve.array_index)):
         points = curve.keyframe_points
-        for i in range(len(points), 0, -1):
-            key = points[i - 1]
-            if key_range is None or key_range[0] <= key.co[0] <= key_range[1]:
-                points.remove(key, fast=True)
-        curve.update()
+        co = np.empty(len(points) * 2, dtype=np.float32)
+        points.foreach_get('co', co)
+        data += [f"{curve.data_path}[{curve.array_index}]:{len(points)}".encode(), co.tobytes()]
+    return get_signed_crc32(b''.join(data))
 
 def nla_tweak_to_scene(anim_data, frames, invert=False):
     "Convert a frame value or list between scene and tweaked NLA strip time."
@@ -361,11 +947,67 @@ def find_action(action):
 def clean_action_empty_curves(action):
     "Delete completely empty curves from the given action."
     action = find_action(action)
-    for curve in list(action.fcurves):
-        if curve.is_empty:
-            action.fcurves.remove(curve)
+    fcurves = action.fcurves
+    empty = np.zeros(len(fcurves), dtype=bool)
+    fcurves.foreach_get('is_empty', empty)
+    for i in reversed(np.flatnonzero(empty)):
+        fcurves.remove(fcurves[int(i)])
+    invalidate_curve_tables(action)
     action.update_tag()
 
+class ActionKeySnapshot:
+    "Copy of the keys of all curves in an action, used to undo a partially completed bake."
+
+    def __init__(self, action):
+        self.action = action
+        self.action_pointer = action.as_pointer() if action else None
+        self.action_name = action.name if action else None
+        self.curves = []
+        self.pointers = set()
+
+        if action:
+            for curve in action.fcurves:
+                self.curves.append((curve, read_keyframe_data(curve)))
+                self.pointers.add(curve.as_pointer())
+
+    def find_action(self):
+        "Returns the action if it still exists, comparing pointers to never touch a freed one."
+        action = bpy.data.actions.get(self.action_name)
+        if action and action.as_pointer() == self.action_pointer:
+            return action
+        for action in bpy.data.actions:
+            if action.as_pointer() == self.action_pointer:
+                return action
+        return None
+
+    def is_valid(self):
+        "Check that the action and all the curves of the snapshot still exist."
+        if self.action_pointer is None:
+            return True
+        action = self.find_action()
+        return action is not None and self.pointers <= {curve.as_pointer() for curve in action.fcurves}
+
+    def restore(self):
+        "Remove curves created after the snapshot and put back the original keys."
+        if self.action_pointer is None:
+            return
+        action = self.find_action()
+        if action is None:
+            return
+
+        fcurves = action.fcurves
+        for i in reversed(range(len(fcurves))):
+            if fcurves[i].as_pointer() not in self.pointers:
+                fcurves.remove(fcurves[i])
+
+        current = {curve.as_pointer() for curve in fcurves}
+        for curve, data in self.curves:
+            if curve.as_pointer() in current:
+                write_keyframe_data(curve, data)
+
+        invalidate_curve_tables(action)
+        action.update_tag()
+
 TRANSFORM_PROPS_LOCATION = frozenset(['location'])
 TRANSFORM_PROPS_ROTATION = frozenset(['rotation_euler', 'rotation_quaternion', 'rotation_axis_angle'])
 TRANSFORM_PROPS_SCALE = frozenset(['scale'])
@@ -417,9 +1059,21 @@ class ActionCurveTable(FCurveTable):
     def __init__(self, action):
         super().__init__()
         self.action = find_action(action)
+        self.keyed_bones = None
         if self.action:
             self.index_curves(self.action.fcurves)
 
+    def get_keyed_bones(self):
+        "Returns the set of names of pose bones with any curve in the action, computed once per table."
+        if self.keyed_bones is None:
+            names = (get_pose_bone_name_from_path(path) for path in self.curve_map)
+            self.keyed_bones = frozenset(name for name in names if name is not None)
+        return self.keyed_bones
+
+    def get_keyed_bone_subset(self, names):
+        "Returns the set of the given bone names that have any curve in the action."
+        return self.get_keyed_bones().intersection(names)
+
 class DriverCurveTable(FCurveTable):
     "Table for efficient lookup of Driver FCurves by properties."
 
@@ -429,6 +1083,237 @@ class DriverCurveTable(FCurveTable):
         if self.anim_data:
             self.index_curves(self.anim_data.drivers)
 
+#######################
+## Rest pose caching ##
+#######################
+
+# Rest pose matrices never change while animating, so they are cached per armature data
+# block, keyed by its pointer. Editing, leaving edit mode, undo and file load reallocate the
+# bones of the armature, so the depsgraph and undo handlers below drop the entries then.
+_armature_rest_caches = {}
+
+# Incremented whenever bones may have been added, removed or reallocated: on entering and leaving
+# armature edit mode, undo, redo and file load. Caches of bone indices compare against it.
+_bone_structure_serial = 0
+
+def get_bone_structure_serial():
+    return _bone_structure_serial
+
+def bump_bone_structure_serial():
+    global _bone_structure_serial
+    _bone_structure_serial += 1
+
+class ArmatureRestCache:
+    "Rest matrices of the bones of an armature, their inverses and deltas, computed on demand."
+
+    def __init__(self, armature):
+        self.bones = armature.bones
+        self.matrices = {}
+        self.inverses = {}
+        self.deltas = {}
+
+    def get_matrix(self, name):
+        "Returns the rest matrix of the bone in armature space."
+        mat = self.matrices.get(name)
+        if mat is None:
+            mat = self.matrices[name] = self.bones[name].matrix_local.copy().freeze()
+        return mat
+
+    def get_inverse(self, name):
+        "Returns the inverted rest matrix of the bone."
+        mat = self.inverses.get(name)
+        if mat is None:
+            mat = self.inverses[name] = self.get_matrix(name).inverted().freeze()
+        return mat
+
+    def get_delta(self, from_name, to_name):
+        "Returns the rest matrix of to_name relative to from_name."
+        key = (from_name, to_name)
+        mat = self.deltas.get(key)
+        if mat is None:
+            mat = self.deltas[key] = (self.get_inverse(from_name) @ self.get_matrix(to_name)).freeze()
+        return mat
+
+    def get_parent_delta(self, name):
+        "Returns the rest matrix of the bone relative to its parent, or to the armature if it has none."
+        parent = self.bones[name].parent
+        if parent:
+            return self.get_delta(parent.name, name)
+        return self.get_matrix(name)
+
+def get_armature_rest_cache(armature):
+    "Returns the ArmatureRestCache of the armature data, or of the armature of the object."
+    if isinstance(armature, bpy.types.Object):
+        armature = armature.data
+
+    key = armature.as_pointer()
+    cache = _armature_rest_caches.get(key)
+
+    if cache is None:
+        cache = _armature_rest_caches[key] = ArmatureRestCache(armature)
+
+    return cache
+
+def invalidate_rest_caches(armature=None):
+    "Drop the cached rest pose matrices of the armature, or of all armatures."
+    if armature is None:
+        _armature_rest_caches.clear()
+    else:
+        _armature_rest_caches.pop(armature.as_pointer(), None)
+
+#########################
+## Curve table caching ##
+#########################
+
+# Curve tables are kept between operator invocations, keyed by the pointer of the
+# action or the object owning the drivers. Each entry remembers the number of curves
+# it was built from and is rebuilt when that changes. The add-on's own code that
+# removes curves drops the table of the action explicitly, since removing one curve
+# and adding another keeps the count. Undo, file loading and armature edits (which
+# may rename bones, and thus curve paths) drop the entries outright.
+_action_curve_tables = {}
+_driver_curve_tables = {}
+
+def get_curve_collection_fingerprint(curves):
+    "Cheap summary of a curve collection that changes when curves are added or removed."
+    return len(curves)
+
+def get_action_curve_table(action):
+    "Returns a cached ActionCurveTable for the action, rebuilding it if the action changed."
+    action = find_action(action)
+    if action is None:
+        return ActionCurveTable(None)
+
+    key = action.as_pointer()
+    fingerprint = get_curve_collection_fingerprint(action.fcurves)
+    table = _action_curve_tables.get(key)
+
+    if table is None or table.fingerprint != fingerprint:
+        table = ActionCurveTable(action)
+        table.fingerprint = fingerprint
+        _action_curve_tables[key] = table
+
+    return table
+
+def get_driver_curve_table(obj):
+    "Returns a cached DriverCurveTable for the object, rebuilding it if the drivers changed."
+    anim_data = obj.animation_data
+    if anim_data is None:
+        return DriverCurveTable(obj)
+
+    key = obj.as_pointer()
+    fingerprint = (anim_data.as_pointer(), get_curve_collection_fingerprint(anim_data.drivers))
+    table = _driver_curve_tables.get(key)
+
+    if table is None or table.fingerprint != fingerprint:
+        table = DriverCurveTable(obj)
+        table.fingerprint = fingerprint
+        _driver_curve_tables[key] = table
+
+    return table
+
+def invalidate_curve_tables(action=None):
+    "Drop the cached curve table of the action, or all cached tables."
+    if action is None:
+        _action_curve_tables.clear()
+        _driver_curve_tables.clear()
+    else:
+        _action_curve_tables.pop(action.as_pointer(), None)
+
+# Pointers of the armatures last seen in edit mode, to catch the update that leaves it
+_armatures_in_editmode = set()
+
+def get_updated_armature(update):
+    "Returns the original armature data of a depsgraph update of an armature or its object."
+    id = update.id
+    if isinstance(id, bpy.types.Object) and id.type == 'ARMATURE':
+        return id.original.data
+    if isinstance(id, bpy.types.Armature):
+        return id.original
+    return None
+
+@bpy.app.handlers.persistent
+def curve_table_depsgraph_update(scene, depsgraph):
+    # Selecting or toggling bones also updates the armature, so caches are only dropped on
+    # structural changes; curve tables otherwise rely on the fingerprint of each action.
+    for update in depsgraph.updates:
+        armature = get_updated_armature(update)
+        if armature is None:
+            continue
+
+        # Bones are only reallocated while editing, and once more when leaving edit mode
+        key = armature.as_pointer()
+        if armature.is_editmode:
+            _armatures_in_editmode.add(key)
+        elif key in _armatures_in_editmode:
+            _armatures_in_editmode.discard(key)
+        else:
+            continue
+
+        invalidate_rest_caches(armature)
+        invalidate_rig_manifests()
+        invalidate_curve_tables()
+        bump_bone_structure_serial()
+
+# Renaming a bone outside edit mode rewrites the data paths of its curves and changes the keys
+# of the bone caches, but the depsgraph handler above can't tell it from a selection change.
+_bone_rename_owner = object()
+
+def bone_rename_notify():
+    invalidate_curve_tables()
+    invalidate_rest_caches()
+    invalidate_rig_manifests()
+    invalidate_panel_layout_plans()
+    bump_bone_structure_serial()
+
+@bpy.app.handlers.persistent
+def bone_rename_subscribe(*args):
+    "Subscribe to bone renames; message bus subscriptions are dropped when a file is loaded."
+    bpy.msgbus.clear_by_owner(_bone_rename_owner)
+    for key in ((bpy.types.Bone, 'name'), (bpy.types.PoseBone, 'name')):
+        bpy.msgbus.subscribe_rna(key=key, owner=_bone_rename_owner, args=(), notify=bone_rename_notify)
+
+# Counts undo, redo and file load events, which may free any data referenced by running bakes
+_data_reload_serial = 0
+
+def get_data_reload_serial():
+    return _data_reload_serial
+
+@bpy.app.handlers.persistent
+def curve_table_clear(*args):
+    global _data_reload_serial
+    _data_reload_serial += 1
+    _armatures_in_editmode.clear()
+    bump_bone_structure_serial()
+    invalidate_curve_tables()
+    invalidate_rest_caches()
+    invalidate_rig_manifests()
+    invalidate_panel_layout_plans()
+
+CACHE_HANDLERS = (
+    (bpy.app.handlers.depsgraph_update_post, curve_table_depsgraph_update),
+    (bpy.app.handlers.undo_post, curve_table_clear),
+    (bpy.app.handlers.redo_post, curve_table_clear),
+    (bpy.app.handlers.load_post, curve_table_clear),
+    (bpy.app.handlers.load_post, bone_rename_subscribe),
+)
+
+def register_handlers():
+    for handlers, func in CACHE_HANDLERS:
+        if func not in handlers:
+            handlers.append(func)
+    bone_rename_subscribe()
+
+def unregister_handlers():
+    for handlers, func in CACHE_HANDLERS:
+        if func in handlers:
+            handlers.remove(func)
+    bpy.msgbus.clear_by_owner(_bone_rename_owner)
+    invalidate_curve_tables()
+    invalidate_rest_caches()
+    invalidate_rig_manifests()
+    invalidate_panel_layout_plans()
+
 
 ##################################
 # Common bake operator settings ##
@@ -448,6 +1333,72 @@ bpy.types.WindowManager.rigify_transfer_start_frame = bpy.props.IntProperty(
 bpy.types.WindowManager.rigify_transfer_end_frame = bpy.props.IntProperty(
     name="End", description="Last frame to transfer", default=0, min=0
 )
+bpy.types.WindowManager.rigify_transfer_rig_only = bpy.props.BoolProperty(
+    name="Evaluate Rig Only",
+    description="When changing frames during the bake, only evaluate the rig and the objects it depends on "
+                "(parents, constraint targets, driver targets) instead of the whole scene",
+    default=False
+)
+bpy.types.WindowManager.rigify_transfer_profile = bpy.props.BoolProperty(
+    name="Profile Bakes",
+    description="Measure the time spent in each phase of bakes and count frame changes, "
+                "view layer updates and written keys, reporting the result in the info bar",
+    default=False
+)
+bpy.types.WindowManager.rigify_transfer_profile_path = bpy.props.StringProperty(
+    name="Profile Log",
+    description="Optional JSON lines file to append the bake profiles to",
+    subtype='FILE_PATH'
+)
+bpy.types.WindowManager.rigify_transfer_incremental = bpy.props.BoolProperty(
+    name="Incremental Bake",
+    description="Remember the source values of each baked frame, and only re-bake the frames where they "
+                "changed when the same bake is repeated with the same settings",
+    default=False
+)
+bpy.types.WindowManager.rigify_transfer_incremental_margin = bpy.props.IntProperty(
+    name="Changed Frame Margin",
+    description="Number of neighbouring baked frames on each side to re-bake together with every changed frame",
+    default=1, min=0
+)
+bpy.types.WindowManager.rigify_transfer_adaptive = bpy.props.BoolProperty(
+    name="Adaptive Frames",
+    description="After baking the keyed frames, also bake the frames in the middle of the gaps where the "
+                "interpolated result differs from the baked one more than the tolerance, recursively",
+    default=False
+)
+bpy.types.WindowManager.rigify_transfer_adaptive_location = bpy.props.FloatProperty(
+    name="Adaptive Location Tolerance",
+    description="Maximum distance between the interpolated and baked bone positions",
+    subtype='DISTANCE', default=0.005, min=0, precision=4, step=0.1
+)
+bpy.types.WindowManager.rigify_transfer_adaptive_rotation = bpy.props.FloatProperty(
+    name="Adaptive Rotation Tolerance",
+    description="Maximum angle between the interpolated and baked bone orientations",
+    subtype='ANGLE', default=math.radians(1), min=0, precision=3, step=10
+)
+bpy.types.WindowManager.rigify_transfer_reduce_keys = bpy.props.BoolProperty(
+    name="Reduce Keys",
+    description="After baking, remove the keys of the baked bones that aren't needed to keep their world space "
+                "motion within the tolerance",
+    default=False
+)
+bpy.types.WindowManager.rigify_transfer_reduce_location = bpy.props.FloatProperty(
+    name="Location Tolerance",
+    description="Maximum distance between the baked and reduced bone positions",
+    subtype='DISTANCE', default=0.001, min=0, precision=4, step=0.01
+)
+bpy.types.WindowManager.rigify_transfer_reduce_rotation = bpy.props.FloatProperty(
+    name="Rotation Tolerance",
+    description="Maximum angle between the baked and reduced bone orientations",
+    subtype='ANGLE', default=math.radians(0.1), min=0, precision=3, step=1
+)
+bpy.types.WindowManager.rigify_transfer_use_modal = bpy.props.BoolProperty(
+    name="Interactive Bake",
+    description="Run bakes started from the UI in small time slices, showing progress and ETA, "
+                "and allowing to cancel with Esc, which restores the original keys",
+    default=True
+)
 
 class RIGIFY_OT_get_frame_range(bpy.types.Operator):
     bl_idname = "rigify.get_frame_range"
@@ -483,10 +1434,452 @@ class RIGIFY_OT_get_frame_range(bpy.types.Operator):
         row.prop(id_store, 'rigify_transfer_end_frame')
         row.operator(self.bl_idname, icon='TIME', text='')
 
+#############################
+## Offline pose evaluation ##
+#############################
+
+def get_axis_rotation_matrices(axis, angles):
+    "Returns an array of rotation matrices around the X, Y or Z axis by the given angles."
+    cos, sin = np.cos(angles), np.sin(angles)
+    i, j = [(1, 2), (2, 0), (0, 1)][axis]
+    result = np.zeros((len(angles), 3, 3))
+    result[:, axis, axis] = 1
+    result[:, i, i] = cos
+    result[:, i, j] = -sin
+    result[:, j, i] = sin
+    result[:, j, j] = cos
+    return result
+
+def euler_array_to_matrices(eulers, order):
+    "Converts an array of euler rotations to rotation matrices, like mathutils.Euler.to_matrix."
+    result = None
+    for char in order:
+        axis = 'XYZ'.index(char)
+        mat = get_axis_rotation_matrices(axis, eulers[:, axis])
+        result = mat if result is None else mat @ result
+    return result
+
+def quaternion_array_to_matrices(quats):
+    "Converts an array of (w, x, y, z) quaternions to rotation matrices, normalizing them."
+    length = np.linalg.norm(quats, axis=1)
+    quats = np.where(length[:, None] > 1e-8, quats / np.maximum(length, 1e-8)[:, None], [1, 0, 0, 0])
+    w, x, y, z = quats.T
+    return np.stack([
+        np.stack([1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y)], axis=-1),
+        np.stack([2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x)], axis=-1),
+        np.stack([2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)], axis=-1),
+    ], axis=1)
+
+def axis_angle_array_to_matrices(values):
+    "Converts an array of (angle, x, y, z) axis angle rotations to rotation matrices."
+    angle, axis = values[:, 0], values[:, 1:]
+    length = np.linalg.norm(axis, axis=1)
+    axis = np.where(length[:, None] > 1e-8, axis / np.maximum(length, 1e-8)[:, None], 0)
+    quats = np.concatenate([np.cos(angle / 2)[:, None], axis * np.sin(angle / 2)[:, None]], axis=1)
+    return quaternion_array_to_matrices(quats)
+
+def evaluate_property_array(ptr, prop, size, frames, curve_table):
+    "Evaluates the property at the frames from its curves in the table, using the current value for the rest."
+    values = np.tile(np.array(getattr(ptr, prop), dtype=float), (len(frames), 1))
+    curves = curve_table.get_prop_curves(ptr, prop)
+
+    for index, fcu in (curves or {}).items():
+        if index < size and not fcu.mute and not (fcu.group and fcu.group.mute):
+            values[:, index] = [fcu.evaluate(frame) for frame in frames]
+
+    return values
+
+def evaluate_basis_matrices(bone, frames, curve_table):
+    "Computes the matrix_basis of the pose bone at the frames from its curves."
+    loc = evaluate_property_array(bone, 'location', 3, frames, curve_table)
+    scale = evaluate_property_array(bone, 'scale', 3, frames, curve_table)
+
+    if bone.rotation_mode == 'QUATERNION':
+        rot = quaternion_array_to_matrices(
+            evaluate_property_array(bone, 'rotation_quaternion', 4, frames, curve_table))
+    elif bone.rotation_mode == 'AXIS_ANGLE':
+        rot = axis_angle_array_to_matrices(
+            evaluate_property_array(bone, 'rotation_axis_angle', 4, frames, curve_table))
+    else:
+        rot = euler_array_to_matrices(
+            evaluate_property_array(bone, 'rotation_euler', 3, frames, curve_table), bone.rotation_mode)
+
+    result = np.zeros((len(frames), 4, 4))
+    result[:, :3, :3] = rot * scale[:, None, :]
+    result[:, :3, 3] = loc
+    result[:, 3, 3] = 1
+    return result
+
+def get_driven_pose_bone_names(obj):
+    "Returns the names of the bones with drivers on the object or the armature bone properties."
+    driven = set()
+    if obj.animation_data:
+        driven.update(get_pose_bone_name_from_path(fcu.data_path) for fcu in obj.animation_data.drivers)
+    if obj.data.animation_data:
+        driven.update(get_pose_bone_name_from_path('pose.' + fcu.data_path) for fcu in obj.data.animation_data.drivers)
+    return driven
+
+def get_offline_pose_bones(obj, bone_names, dependencies):
+    """Returns the given bones and all their parents, parents first, if their pose follows only
+    from the rest pose, parenting and their own action curves; otherwise returns None."""
+    anim_data = obj.animation_data
+
+    if obj.data.pose_position != 'POSE':
+        return None
+
+    if anim_data:
+        if anim_data.use_tweak_mode or anim_data.action_influence < 1 or anim_data.action_blend_type != 'REPLACE':
+            return None
+        if anim_data.use_nla and any(not track.mute for track in anim_data.nla_tracks):
+            return None
+
+    driven = get_driven_pose_bone_names(obj)
+    result = []
+    visited = set()
+
+    def add_bone(bone):
+        if bone.name in visited:
+            return True
+        visited.add(bone.name)
+
+        if bone.parent and not add_bone(bone.parent):
+            return False
+
+        if bone.name in driven:
+            return False
+        if any(con.enabled and con.influence > 0 for con in bone.constraints):
+            return False
+        if dependencies.get(bone.name, set()) - {bone.parent and bone.parent.name}:
+            return False
+
+        data = bone.bone
+        if not data.use_inherit_rotation or data.inherit_scale != 'FULL' or not data.use_local_location:
+            return False
+
+        result.append(bone)
+        return True
+
+    if all(add_bone(obj.pose.bones[name]) for name in bone_names):
+        return result
+
+    return None
+
+def evaluate_offline_pose_matrices(obj, bone_names, frames, curve_table, dependencies):
+    """Computes the pose space matrices of the bones at the given action frames directly from the
+    curves, without evaluating the scene. Returns a list of lists of matrices for each frame,
+    or None if some of the bones or their parents are affected by anything other than curves."""
+    bones = get_offline_pose_bones(obj, bone_names, dependencies)
+    if bones is None:
+        return None
+
+    frames = list(frames)
+    rest_cache = get_armature_rest_cache(obj)
+    pose = {}
+
+    for bone in bones:
+        delta = np.array(rest_cache.get_parent_delta(bone.name))
+        basis = evaluate_basis_matrices(bone, frames, curve_table)
+
+        if bone.parent:
+            pose[bone.name] = pose[bone.parent.name] @ delta @ basis
+        else:
+            pose[bone.name] = delta @ basis
+
+    return [
+        [Matrix(pose[name][i].tolist()) for name in bone_names]
+        for i in range(len(frames))
+    ]
+
+
+#########################
+## Baked key reduction ##
+#########################
+
+def get_matrix_array_errors(matrices, reference, length):
+    """Returns the distances and rotation angles between two arrays of 4x4 matrices. The distance
+    is the largest one between the origins and the ends of the axes scaled by the length, which
+    can be a number or an array with one length per matrix."""
+    offsets = matrices - reference
+    length = np.reshape(length, (-1, 1))
+    distance = np.linalg.norm(offsets[:, :3, 3], axis=1)
+    for axis in range(3):
+        distance = np.maximum(distance, np.linalg.norm(offsets[:, :3, 3] + offsets[:, :3, axis] * length, axis=1))
+
+    def normalize(rot):
+        return rot / np.maximum(np.linalg.norm(rot, axis=1), 1e-8)[:, None, :]
+
+    delta = np.swapaxes(normalize(matrices[:, :3, :3]), 1, 2) @ normalize(reference[:, :3, :3])
+    angle = np.arccos(np.clip((np.trace(delta, axis1=1, axis2=2) - 1) / 2, -1, 1))
+    return distance, angle
+
+def get_bone_transform_curves(bone, curve_table):
+    "Returns the curves of the location, rotation and scale of the pose bone in its rotation mode."
+    if bone.rotation_mode == 'QUATERNION':
+        rotation = 'rotation_quaternion'
+    elif bone.rotation_mode == 'AXIS_ANGLE':
+        rotation = 'rotation_axis_angle'
+    else:
+        rotation = 'rotation_euler'
+    return list(curve_table.list_all_prop_curves(bone, ('location', rotation, 'scale')))
+
+class BakeKeyReducer:
+    """Removes baked keys of the output bones that aren't needed to reproduce the baked motion.
+    The world matrices of the parents are recorded while baking, so that the world space result
+    of any set of keys can be computed from the curves. Starting with the first and last baked
+    key of a bone, keys are added back in the middle of the worst frame of every segment until
+    all baked frames are within the tolerance. Parents are reduced before their children, and
+    the children are checked against the reduced parents, so the tolerance holds for the chain.
+    Only bones that follow from their parent and their own curves are reduced."""
+
+    def __init__(self, obj, bone_names, frames, dependencies):
+        rest_cache = get_armature_rest_cache(obj)
+        driven = get_driven_pose_bone_names(obj)
+        outputs = set(bone_names)
+
+        self.obj = obj
+        self.bones = []
+        self.frame_index = {frame: i for i, frame in enumerate(frames)}
+
+        for name in sorted(bone_names, key=lambda name: len(obj.pose.bones[name].parent_recursive)):
+            bone = obj.pose.bones[name]
+            data = bone.bone
+
+            if name in driven or any(con.enabled and con.influence > 0 for con in bone.constraints):
+                continue
+            if dependencies.get(name, set()) - {bone.parent and bone.parent.name}:
+                continue
+            if not data.use_inherit_rotation or data.inherit_scale != 'FULL' or not data.use_local_location:
+                continue
+            # The pose of the parent must be known before the bone is baked
+            if bone.parent and bone.parent.name not in self.get_bone_names():
+                if bones_depend_on(dependencies, [bone.parent.name], outputs):
+                    continue
+
+            self.bones.append(bone)
+
+        reduced = set(self.get_bone_names())
+        self.recorded = [
+            bone for bone in self.bones if not (bone.parent and bone.parent.name in reduced)
+        ]
+        self.deltas = {bone.name: np.array(rest_cache.get_parent_delta(bone.name)) for bone in self.bones}
+        self.parent_matrices = np.zeros((len(frames), len(self.recorded), 4, 4))
+        self.frames = list(frames)
+
+    def get_bone_names(self):
+        return [bone.name for bone in self.bones]
+
+    def record_frame(self, frame):
+        "Record the world matrices of the parents at the current frame, before baking it."
+        row = self.frame_index.get(frame)
+
+        if row is None:
+            row = self.frame_index[frame] = len(self.frames)
+            self.frames.append(frame)
+            self.parent_matrices = np.concatenate([self.parent_matrices, np.zeros_like(self.parent_matrices[:1])])
+        world = self.obj.matrix_world
+
+        for i, bone in enumerate(self.recorded):
+            self.parent_matrices[row, i] = world @ bone.parent.matrix if bone.parent else world
+
+    def reduce(self, to_raw, location_tolerance, rotation_tolerance):
+        """Remove the keys that are not needed, returning the number of removed keys.
+        The to_raw callback converts the recorded scene frames to action frames."""
+        curve_table = get_action_curve_table(self.obj)
+        order = np.argsort(self.frames)
+        frames_raw = np.array(to_raw([self.frames[i] for i in order]), dtype=np.float64)
+        parents = {bone.name: self.parent_matrices[order, i] for i, bone in enumerate(self.recorded)}
+        world = {}
+        removed = 0
+
+        for bone in self.bones:
+            parent = world[bone.parent.name] if bone.parent and bone.parent.name in world else parents[bone.name]
+            parent = parent @ self.deltas[bone.name]
+            reference = parent @ evaluate_basis_matrices(bone, frames_raw, curve_table)
+
+            keys = [(curve, read_keyframe_data(curve)) for curve in get_bone_transform_curves(bone, curve_table)]
+            times = [np.round(data['co'][:, 0], 3) for _, data in keys]
+            baked = [np.isin(key_times, np.round(frames_raw, 3)) for key_times in times]
+
+            if not any(mask.any() for mask in baked):
+                world[bone.name] = reference
+                continue
+
+            kept = {0, len(frames_raw) - 1}
+
+            while True:
+                kept_frames = np.round(frames_raw[sorted(kept)], 3)
+                masks = [~mask | np.isin(key_times, kept_frames) for mask, key_times in zip(baked, times)]
+
+                for (curve, data), mask in zip(keys, masks):
+                    write_keyframe_data(curve, data, mask)
+
+                matrices = parent @ evaluate_basis_matrices(bone, frames_raw, curve_table)
+                distance, angle = get_matrix_array_errors(matrices, reference, bone.length)
+                error = np.maximum(distance / max(location_tolerance, 1e-8), angle / max(rotation_tolerance, 1e-8))
+
+                added = set()
+                bounds = sorted(kept)
+                for start, end in zip(bounds, bounds[1:]):
+                    if end - start > 1:
+                        worst = start + 1 + int(np.argmax(error[start + 1:end]))
+                        if error[worst] > 1:
+                            added.add(worst)
+
+                if not added:
+                    break
+
+                kept |= added
+
+            world[bone.name] = matrices
+            removed += sum(np.count_nonzero(mask & ~keep) for mask, keep in zip(baked, masks))
+
+        count_bake_event('reduced_keys', removed)
+        return removed
+
+
+########################
+## Bake state storage ##
+########################
+
+class BakeStateStore:
+    """Dictionary-like storage of the saved state of each bake frame in preallocated arrays.
+    The layout is taken from the first stored state: 4x4 matrices go to a frames x matrices
+    x 4 x 4 array, numbers to a frames x scalars array, and lists, tuples and None keep their
+    structure. States that don't match the layout are kept as they are. Reading a frame
+    rebuilds the state, creating the Matrix objects from views of the arrays."""
+
+    def __init__(self):
+        self.frame_index = {}
+        self.layout = None
+        self.matrices = None
+        self.scalars = None
+        self.filled = None
+        self.extra = {}
+
+    def set_frames(self, frames):
+        "Set the frames that will be stored, dropping any stored data."
+        self.frame_index = {frame: i for i, frame in enumerate(frames)}
+        self.layout = self.matrices = self.scalars = self.filled = None
+        self.extra = {}
+
+    @property
+    def nbytes(self):
+        if self.layout is None:
+            return 0
+        return self.matrices.nbytes + self.scalars.nbytes + self.filled.nbytes
+
+    @staticmethod
+    def build_layout(value, counts):
+        if isinstance(value, Matrix) and len(value) == 4 and len(value.col) == 4:
+            counts[0] += 1
+            return ('matrix', counts[0] - 1)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            counts[1] += 1
+            return ('scalar', counts[1] - 1, type(value))
+        elif value is None:
+            return ('none',)
+        elif isinstance(value, (list, tuple)):
+            items = [BakeStateStore.build_layout(item, counts) for item in value]
+            if None in items:
+                return None
+            return ('sequence', type(value), items)
+        else:
+            return None
+
+    def write(self, layout, row, value):
+        kind = layout[0]
+
+        if kind == 'matrix':
+            if not isinstance(value, Matrix) or len(value) != 4 or len(value.col) != 4:
+                return False
+            self.matrices[row, layout[1]] = value
+        elif kind == 'scalar':
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                return False
+            self.scalars[row, layout[1]] = value
+        elif kind == 'none':
+            return value is None
+        else:
+            if not isinstance(value, layout[1]) or len(value) != len(layout[2]):
+                return False
+            return all(self.write(item, row, sub) for item, sub in zip(layout[2], value))
+
+        return True
+
+    def read(self, layout, row):
+        kind = layout[0]
+
+        if kind == 'matrix':
+            return Matrix(self.matrices[row, layout[1]])
+        elif kind == 'scalar':
+            return layout[2](self.scalars[row, layout[1]])
+        elif kind == 'none':
+            return None
+        else:
+            return layout[1](self.read(item, row) for item in layout[2])
+
+    def __setitem__(self, frame, state):
+        row = self.frame_index[frame]
+        self.extra.pop(frame, None)
+
+        if self.layout is None:
+            counts = [0, 0]
+            layout = self.build_layout(state, counts)
+
+            if layout is None:
+                self.extra[frame] = state
+                return
+
+            self.layout = layout
+            self.matrices = np.zeros((len(self.frame_index), counts[0], 4, 4), dtype=np.float32)
+            self.scalars = np.zeros((len(self.frame_index), counts[1]), dtype=np.float64)
+            self.filled = np.zeros(len(self.frame_index), dtype=bool)
+            count_bake_event('bake_state_bytes', self.nbytes)
+
+        if self.write(self.layout, row, state):
+            self.filled[row] = True
+        else:
+            self.filled[row] = False
+            self.extra[frame] = state
+
+    def __getitem__(self, frame):
+        if frame in self.extra:
+            return self.extra[frame]
+
+        row = self.frame_index[frame]
+        if self.layout is None or not self.filled[row]:
+            raise KeyError(frame)
+
+        return self.read(self.layout, row)
+
+    def get(self, frame, default=None):
+        try:
+            return self[frame]
+        except KeyError:
+            return default
+
+    def __contains__(self, frame):
+        if frame in self.extra:
+            return True
+        row = self.frame_index.get(frame)
+        return row is not None and self.layout is not None and bool(self.filled[row])
+
+    def update(self, items):
+        for frame, state in items:
+            self[frame] = state
+
+
 #######################################
 # Keyframe baking operator framework ##
 #######################################
 
+def get_property_annotations(cls):
+    "Collect the property annotations of the class and its bases."
+    annotations = {}
+    for base in reversed(cls.__mro__):
+        annotations.update(vars(base).get('__annotations__', {}))
+    return annotations
+
 class RigifyOperatorMixinBase:
     bl_options = {'UNDO', 'INTERNAL'}
 
@@ -502,8 +1895,327 @@ class RigifyOperatorMixinBase:
     def after_save_state(self, context, rig):
         "Override to undo before_save_state."
 
+    def get_rig_module(self, context, *kinds):
+        "Returns the rig manifest module given by the module property, or None if it is not set."
+        if not getattr(self, 'module', ''):
+            return None
+
+        obj = getattr(self, 'bake_rig', None) or context.active_object
+        module = get_rig_manifest(obj).modules.get(self.module)
+
+        if module is None or module.kind not in kinds:
+            raise ValueError(f"Unknown {'/'.join(kinds)} module '{self.module}' in {obj.name}")
+
+        return module
+
+    # Pose bones of the bone name list attributes, resolved by the rig module
+    module_bones = None
+
+    def set_module_bones(self, module, **roles):
+        "Take the pose bones of the bone name list attributes from the roles of the module."
+        self.module_bones = {attr: module.get_bones(role) for attr, role in roles.items()}
+
+    def get_pose_bones(self, obj, attr):
+        "Returns the pose bones of a bone name list attribute, resolved by the rig module if possible."
+        if self.module_bones is not None and attr in self.module_bones:
+            return self.module_bones[attr]
+        return [obj.pose.bones[name] for name in getattr(self, attr)]
+
+    # Bone update planners of the rigs, reused for the rest of the operator run
+    bone_update_planners = None
+
+    def get_bone_update_planner(self, obj):
+        "Returns a BoneUpdatePlanner for the rig, reused for the rest of the operator run."
+        if self.bone_update_planners is None:
+            self.bone_update_planners = {}
+
+        key = obj.as_pointer()
+        if key not in self.bone_update_planners:
+            self.bone_update_planners[key] = BoneUpdatePlanner(obj)
+        return self.bone_update_planners[key]
+
+
+class RigifyBakeRunnerMixin(RigifyOperatorMixinBase):
+    """Runs a bake defined as a generator of per-frame steps, either at once or as a modal operator."""
+
+    # Set by bake_start when it changed data even though there is nothing left to bake,
+    # so that the operator finishes and pushes an undo step instead of cancelling.
+    bake_changed_data = False
+
+    def bake_start(self, context):
+        """Override to initialize the bake, setting bake_frames, bake_current_frame, bake_total_steps
+        and bake_generator. Returns False if there is nothing to bake."""
+        raise NotImplementedError()
+
+    def bake_get_rigs(self):
+        "Override to return the rigs affected by the bake."
+        raise NotImplementedError()
+
+    def bake_init_timing(self):
+        self.bake_frame_time = 0.0
+        self.bake_frame_count = 0
+        self.bake_full_frame_time = None
+        self.bake_isolation = None
+
+    def bake_frame_set(self, scene, frame):
+        "Change the current frame, keeping track of the time spent evaluating it."
+        start = time.perf_counter()
+        scene_frame_set(scene, frame)
+        self.bake_frame_time += time.perf_counter() - start
+        self.bake_frame_count += 1
+
+    @contextlib.contextmanager
+    def bake_evaluation_scope(self, context):
+        "Restrict frame evaluation to the rigs and their dependencies if enabled in the settings."
+        set_bake_phase('bake_evaluation_scope')
+
+        if not context.window_manager.rigify_transfer_rig_only:
+            yield
+            return
+
+        scene = context.scene
+        first = self.bake_frames[0]
+
+        # Time one full scene evaluation as the reference for the speedup report
+        start = time.perf_counter()
+        scene_frame_set(scene, first)
+        self.bake_full_frame_time = time.perf_counter() - start
+
+        with RigOnlyEvaluation(context, *self.bake_get_rigs()) as isolation:
+            self.bake_isolation = isolation
+            # Let the depsgraph rebuild before any frames are timed
+            scene_frame_set(scene, first)
+            yield
+
+    def report_bake_evaluation(self):
+        "Report the per-frame speedup of the rig-only evaluation mode."
+        isolation = self.bake_isolation
+        if isolation and self.bake_frame_count and self.bake_full_frame_time:
+            average = self.bake_frame_time / self.bake_frame_count
+            speedup = self.bake_full_frame_time / max(average, 1e-9)
+            self.report(
+                {'INFO'},
+                f"Rig-only evaluation: {isolation.evaluated_count} of {isolation.total} objects evaluated, "
+                f"{speedup:.1f}x faster per frame"
+            )
+
+    def bake_profile_scope(self):
+        return self.bake_profiler or contextlib.nullcontext()
+
+    def report_bake_profile(self, context):
+        "Report the profile of a finished bake, adding it to the history and the log file."
+        if not self.bake_profiler:
+            return
+
+        record = self.bake_profiler.get_record(self.bake_get_rigs(), len(self.bake_frames))
+        bake_profile_history.append(record)
+        self.report({'INFO'}, BakeProfiler.format_record(record))
+
+        path = context.window_manager.rigify_transfer_profile_path
+        if path:
+            try:
+                with open(bpy.path.abspath(path), 'a') as fp:
+                    fp.write(json.dumps(record) + '\n')
+            except OSError as e:
+                self.report({'WARNING'}, 'Could not write the bake profile: ' + str(e))
+
+    def bake_step(self, context):
+        "Performs one step of the bake. Returns False when the bake is complete."
+        with self.bake_profile_scope():
+            try:
+                if self.bake_done_steps == 0:
+                    next(self.bake_generator)
+                else:
+                    self.bake_generator.send(context)
+            except StopIteration:
+                return False
+
+        self.bake_done_steps += 1
+        return True
+
+    def execute(self, context):
+        wm = context.window_manager
+        self.bake_profiler = BakeProfiler(self) if wm.rigify_transfer_profile else None
+
+        with self.bake_profile_scope():
+            if not self.bake_start(context):
+                return {'FINISHED'} if self.bake_changed_data else {'CANCELLED'}
+
+        self.bake_done_steps = 0
+
+        if getattr(self, 'bake_invoked', False) and context.window and wm.rigify_transfer_use_modal:
+            return self.bake_modal_start(context)
+
+        try:
+            while self.bake_step(context):
+                pass
+
+            self.report_bake_evaluation()
+            self.report_bake_profile(context)
+
+        except Exception as e:
+            traceback.print_exc()
+            self.report({'ERROR'}, 'Exception: ' + str(e))
+
+        return {'FINISHED'}
+
+    # Modal execution
+    BAKE_TIMER_INTERVAL = 0.02
+    BAKE_TIME_SLICE = 0.05
+
+    def bake_modal_start(self, context):
+        wm = context.window_manager
+
+        rigs = self.bake_get_rigs()
+        self.bake_snapshots = [ActionKeySnapshot(find_action(rig)) for rig in rigs]
+        self.bake_rig_keys = [(rig.name, rig.as_pointer()) for rig in rigs]
+        self.bake_reload_serial = get_data_reload_serial()
+        self.bake_bone_serial = get_bone_structure_serial()
+        self.bake_active_time = 0.0
+        self.bake_timer = wm.event_timer_add(self.BAKE_TIMER_INTERVAL, window=context.window)
+
+        self.bake_progress_total = self.bake_total_steps
+        wm.progress_begin(0, self.bake_progress_total)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def bake_modal_end(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self.bake_timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+
+    def bake_modal_status(self, context):
+        wm = context.window_manager
+        done = self.bake_done_steps
+        rate = done / max(self.bake_active_time, 1e-6)
+        eta = (self.bake_total_steps - done) / max(rate, 1e-6)
+
+        # Adaptive refinement adds steps while baking
+        if self.bake_total_steps > self.bake_progress_total:
+            self.bake_progress_total = self.bake_total_steps
+            wm.progress_begin(0, self.bake_progress_total)
+
+        wm.progress_update(min(done, self.bake_progress_total))
+        context.workspace.status_text_set(
+            f"Baking {self.bl_label}: {done}/{self.bake_total_steps} frame steps, "
+            f"{rate:.1f} steps/s, ETA {eta:.0f}s (Esc to cancel)"
+        )
+
+    # Events passed on to the rest of the UI while baking. Anything else could undo, delete
+    # or change the mode of the rig and pull the action or its curves from under the bake,
+    # so only view navigation and timers get through.
+    BAKE_PASS_THROUGH_EVENTS = frozenset([
+        'NONE', 'MOUSEMOVE', 'INBETWEEN_MOUSEMOVE', 'MIDDLEMOUSE',
+        'WHEELUPMOUSE', 'WHEELDOWNMOUSE', 'WHEELINMOUSE', 'WHEELOUTMOUSE',
+        'TRACKPADPAN', 'TRACKPADZOOM', 'MOUSEROTATE', 'MOUSESMARTZOOM', 'NDOF_MOTION',
+        'LEFT_CTRL', 'RIGHT_CTRL', 'LEFT_SHIFT', 'RIGHT_SHIFT', 'LEFT_ALT', 'RIGHT_ALT', 'OSKEY',
+        'WINDOW_DEACTIVATE', 'TIMER', 'TIMER_REPORT', 'TIMERREGION',
+    ])
+
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            return self.cancel_bake(context)
+
+        if event.type != 'TIMER' or event.timer != self.bake_timer:
+            if event.type in self.BAKE_PASS_THROUGH_EVENTS:
+                return {'PASS_THROUGH'}
+            return {'RUNNING_MODAL'}
+
+        if not self.bake_check_data(context):
+            self.bake_abort(context)
+            self.report({'ERROR'}, 'The rig or its action changed during the bake, bake cancelled.')
+            return {'CANCELLED'}
+
+        start = time.perf_counter()
+
+        try:
+            while time.perf_counter() - start < self.BAKE_TIME_SLICE:
+                if not self.bake_step(context):
+                    self.bake_active_time += time.perf_counter() - start
+                    self.bake_modal_end(context)
+                    self.report(
+                        {'INFO'},
+                        f"Baked {len(self.bake_frames)} frames in {self.bake_active_time:.1f}s"
+                    )
+                    self.report_bake_evaluation()
+                    self.report_bake_profile(context)
+                    return {'FINISHED'}
+
+        except Exception as e:
+            traceback.print_exc()
+            self.report({'ERROR'}, 'Exception: ' + str(e))
+            self.bake_abort(context)
+            return {'CANCELLED'}
+
+        self.bake_active_time += time.perf_counter() - start
+        self.bake_modal_status(context)
+        return {'RUNNING_MODAL'}
+
+    def bake_check_data(self, context):
+        "Check that the rigs, their actions and the curves being baked still exist unchanged."
+        rigs = [bpy.data.objects.get(name) for name, _pointer in self.bake_rig_keys]
+        if any(rig is None or rig.as_pointer() != pointer
+               for rig, (_name, pointer) in zip(rigs, self.bake_rig_keys)):
+            return False
+
+        # Rig modules hold pose bones, which may have been reallocated
+        if get_bone_structure_serial() != self.bake_bone_serial:
+            return False
 
-class RigifyBakeKeyframesMixin(RigifyOperatorMixinBase):
+        # Curves can only vanish behind the bake's back through undo or reload,
+        # since the modal handler swallows editing events.
+        serial = get_data_reload_serial()
+        check_curves = serial != self.bake_reload_serial
+        self.bake_reload_serial = serial
+
+        for rig, snapshot in zip(rigs, self.bake_snapshots):
+            if rig.mode == 'EDIT':
+                return False
+            action = find_action(rig)
+            if (action.as_pointer() if action else None) != snapshot.action_pointer:
+                return False
+            if check_curves and not snapshot.is_valid():
+                return False
+
+        return True
+
+    def bake_restore_snapshots(self):
+        for snapshot in self.bake_snapshots:
+            snapshot.restore()
+
+    def bake_abort(self, context):
+        "Stops a modal bake, restoring the action to the state before the bake."
+        try:
+            self.bake_generator.close()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.bake_restore_snapshots()
+            scene_frame_set(context.scene, self.bake_current_frame)
+            self.bake_modal_end(context)
+
+    def cancel_bake(self, context):
+        "Aborts a modal bake on user request."
+        self.bake_abort(context)
+        self.report({'WARNING'}, 'Bake cancelled.')
+        return {'CANCELLED'}
+
+    def cancel(self, context):
+        # Called by Blender when the modal operator is terminated, e.g. the window is closed
+        self.bake_abort(context)
+
+    def invoke(self, context, event):
+        self.init_invoke(context)
+        self.bake_invoked = True
+
+        if hasattr(self, 'draw'):
+            return context.window_manager.invoke_props_dialog(self)
+        else:
+            return context.window_manager.invoke_confirm(self, event)
+
+
+class RigifyBakeKeyframesMixin(RigifyBakeRunnerMixin):
     """Basic framework for an operator that updates a set of keyed frames."""
 
     # Utilities
@@ -563,15 +2275,16 @@ class RigifyBakeKeyframesMixin(RigifyOperatorMixinBase):
             set_curve_key_interpolation(prop_curves, 'CONSTANT', range_raw)
 
     # Default behavior implementation
-    def bake_init(self, context):
-        self.bake_rig = context.active_object
+    def bake_init(self, context, rig=None):
+        self.bake_rig = rig or context.active_object
         self.bake_anim = self.bake_rig.animation_data
         self.bake_frame_range = RIGIFY_OT_get_frame_range.get_range(context)
         self.bake_frame_range_raw = self.nla_to_raw(self.bake_frame_range)
-        self.bake_curve_table = ActionCurveTable(self.bake_rig)
+        self.bake_curve_table = get_action_curve_table(self.bake_rig)
         self.bake_current_frame = context.scene.frame_current
         self.bake_frames_raw = set()
-        self.bake_state = dict()
+        self.bake_state = BakeStateStore()
+        self.bake_init_timing()
 
         self.keyflags = get_keying_flags(context)
         self.keyflags_switch = None
@@ -579,10 +2292,14 @@ class RigifyBakeKeyframesMixin(RigifyOperatorMixinBase):
         if context.window_manager.rigify_transfer_use_all_keys:
             self.bake_add_curve_frames(self.bake_curve_table.curve_map)
 
+    def bake_get_rigs(self):
+        return [self.bake_rig]
+
     def bake_add_frames_done(self):
         "Computes and sets the final set of frames to bake."
         frames = self.nla_from_raw(self.bake_frames_raw)
         self.bake_frames = sorted(set(map(round, frames)))
+        self.bake_state.set_frames(self.bake_frames)
 
     def is_bake_empty(self):
         return len(self.bake_frames_raw) == 0
@@ -607,47 +2324,454 @@ class RigifyBakeKeyframesMixin(RigifyOperatorMixinBase):
         range = self.get_bake_range()
         return range, self.nla_to_raw(range)
 
+    # The bake passes are generators that yield after processing each frame, receiving the
+    # current context back. This lets execute run them to completion at once, and modal
+    # run them in time slices between UI events, where the original context is not valid.
     def bake_save_state(self, context):
         "Scans frames and collects data for baking before changing anything."
+        set_bake_phase('bake_save_state')
         rig = self.bake_rig
-        scene = context.scene
         saved_state = self.bake_state
 
+        if self.bake_use_offline:
+            return context
+
         try:
             self.before_save_state(context, rig)
 
             for frame in self.bake_frames:
-                scene.frame_set(frame)
+                self.bake_frame_set(context.scene, frame)
                 saved_state[frame] = self.save_frame_state(context, rig)
+                context = yield
 
         finally:
             self.after_save_state(context, rig)
 
+        return context
+
     def bake_clean_curves_in_range(self, context, curves):
         "Deletes all keys from the given curves in the bake range."
+        set_bake_phase('bake_clean_curves_in_range')
         range, range_raw = self.get_bake_range_pair()
 
-        context.scene.frame_set(range[0])
-        delete_curve_keys_in_range(curves, range_raw)
+        self.bake_frame_set(context.scene, range[0])
+
+        if self.bake_incremental_frames is not None:
+            delete_curve_keys_at_frames(curves, self.nla_to_raw(sorted(self.bake_incremental_frames)))
+        else:
+            delete_curve_keys_in_range(curves, range_raw)
 
         return range, range_raw
 
     def bake_apply_state(self, context):
         "Scans frames and applies the baking operation."
+        set_bake_phase('bake_apply_state')
         rig = self.bake_rig
-        scene = context.scene
         saved_state = self.bake_state
 
-        for frame in self.bake_frames:
-            scene.frame_set(frame)
-            self.apply_frame_state(context, rig, saved_state.get(frame))
+        with KeyframeBatchWriter(context) as writer:
+            for frame in self.bake_frames:
+                self.bake_frame_set(context.scene, frame)
+                self.bake_record_reduction_frame(frame)
+                self.apply_frame_state(context, rig, saved_state.get(frame))
+                writer.flush()
+
+                with writer.suspended():
+                    context = yield
+
+        self.bake_finish(context)
+
+    def bake_get_input_bones(self):
+        "Override to return the bones read by save_frame_state, enabling the single pass bake."
+        return None
+
+    def bake_get_output_bones(self):
+        "Override to return the bones written by apply_frame_state, enabling the single pass bake."
+        return None
+
+    def bake_get_offline_state_bones(self):
+        """Override to return the bones whose pose matrices are the whole saved frame state, which
+        allows computing it directly from the curves when they are plain FK bones."""
+        return None
+
+    def bake_compute_offline_state(self):
+        """Computes the saved state of all frames from the curves without evaluating the scene,
+        if possible. Returns True on success."""
+        bones = self.bake_get_offline_state_bones()
+        if not bones:
+            return False
+
+        set_bake_phase('bake_offline_state')
+
+        rig = self.bake_rig
+        matrices = evaluate_offline_pose_matrices(
+            rig, bones, self.nla_to_raw(self.bake_frames),
+            get_action_curve_table(rig), self.get_bone_update_planner(rig).dependencies,
+        )
+
+        if matrices is None:
+            return False
+
+        self.bake_state.update(zip(self.bake_frames, matrices))
+        count_bake_event('offline_state_frames', len(self.bake_frames))
+        return True
+
+    def bake_can_stream(self):
+        "Check if the output bones don't affect the input bones, so that each frame can be saved and applied at once."
+        inputs = self.bake_get_input_bones()
+        outputs = self.bake_get_output_bones()
+
+        if not inputs or not outputs:
+            return False
+
+        return not bones_depend_on(get_bone_dependency_map(self.bake_rig), inputs, outputs)
+
+    def bake_stream_state(self, context, curves):
+        "Scans frames once, saving and immediately applying the state of each frame."
+        rig = self.bake_rig
 
+        range, range_raw = self.bake_clean_curves_in_range(context, curves)
+
+        self.execute_before_apply(context, rig, range, range_raw)
+
+        set_bake_phase('bake_stream_state')
+
+        try:
+            self.before_save_state(context, rig)
+
+            with KeyframeBatchWriter(context) as writer:
+                for frame in self.bake_frames:
+                    self.bake_frame_set(context.scene, frame)
+                    state = self.save_frame_state(context, rig)
+                    self.bake_record_reduction_frame(frame)
+                    self.apply_frame_state(context, rig, state)
+                    writer.flush()
+
+                    with writer.suspended():
+                        context = yield
+
+            if self.bake_supports_adaptive and context.window_manager.rigify_transfer_adaptive:
+                context = yield from self.bake_refine_adaptive(context)
+
+        finally:
+            self.after_save_state(context, rig)
+
+        self.bake_finish(context)
+
+    bake_supports_adaptive = False
+
+    def bake_get_output_world_matrices(self, bones):
+        rig = self.bake_rig
+        return np.array([rig.matrix_world @ bone.matrix for bone in bones])
+
+    def bake_refine_adaptive(self, context):
+        """Bakes the middle frames of the gaps between the baked frames where the result differs from
+        the interpolated one more than the tolerance, and then recursively the gaps on both sides."""
+        rig = self.bake_rig
+        wm = context.window_manager
+
+        if not KeyframeBatchWriter(context).accepts(self.keyflags):
+            return context
+
+        set_bake_phase('bake_refine_adaptive')
+
+        bones = self.bake_get_bones(list(self.bake_get_output_bones()))
+        lengths = np.array([bone.length for bone in bones])
+        frames = self.bake_frames
+        gaps = [(start, end) for start, end in zip(frames, frames[1:]) if end - start > 1]
+        added = 0
+
+        while gaps:
+            self.bake_total_steps += len(gaps)
+            next_gaps = []
+
+            # Keys are flushed after every level, so that the next one interpolates between them
+            with KeyframeBatchWriter(context) as writer:
+                for start, end in gaps:
+                    frame = (start + end) // 2
+                    self.bake_frame_set(context.scene, frame)
+                    interpolated = self.bake_get_output_world_matrices(bones)
+
+                    self.apply_frame_state(context, rig, self.save_frame_state(context, rig))
+                    update_view_layer(context.view_layer)
+
+                    distance, angle = get_matrix_array_errors(
+                        interpolated, self.bake_get_output_world_matrices(bones), lengths
+                    )
+                    location_error = distance.max() > wm.rigify_transfer_adaptive_location
+                    rotation_error = angle.max() > wm.rigify_transfer_adaptive_rotation
+
+                    if location_error or rotation_error:
+                        self.bake_record_reduction_frame(frame)
+                        next_gaps += [gap for gap in ((start, frame), (frame, end)) if gap[1] - gap[0] > 1]
+                        added += 1
+                    else:
+                        writer.discard_frame(self.nla_to_raw(frame))
+
+                    with writer.suspended():
+                        context = yield
+
+            gaps = next_gaps
+
+        count_bake_event('adaptive_frames', added)
+        return context
+
+    bake_key_reducer = None
+
+    def bake_init_key_reduction(self, context):
+        "Prepares the removal of unneeded keys of the output bones after the bake, if enabled."
+        self.bake_key_reducer = None
+
+        outputs = self.bake_get_output_bones()
+
+        if context.window_manager.rigify_transfer_reduce_keys and outputs:
+            rig = self.bake_rig
+            reducer = BakeKeyReducer(rig, outputs, self.bake_frames, self.get_bone_update_planner(rig).dependencies)
+            if reducer.bones:
+                self.bake_key_reducer = reducer
+
+    def bake_record_reduction_frame(self, frame):
+        if self.bake_key_reducer:
+            self.bake_key_reducer.record_frame(frame)
+
+    def bake_reduce_keys(self, context):
+        "Removes the baked keys that are not needed to stay within the tolerance."
+        if not self.bake_key_reducer:
+            return
+
+        set_bake_phase('bake_reduce_keys')
+
+        wm = context.window_manager
+        removed = self.bake_key_reducer.reduce(
+            self.nla_to_raw, wm.rigify_transfer_reduce_location, wm.rigify_transfer_reduce_rotation
+        )
+        self.report({'INFO'}, f'Removed {removed} keys within tolerance.')
+
+    def bake_finish(self, context):
+        "Cleans up the action and returns to the original frame."
+        self.bake_reduce_keys(context)
+        set_bake_phase('clean_action_empty_curves')
         clean_action_empty_curves(self.bake_rig)
-        scene.frame_set(self.bake_current_frame)
+        self.bake_store_fingerprints()
+        scene_frame_set(context.scene, self.bake_current_frame)
+
+    # Incremental bakes keep a fingerprint of the source values of every baked frame in
+    # a custom property of the action, keyed by the operator and its output bones.
+    BAKE_RECORDS_PROP = 'rigify_bake_records'
+
+    bake_supports_incremental = False
+    bake_incremental_frames = None
+    bake_fingerprints = None
+
+    bake_fingerprint_after = False
+
+    def bake_get_record_key(self):
+        "Key of the fingerprint record, shared by all bakes writing the same bones."
+        return f"{zlib.crc32(json.dumps(self.bake_get_output_bones()).encode()):08x}"
+
+    def bake_get_settings_hash(self, context):
+        "Hash of the operator settings and the rig structure, which must match for an incremental bake."
+        settings = [
+            (name, getattr(self, name)) for name in sorted(get_property_annotations(type(self)))
+        ]
+        rig = [
+            (bone.name, bone.parent.name if bone.parent else '', [
+                (con.type, getattr(con, 'subtarget', ''), con.enabled, round(con.influence, 4))
+                for con in bone.constraints
+            ])
+            for bone in self.bake_rig.pose.bones
+        ]
+        options = (
+            getattr(type(self), 'bl_idname', None) or self.operator,
+            self.bake_frame_range, context.window_manager.rigify_transfer_use_all_keys,
+        )
+        return get_signed_crc32(json.dumps([settings, rig, options], default=list).encode())
+
+    def bake_get_fingerprint_curves(self):
+        """Returns the curves of the action the result of the bake can depend on, or None if it
+        can depend on anything else, like other objects or NLA strips."""
+        rig = self.bake_rig
+        anim_data = rig.animation_data
+
+        if anim_data.use_tweak_mode or (anim_data.use_nla and any(not t.mute for t in anim_data.nla_tracks)):
+            return None
+
+        # Bones read by the bake and the parents of the bones it writes, with their dependencies
+        dependencies = self.get_bone_update_planner(rig).dependencies
+        queue = list(self.bake_get_input_bones() or ())
+        if not queue:
+            return None
+
+        for name in self.bake_get_output_bones():
+            parent = rig.pose.bones[name].parent
+            if parent:
+                queue.append(parent.name)
+
+        bones = set()
+
+        while queue:
+            name = queue.pop()
+            if name is None:
+                return None
+            if name not in bones:
+                bones.add(name)
+                queue.extend(dependencies.get(name, ()))
+
+        for name in bones:
+            for con in rig.pose.bones[name].constraints:
+                if any(target != rig for target in get_constraint_target_objects(con)):
+                    return None
+
+        for fcu in anim_data.drivers:
+            if get_pose_bone_name_from_path(fcu.data_path) in bones:
+                for var in fcu.driver.variables:
+                    if any(tgt.id not in (rig, rig.data) for tgt in var.targets):
+                        return None
+
+        curves = []
+        for path, curve_map in get_action_curve_table(rig).curve_map.items():
+            name = get_pose_bone_name_from_path(path)
+            if name is None or name in bones:
+                curves.extend(curve_map.values())
+
+        self.bake_fingerprint_after = bool(bones.intersection(self.bake_get_output_bones()))
+        return curves
+
+    def bake_get_output_keys_fingerprint(self):
+        """Fingerprint of the keys of the baked bones, which must be unchanged since the last bake
+        for an incremental bake, so that editing or deleting baked keys forces a full bake."""
+        outputs = set(self.bake_get_output_bones())
+        curves = [
+            curve
+            for path, curve_map in get_action_curve_table(self.bake_rig).curve_map.items()
+            if get_pose_bone_name_from_path(path) in outputs
+            for curve in curve_map.values()
+        ]
+        return get_curve_keys_fingerprint(curves)
+
+    def bake_plan_incremental(self, context, curves):
+        """Compares the fingerprints of the frames with the ones stored by the last bake, limiting
+        the bake to the changed frames and their neighbours. Returns False if nothing changed."""
+        wm = context.window_manager
+        self.bake_fingerprints = None
+        self.bake_incremental_frames = None
+
+        # Adaptive frames depend on the baked result between the source frames
+        if not self.bake_supports_incremental or not wm.rigify_transfer_incremental or wm.rigify_transfer_adaptive:
+            return True
+
+        set_bake_phase('bake_plan_incremental')
+
+        source_curves = self.bake_get_fingerprint_curves()
+        if source_curves is None:
+            return True
+
+        frames = self.bake_frames
+        hashes = get_curve_frame_fingerprints(source_curves, self.nla_to_raw(frames))
+        settings = self.bake_get_settings_hash(context)
+        self.bake_fingerprints = (settings, frames, hashes)
+
+        records = find_action(self.bake_rig).get(self.BAKE_RECORDS_PROP)
+        record = records and records.get(self.bake_get_record_key())
+
+        if not record or record['settings'] != settings:
+            return True
+
+        if record.get('outputs') != self.bake_get_output_keys_fingerprint():
+            return True
+
+        old_hashes = dict(zip(record['frames'], record['hashes']))
+        margin = wm.rigify_transfer_incremental_margin
+        changed = set()
+
+        for i, (frame, value) in enumerate(zip(frames, hashes)):
+            if old_hashes.get(frame) != value:
+                changed.update(frames[max(0, i - margin):i + margin + 1])
+
+        removed = set(old_hashes).difference(frames)
+
+        count_bake_event('incremental_skipped_frames', len(frames) - len(changed))
+
+        self.bake_incremental_frames = changed | removed
+        self.bake_frames = sorted(changed)
+        self.bake_state.set_frames(self.bake_frames)
+
+        if not changed:
+            if removed:
+                delete_curve_keys_at_frames(curves, self.nla_to_raw(sorted(removed)))
+                clean_action_empty_curves(self.bake_rig)
+                self.bake_store_fingerprints()
+                self.bake_changed_data = True
+                self.report({'INFO'}, 'Removed the keys of frames no longer baked.')
+                return False
+            self.report({'INFO'}, 'No changes since the last bake.')
+            return False
+
+        return True
+
+    def bake_store_fingerprints(self):
+        "Store the fingerprints of the bake in the action, or drop the stale ones after a full bake."
+        action = find_action(self.bake_rig)
+        records = action.get(self.BAKE_RECORDS_PROP)
+        key = self.bake_get_record_key()
+
+        if self.bake_fingerprints is None:
+            if records and key in records:
+                del records[key]
+            return
+
+        settings, frames, hashes = self.bake_fingerprints
+
+        # The bake changed curves it depends on, so compute them again
+        if self.bake_fingerprint_after:
+            source_curves = self.bake_get_fingerprint_curves()
+            if source_curves is None:
+                return
+            hashes = get_curve_frame_fingerprints(source_curves, self.nla_to_raw(frames))
+
+        if records is None:
+            action[self.BAKE_RECORDS_PROP] = {}
+            records = action[self.BAKE_RECORDS_PROP]
+
+        records[key] = {
+            'settings': settings, 'frames': list(frames), 'hashes': list(hashes),
+            'outputs': self.bake_get_output_keys_fingerprint(),
+        }
+
+    def bake_steps(self, context, curves):
+        "Runs the whole bake as a generator yielding after every processed frame."
+        with self.bake_evaluation_scope(context):
+            if self.bake_use_stream:
+                yield from self.bake_stream_state(context, curves)
+
+            else:
+                context = yield from self.bake_save_state(context)
+
+                range, range_raw = self.bake_clean_curves_in_range(context, curves)
+
+                self.execute_before_apply(context, self.bake_rig, range, range_raw)
+
+                yield from self.bake_apply_state(context)
 
     @staticmethod
     def draw_common_bake_ui(context, layout):
         layout.prop(context.window_manager, 'rigify_transfer_use_all_keys')
+        layout.prop(context.window_manager, 'rigify_transfer_rig_only')
+        layout.prop(context.window_manager, 'rigify_transfer_use_modal')
+        layout.prop(context.window_manager, 'rigify_transfer_incremental')
+        if context.window_manager.rigify_transfer_incremental:
+            layout.prop(context.window_manager, 'rigify_transfer_incremental_margin')
+        layout.prop(context.window_manager, 'rigify_transfer_adaptive')
+        if context.window_manager.rigify_transfer_adaptive:
+            layout.prop(context.window_manager, 'rigify_transfer_adaptive_location')
+            layout.prop(context.window_manager, 'rigify_transfer_adaptive_rotation')
+        layout.prop(context.window_manager, 'rigify_transfer_reduce_keys')
+        if context.window_manager.rigify_transfer_reduce_keys:
+            layout.prop(context.window_manager, 'rigify_transfer_reduce_location')
+            layout.prop(context.window_manager, 'rigify_transfer_reduce_rotation')
+        layout.prop(context.window_manager, 'rigify_transfer_profile')
+        if context.window_manager.rigify_transfer_profile:
+            layout.prop(context.window_manager, 'rigify_transfer_profile_path')
 
         RIGIFY_OT_get_frame_range.draw_range_ui(context, layout)
 
@@ -663,37 +2787,27 @@ class RigifyBakeKeyframesMixin(RigifyOperatorMixinBase):
         "Override to execute code one time before the bake apply frame scan."
         pass
 
-    def execute(self, context):
+    def bake_start(self, context):
+        "Initializes the bake and creates the step generator. Returns False if there is nothing to bake."
         self.init_execute(context)
         self.bake_init(context)
 
+        set_bake_phase('execute_scan_curves')
+
         curves = self.execute_scan_curves(context, self.bake_rig)
 
         if self.report_bake_empty():
-            return {'CANCELLED'}
-
-        try:
-            self.bake_save_state(context)
-
-            range, range_raw = self.bake_clean_curves_in_range(context, curves)
-
-            self.execute_before_apply(context, self.bake_rig, range, range_raw)
-
-            self.bake_apply_state(context)
-
-        except Exception as e:
-            traceback.print_exc()
-            self.report({'ERROR'}, 'Exception: ' + str(e))
-
-        return {'FINISHED'}
+            return False
 
-    def invoke(self, context, event):
-        self.init_invoke(context)
+        if not self.bake_plan_incremental(context, curves):
+            return False
 
-        if hasattr(self, 'draw'):
-            return context.window_manager.invoke_props_dialog(self)
-        else:
-            return context.window_manager.invoke_confirm(self, event)
+        self.bake_use_stream = self.bake_can_stream()
+        self.bake_use_offline = not self.bake_use_stream and self.bake_compute_offline_state()
+        self.bake_total_steps = len(self.bake_frames) * (1 if self.bake_use_stream or self.bake_use_offline else 2)
+        self.bake_init_key_reduction(context)
+        self.bake_generator = self.bake_steps(context, curves)
+        return True
 
 
 class RigifySingleUpdateMixin(RigifyOperatorMixinBase):
@@ -733,7 +2847,14 @@ class RigifySingleUpdateMixin(RigifyOperatorMixinBase):
 ## Generic Snap (FK to IK) ##
 #############################
 
+# Input, output and control chains of the generic snap for each kind of rig module
+GENERIC_SNAP_MODULE_ROLES = {
+    'limb': ('ik', 'fk', 'ctrl'),
+    'finger': ('fk_tip', 'ik_control', 'fk_ctrls'),
+}
+
 class RigifyGenericSnapBase:
+    module:        StringProperty(name="Rig Module")
     input_bones:   StringProperty(name="Input Chain")
     output_bones:  StringProperty(name="Output Chain")
     ctrl_bones:    StringProperty(name="Input Controls")
@@ -743,16 +2864,26 @@ class RigifyGenericSnapBase:
     undo_copy_scale: bpy.props.BoolProperty(name="Undo Copy Scale", default=False)
 
     def init_execute(self, context):
-        self.input_bone_list = json.loads(self.input_bones)
-        self.output_bone_list = json.loads(self.output_bones)
-        self.ctrl_bone_list = json.loads(self.ctrl_bones)
+        module = self.get_rig_module(context, *GENERIC_SNAP_MODULE_ROLES)
+
+        if module:
+            input_role, output_role, ctrl_role = GENERIC_SNAP_MODULE_ROLES[module.kind]
+            self.input_bone_list = module.get_names(input_role)
+            self.output_bone_list = module.get_names(output_role)
+            self.ctrl_bone_list = module.get_names(ctrl_role)
+            self.set_module_bones(module, input_bone_list=input_role, output_bone_list=output_role)
+        else:
+            self.input_bone_list = json.loads(self.input_bones)
+            self.output_bone_list = json.loads(self.output_bones)
+            self.ctrl_bone_list = json.loads(self.ctrl_bones)
 
     def save_frame_state(self, context, obj):
-        return get_chain_transform_matrices(obj, self.input_bone_list)
+        return get_chain_transform_matrices(obj, self.get_pose_bones(obj, 'input_bone_list'))
 
     def apply_frame_state(self, context, obj, matrices):
         set_chain_transforms_from_matrices(
-            context, obj, self.output_bone_list, matrices,
+            context, obj, self.get_pose_bones(obj, 'output_bone_list'), matrices,
+            planner=self.get_bone_update_planner(obj),
             undo_copy_scale=self.undo_copy_scale, keyflags=self.keyflags,
             no_loc=self.locks[0], no_rot=self.locks[1], no_scale=self.locks[2],
         )
@@ -771,6 +2902,9 @@ class POSE_OT_rigify_generic_snap_bake(RigifyGenericSnapBase, RigifyBakeKeyframe
     bl_label = "Apply Snap To Keyframes"
     bl_description = "Apply snap to keyframes"
 
+    bake_supports_incremental = True
+    bake_supports_adaptive = True
+
     @classmethod
     def description(cls, context, props):
         return "Apply snap " + props.tooltip + " to keyframes"
@@ -780,6 +2914,15 @@ class POSE_OT_rigify_generic_snap_bake(RigifyGenericSnapBase, RigifyBakeKeyframe
         self.bake_add_bone_frames(self.ctrl_bone_list, TRANSFORM_PROPS_ALL)
         return self.bake_get_all_bone_curves(self.output_bone_list, props)
 
+    def bake_get_input_bones(self):
+        return self.input_bone_list
+
+    def bake_get_output_bones(self):
+        return self.output_bone_list
+
+    def bake_get_offline_state_bones(self):
+        return self.input_bone_list
+
 
 #############################
 ## Generic Clear Keyframes ##
@@ -804,7 +2947,7 @@ class POSE_OT_rigify_clear_keyframes(bpy.types.Operator):
         obj = context.active_object
         bone_list = [ obj.pose.bones[name] for name in json.loads(self.bones) ]
 
-        curve_table = ActionCurveTable(context.active_object)
+        curve_table = get_action_curve_table(context.active_object)
         curves = list(curve_table.list_all_prop_curves(bone_list, TRANSFORM_PROPS_ALL))
 
         key_range = RIGIFY_OT_get_frame_range.get_range(context)
@@ -837,7 +2980,7 @@ def get_pose_matrix_in_other_space(mat, pose_bone):
 
 def convert_pose_matrix_via_rest_delta(mat, from_bone, to_bone):
     """Convert pose of one bone to another bone, preserving the rest pose difference between them."""
-    return mat @ from_bone.bone.matrix_local.inverted() @ to_bone.bone.matrix_local
+    return mat @ get_armature_rest_cache(from_bone.id_data).get_delta(from_bone.name, to_bone.name)
 
 
 def convert_pose_matrix_via_pose_delta(mat, from_bone, to_bone):
@@ -913,30 +3056,236 @@ def match_pose_scale(pose_bone, target_bone):
 ## IK/FK snapping functions ##
 ##############################
 
-def correct_rotation(view_layer, bone_ik, target_matrix, *, ctrl_ik=None):
-    """ Corrects the ik rotation in ik2fk snapping functions
+# Constraints that keep the IK chain roll a smooth rotation around the chain axis
+ROLL_SAFE_CONSTRAINTS = frozenset([
+    'IK', 'COPY_LOCATION', 'COPY_ROTATION', 'COPY_SCALE', 'COPY_TRANSFORMS', 'STRETCH_TO', 'MAINTAIN_VOLUME',
+])
+
+def has_extra_constraints(*bones):
+    "Check if any of the bones have active constraints that can make their rotation response irregular."
+    return any(
+        con.enabled and con.influence > 0 and con.type not in ROLL_SAFE_CONSTRAINTS
+        for bone in bones for con in bone.constraints
+    )
+
+def get_roll_parent_matrix(ctrl_ik):
+    "Returns the rotation of the space in which the Y rotation of ctrl_ik is applied."
+    return (ctrl_ik.matrix @ ctrl_ik.matrix_basis.inverted_safe()).to_3x3().normalized()
+
+def get_cone_roll_error(cone_axis, target, direction):
+    "Returns the signed angle around cone_axis from direction to target, both projected to its plane."
+    projected = direction - cone_axis * cone_axis.dot(direction)
+    return math.atan2(cone_axis.dot(projected.cross(target)), projected.dot(target))
+
+# Number of consecutive warm started solutions before the cone axis is sampled again
+ROLL_WARM_START_MAX_AGE = 8
+
+# A stale cone axis only gives the exact solution if the bone can point exactly along
+# the axis, so warm starts are used only when the solution is aligned within this angle
+ROLL_WARM_START_ALIGNMENT = math.cos(1e-3)
+
+def refine_roll_angle(view_layer, bone_ik, ctrl_ik, axis, cone_axis, guess, *, tolerance=1e-4, max_steps=4, max_jump=pi/8):
+    """ Finds the Y rotation of ctrl_ik that points bone_ik along axis starting from a close
+        guess, reusing the cone axis of a previous solution instead of sampling it again.
+        Returns the angle, or None if the solution isn't near the guess.
+    """
+    target = axis - cone_axis * cone_axis.dot(axis)
+    if target.length < 1e-6:
+        return None
+
+    def sample(angle):
+        ctrl_ik.rotation_euler[1] = angle
+        update_view_layer(view_layer)
+        return get_cone_roll_error(cone_axis, target, bone_ik.vector.normalized())
+
+    angle = guess
+    error = sample(angle)
+    prev_angle = prev_error = None
+    best_angle, best_error = angle, error
+
+    for i in range(max_steps):
+        if abs(error) < tolerance:
+            break
+
+        if prev_angle is not None and abs(error - prev_error) > 1e-9:
+            step = -error * (angle - prev_angle) / (error - prev_error)
+        else:
+            step = error
+
+        prev_angle, prev_error = angle, error
+        angle += max(-pi / 8, min(pi / 8, step))
+
+        if abs(angle - guess) > max_jump:
+            return None
+
+        error = sample(angle)
+
+        if abs(error) < abs(best_error):
+            best_angle, best_error = angle, error
+
+    if abs(best_error) > pi / 180:
+        return None
+
+    if best_angle != angle:
+        ctrl_ik.rotation_euler[1] = best_angle
+        update_view_layer(view_layer)
+
+    if bone_ik.vector.normalized().dot(axis) < ROLL_WARM_START_ALIGNMENT:
+        return None
+
+    return best_angle
+
+def solve_roll_angle(view_layer, bone_ik, ctrl_ik, axis, *, tolerance=1e-4, max_refine=4, warm_start=None):
+    """ Finds the Y rotation of ctrl_ik that points bone_ik along axis in closed form.
+        The bone direction traces a cone as the control rolls, so three samples
+        determine it: d(a) = C + A*cos(a - a0) + B*sin(a - a0). The best angle
+        maximizes axis.d(a), and is refined with a few secant steps on the
+        remaining roll error. Returns False if the response doesn't fit the model.
+        If warm_start is a dictionary, the solution is stored in it, and used as
+        the starting point of the next call when available.
+        The pose is assumed to be up to date on entry.
+    """
+    def sample(angle):
+        ctrl_ik.rotation_euler[1] = angle
+        update_view_layer(view_layer)
+        return bone_ik.vector.normalized()
+
+    start_angle = ctrl_ik.rotation_euler[1]
+    parent = get_roll_parent_matrix(ctrl_ik)
+
+    if warm_start and 'axis' in warm_start and warm_start['age'] < ROLL_WARM_START_MAX_AGE:
+        angle = refine_roll_angle(
+            view_layer, bone_ik, ctrl_ik, axis, parent @ warm_start['axis'],
+            start_angle + warm_start['offset'], tolerance=tolerance,
+        )
+
+        if angle is not None:
+            count_bake_event('roll_warm_start_hit')
+            warm_start.update(offset=angle - start_angle, age=warm_start['age'] + 1)
+            return True
+
+        count_bake_event('roll_warm_start_miss')
+        sample(start_angle)
+
+    if warm_start is not None:
+        warm_start.clear()
+
+    d0 = bone_ik.vector.normalized()
+    d1 = sample(start_angle + pi / 2)
+    d2 = sample(start_angle - pi / 2)
+
+    center = (d1 + d2) / 2
+    vec_b = (d1 - d2) / 2
+    vec_a = d0 - center
+
+    # Rolling doesn't change the bone direction: nothing to solve
+    if vec_a.length < 1e-6 and vec_b.length < 1e-6:
+        sample(start_angle)
+        return True
+
+    cone_axis = vec_a.cross(vec_b)
+    if cone_axis.length < 1e-6 or not 0.5 < vec_a.length / max(vec_b.length, 1e-9) < 2:
+        return False
+
+    cone_axis.normalize()
+
+    target = axis - cone_axis * cone_axis.dot(axis)
+    if target.length < 1e-6:
+        sample(start_angle)
+        return True
+
+    def roll_error(direction):
+        return get_cone_roll_error(cone_axis, target, direction)
+
+    angle = start_angle + math.atan2(axis.dot(vec_b), axis.dot(vec_a))
+    error = roll_error(sample(angle))
+    prev_angle, prev_error = start_angle, roll_error(d0)
+    best_angle, best_error = angle, error
+
+    for i in range(max_refine):
+        if abs(error) < tolerance:
+            break
+
+        if abs(error - prev_error) > 1e-9:
+            step = -error * (angle - prev_angle) / (error - prev_error)
+        else:
+            step = error
+
+        prev_angle, prev_error = angle, error
+        angle += max(-pi / 4, min(pi / 4, step))
+        error = roll_error(sample(angle))
+
+        if abs(error) < abs(best_error):
+            best_angle, best_error = angle, error
+
+    if abs(best_error) > pi / 180:
+        return False
+
+    if best_angle != angle:
+        sample(best_angle)
+
+    if warm_start is not None and bone_ik.vector.normalized().dot(axis) >= ROLL_WARM_START_ALIGNMENT:
+        warm_start.update(offset=best_angle - start_angle, axis=parent.transposed() @ cone_axis, age=0)
+
+    return True
+
+# Maximum number of pose updates spent by the fallback IK rotation search
+ROTATION_SEARCH_BUDGET = 40
+
+def correct_rotation(view_layer, bone_ik, target_matrix, *, ctrl_ik=None, warm_start=None):
+    """ Corrects the ik rotation in ik2fk snapping functions.
+        warm_start is an optional dictionary carrying the solution between consecutive frames.
     """
 
     axis = target_matrix.to_3x3().col[1].normalized()
     ctrl_ik = ctrl_ik or bone_ik
 
+    if ctrl_ik.rotation_mode in {'QUATERNION', 'AXIS_ANGLE'}:
+        ctrl_ik.rotation_mode = 'ZXY'
+
+    start_angle = ctrl_ik.rotation_euler[1]
+
+    if not has_extra_constraints(bone_ik, ctrl_ik):
+        if solve_roll_angle(view_layer, bone_ik, ctrl_ik, axis, warm_start=warm_start):
+            return
+
+        ctrl_ik.rotation_euler[1] = start_angle
+        update_view_layer(view_layer)
+
     def distance(angle):
         # Rotate the bone and return the actual angle between bones
         ctrl_ik.rotation_euler[1] = angle
-        view_layer.update()
+        update_view_layer(view_layer)
 
         return -(bone_ik.vector.normalized().dot(axis))
 
-    if ctrl_ik.rotation_mode in {'QUATERNION', 'AXIS_ANGLE'}:
-        ctrl_ik.rotation_mode = 'ZXY'
+    distance = MemoizedFunction(distance, ROTATION_SEARCH_BUDGET)
+    result = None
 
-    start_angle = ctrl_ik.rotation_euler[1]
+    # Search a narrow range around the previous solution first
+    if warm_start and 'offset' in warm_start:
+        result = minimize_scalar(
+            distance, start_angle + warm_start['offset'], pi / 64,
+            tolerance=pi / 180, max_distance=pi / 8,
+        )
 
-    alpha_range = find_min_range(distance, start_angle)
-    alpha_min = ternarySearch(distance, alpha_range[0], alpha_range[1], pi / 180)
+        if not result.converged:
+            count_bake_event('rotation_search_warm_start_miss')
+            result = None
 
-    ctrl_ik.rotation_euler[1] = alpha_min
-    view_layer.update()
+    if result is None:
+        result = minimize_scalar(distance, start_angle, pi / 8, tolerance=pi / 180)
+
+    count_bake_event('rotation_search_' + result.reason)
+
+    if warm_start is not None:
+        warm_start.clear()
+        warm_start['offset'] = result.x - start_angle
+
+    # The pose is already evaluated at the result if it was the last sample
+    if distance.last != result.x:
+        ctrl_ik.rotation_euler[1] = result.x
+        update_view_layer(view_layer)
 
 
 def correct_scale(view_layer, bone_ik, target_matrix, *, ctrl_ik=None):
@@ -944,18 +3293,35 @@ def correct_scale(view_layer, bone_ik, target_matrix, *, ctrl_ik=None):
     input_scale = target_matrix.to_scale()
     ctrl_ik = ctrl_ik or bone_ik
 
-    for i in range(3):
-        cur_scale = bone_ik.matrix.to_scale()
+    def is_converged(cur_scale):
+        return all(abs((c - i)/i) < 0.01 for i, c in zip(input_scale, cur_scale))
 
+    def correct(cur_scale):
         ctrl_ik.scale = [
             v * i / c for v, i, c in zip(bone_ik.scale, input_scale, cur_scale)
         ]
 
-        view_layer.update()
+        update_view_layer(view_layer)
+
+    fixed_point_iteration(lambda: bone_ik.matrix.to_scale(), correct, is_converged, max_iterations=3)
+
+
+def get_chain_roll_error(axis, matrix, target_matrix):
+    """ Returns the signed angle around axis that rotates the orientation of matrix
+        closest to target_matrix, measured on the X axis (or Z if X is along axis).
+    """
+    axis = axis.normalized()
 
-        if all(abs((c - i)/i) < 0.01 for i, c in zip(input_scale, cur_scale)):
-            break
+    for i in (0, 2):
+        cur = matrix.to_3x3().col[i]
+        cur -= axis * axis.dot(cur)
+        tgt = target_matrix.to_3x3().col[i]
+        tgt -= axis * axis.dot(tgt)
 
+        if cur.length > 1e-3 and tgt.length > 1e-3:
+            return math.atan2(axis.dot(cur.cross(tgt)), cur.dot(tgt))
+
+    return 0.0
 
 def match_pole_target(view_layer, ik_first, ik_last, pole, match_bone_matrix, length):
     """ Places an IK chain's pole target to match ik_first's
@@ -966,6 +3332,7 @@ def match_pole_target(view_layer, ik_first, ik_last, pole, match_bone_matrix, le
         pole:  pole target bone for the IK chain
         match_bone:  bone to match ik_first to (probably first bone in a matching FK chain)
         length:  distance pole target should be placed from the chain center
+        The pose is assumed to be up to date on entry.
     """
     a = ik_first.matrix.to_translation()
     b = ik_last.matrix.to_translation() + ik_last.vector
@@ -973,9 +3340,7 @@ def match_pole_target(view_layer, ik_first, ik_last, pole, match_bone_matrix, le
     # Vector from the head of ik_first to the
     # tip of ik_last
     ikv = b - a
-
-    # Get a vector perpendicular to ikv
-    pv = perpendicular_vector(ikv).normalized() * length
+    axis = ikv.normalized()
 
     def set_pole(pvi):
         """ Set pole target's position based on a vector
@@ -988,25 +3353,229 @@ def match_pole_target(view_layer, ik_first, ik_last, pole, match_bone_matrix, le
         mat = get_pose_matrix_in_other_space(Matrix.Translation(pole_loc), pole)
         set_pose_translation(pole, mat)
 
-        view_layer.update()
+        update_view_layer(view_layer)
+
+    # Current offset of the pole from the chain center line
+    pv = pole.matrix.to_translation() - (a + ikv/2)
+    pv -= axis * axis.dot(pv)
+
+    if pv.length < 1e-6:
+        # Degenerate pole position: the chain plane is undefined, so the current pose says
+        # nothing about where the pole should go. Move it off the line to define the plane.
+        pv = perpendicular_vector(ikv)
+        set_pole(pv.normalized() * length)
+
+    pv = pv.normalized() * length
+
+    # With the root and the target fixed, rotating the pole around the chain axis rolls the
+    # solved chain rigidly by the same angle, so the placement needs no further correction
+    angle = get_chain_roll_error(ikv, ik_first.matrix, match_bone_matrix)
+    set_pole(Matrix.Rotation(angle, 4, ikv) @ pv)
 
-    set_pole(pv)
+##################
+## Rig manifest ##
+##################
 
-    # Get the rotation difference between ik_first and match_bone
-    angle = rotation_difference(ik_first.matrix, match_bone_matrix)
+# Parents of the eye_common bone, which doesn't store them in a custom property
+EYE_PARENT_NAMES = ["None", "God", "COG", "Hips", "Chest", "Head", "head_bend_upper"]
 
-    # Try compensating for the rotation difference in both directions
-    pv1 = Matrix.Rotation(angle, 4, ikv) @ pv
-    set_pole(pv1)
-    ang1 = rotation_difference(ik_first.matrix, match_bone_matrix)
+# Custom properties the manifest reads from the bones holding the modules. Of the switch
+# properties only the presence matters, so that switching doesn't rebuild the manifest.
+MANIFEST_VALUE_PROPS = (
+    "fk_bones", "ik_bones", "ctrl_bones", "extra_ctrls",
+    "ik_parentswitch_ctrlbone", "ik_parentswitch_parentnames",
+    "ik_poleparentswitch_ctrlbone", "ik_poleparentswitch_parentnames",
+    "fk_chain", "ik_chain", "fk_master", "ik_control", "constraint_bone", "axis", "parent_names",
+)
+MANIFEST_PRESENCE_PROPS = ("parent_switch", "parent_space")
+
+def get_manifest_holder_key(bone):
+    "Summary of the custom properties of the bone that the manifest reads."
+    values = [bone.get(prop) for prop in MANIFEST_VALUE_PROPS]
+    return (
+        [value.to_list() if hasattr(value, 'to_list') else value for value in values],
+        [prop in bone for prop in MANIFEST_PRESENCE_PROPS],
+    )
 
-    pv2 = Matrix.Rotation(-angle, 4, ikv) @ pv
-    set_pole(pv2)
-    ang2 = rotation_difference(ik_first.matrix, match_bone_matrix)
+class RigModule:
+    """One module of the rig: a limb, a finger or a parent switch. The bone chains are stored
+    by role both as bone names and as the pose bones, resolved once when the manifest is built,
+    so that the per-frame code of the operators doesn't look bones up. The manifest is rebuilt
+    whenever the bones may have been reallocated."""
+
+    def __init__(self, kind, holder, chains, values, pose_bones):
+        self.kind = kind
+        self.holder = holder
+        self.chains = {role: tuple(names) for role, names in chains.items()}
+        self.bones = {role: tuple(pose_bones[name] for name in names) for role, names in self.chains.items()}
+        self.values = values
+
+    def get_names(self, role):
+        return list(self.chains[role])
+
+    def get_bones(self, role):
+        return list(self.bones[role])
+
+class RigManifest:
+    """All modules of a rig, found once from the custom properties of the settings bones, and
+    keyed by short module IDs: the name of the settings bone for limbs and fingers, and the
+    name of the property bone and the property for parent switches."""
+
+    def __init__(self, obj):
+        self.pose_bones = {bone.name: bone for bone in obj.pose.bones}
+        self.modules = {}
+        self.errors = []
+        holders = set()
+
+        for bone in obj.pose.bones:
+            try:
+                self.add_bone_modules(bone)
+            except (KeyError, TypeError, IndexError) as e:
+                self.errors.append(f"{bone.name}: {e!r}")
+                holders.add(bone.name)
+
+        # Properties of the bones holding modules, to notice when they are edited
+        holders.update(module.holder for module in self.modules.values())
+        self.holders = {name: get_manifest_holder_key(self.pose_bones[name]) for name in holders}
+
+    def is_current(self, obj):
+        "Check that the properties the modules were found from are unchanged."
+        pose_bones = obj.pose.bones
+        for name, key in self.holders.items():
+            bone = pose_bones.get(name)
+            if bone is None or get_manifest_holder_key(bone) != key:
+                return False
+        return True
+
+    def add_module(self, module_id, kind, holder, chains, values=None):
+        self.modules[module_id] = RigModule(kind, holder, chains, values or {}, self.pose_bones)
+
+    def add_parent_switch(self, bone, prop_id, ctrl_bone, parent_names):
+        self.add_module(
+            f"{bone.name}/{prop_id}", 'parent', bone.name, {'bone': [ctrl_bone]},
+            {'prop_id': prop_id, 'parent_names': list(parent_names)},
+        )
 
-    # Do the one with the smaller angle
-    if ang1 < ang2:
-        set_pole(pv1)
+    def add_bone_modules(self, bone):
+        name = bone.name
+
+        if "settings" in name and bone.get("fk_bones") and bone.get("ik_bones"):
+            self.add_module(name, 'limb', name, {
+                'fk': bone["fk_bones"],
+                'ik': bone["ik_bones"],
+                'ctrl': bone["ctrl_bones"],
+                'extra': bone.get("extra_ctrls", []),
+                'tail': [],
+            })
+            if "ik_parentswitch_ctrlbone" in bone:
+                self.add_parent_switch(
+                    bone, 'IK_parent', bone["ik_parentswitch_ctrlbone"], bone["ik_parentswitch_parentnames"])
+            if "ik_poleparentswitch_ctrlbone" in bone:
+                self.add_parent_switch(
+                    bone, 'pole_parent', bone["ik_poleparentswitch_ctrlbone"], bone["ik_poleparentswitch_parentnames"])
+
+        elif "master" in name and bone.get("fk_chain") and bone.get("ik_control"):
+            fk_chain = list(bone["fk_chain"])
+            self.add_module(name, 'finger', name, {
+                'fk_chain': fk_chain,
+                'ik_chain': bone["ik_chain"],
+                'fk_master': [bone["fk_master"]],
+                'fk_ctrls': [bone["fk_master"]] + fk_chain,
+                'fk_tip': fk_chain[-1:],
+                'ik_control': [bone["ik_control"]],
+            }, {'constraint_bone': bone["constraint_bone"], 'axis': bone["axis"]})
+            if "ik_parentswitch_parentnames" in bone:
+                self.add_parent_switch(bone, 'IK_parent', bone["ik_control"], bone["ik_parentswitch_parentnames"])
+
+        elif "eye_common" in name and bone.get("parent_switch") is not None:
+            self.add_parent_switch(bone, 'parent_switch', name, EYE_PARENT_NAMES)
+
+        if isinstance(bone.get("parent_names"), list) and "parent_space" in bone:
+            self.add_parent_switch(bone, 'parent_space', name, bone["parent_names"])
+
+# Cached manifests, keyed by the armature object pointer
+_rig_manifests = {}
+
+def get_rig_manifest(obj):
+    """Returns the cached RigManifest of the armature object, rebuilding it if the bones or
+    the properties of the bones holding the modules changed."""
+    key = obj.as_pointer()
+    fingerprint = (obj.data.as_pointer(), get_bone_structure_serial())
+    manifest = _rig_manifests.get(key)
+
+    if manifest is None or manifest.fingerprint != fingerprint or not manifest.is_current(obj):
+        manifest = _rig_manifests[key] = RigManifest(obj)
+        manifest.fingerprint = fingerprint
+
+    return manifest
+
+def invalidate_rig_manifests():
+    _rig_manifests.clear()
+
+#####################
+## Visibility sets ##
+#####################
+
+# Groups of bones that extras buttons show and hide together, like sculptor controls or vehicle
+# path tangents, can be moved into a managed bone collection each, so that toggling a group is
+# a single is_visible write instead of a hide flag write per bone. The move is done once by an
+# explicit, undoable setup operator, and only where it keeps the Bone Layers buttons working:
+# the managed collection is nested under the one collection all bones of the group were in,
+# which needs Blender 4.1, and a bone can only be in one group. Other groups keep using the
+# hide flags. Managed collections have no rigify_ui_row, so they never get a button of their own.
+VISIBILITY_SET_PREFIX = "VIS-"
+
+def can_nest_bone_collections():
+    return 'parent' in bpy.types.BoneCollection.bl_rna.properties
+
+def get_all_bone_collections(armature):
+    "Returns all bone collections of the armature, including nested ones."
+    return getattr(armature, 'collections_all', armature.collections)
+
+def get_visibility_set(armature, set_name):
+    "Returns the managed bone collection of the named group of bones, or None if not set up."
+    return get_all_bone_collections(armature).get(VISIBILITY_SET_PREFIX + set_name)
+
+def has_visibility_sets(armature):
+    "Check if any group of bones of the armature has been set up with a managed collection."
+    return any(coll.name.startswith(VISIBILITY_SET_PREFIX) for coll in get_all_bone_collections(armature))
+
+def setup_visibility_sets(armature, groups):
+    """Moves every group of bones, given as a dictionary from set name to bone names, into its
+    managed collection nested under the collection the bones were in. Groups sharing bones with
+    another group, or whose bones are not all in the same single collection, are left alone.
+    Returns the lists of the names of the groups set up and skipped."""
+    done, skipped = [], []
+
+    if not can_nest_bone_collections():
+        return done, list(groups)
+
+    use_count = collections.Counter(name for names in groups.values() for name in set(names))
+
+    for set_name, names in groups.items():
+        if get_visibility_set(armature, set_name):
+            done.append(set_name)
+            continue
+
+        bones = [bone for bone in map(armature.bones.get, dict.fromkeys(names)) if bone is not None]
+        sources = {tuple(coll.name for coll in bone.collections) for bone in bones}
+        shared = any(use_count[bone.name] > 1 for bone in bones)
+
+        # All bones must be in exactly the same one collection
+        if not bones or shared or len(sources) != 1 or len(sources.pop()) != 1:
+            skipped.append(set_name)
+            continue
+
+        parent = bones[0].collections[0]
+        coll = armature.collections.new(VISIBILITY_SET_PREFIX + set_name, parent=parent)
+
+        for bone in bones:
+            parent.unassign(bone)
+            coll.assign(bone)
+
+        done.append(set_name)
+
+    return done, skipped
 
 ##########
 ## Misc ##
@@ -1014,7 +3583,7 @@ def match_pole_target(view_layer, ik_first, ik_last, pole, match_bone_matrix, le
 
 def parse_bone_names(names_string):
     if names_string[0] == '[' and names_string[-1] == ']':
-        return eval(names_string)
+        return ast.literal_eval(names_string)
     else:
         return names_string
 
@@ -1025,6 +3594,7 @@ def parse_bone_names(names_string):
 ########################
 
 class RigifyLimbIk2FkBase:
+    module:       StringProperty(name="Rig Module")
     prop_bone:    StringProperty(name="Settings Bone")
     pole_prop:    StringProperty(name="Pole target switch", default="pole_vector")
     fk_bones:     StringProperty(name="FK Bone Chain")
@@ -1033,7 +3603,29 @@ class RigifyLimbIk2FkBase:
     tail_bones:   StringProperty(name="Tail IK Controls", default="[]")
     extra_ctrls:  StringProperty(name="Extra IK Controls")
 
+    # Solutions carried between consecutive frames of a bake, by control name
+    ik_warm_start = None
+
+    def bake_init(self, context, rig=None):
+        super().bake_init(context, rig)
+        self.ik_warm_start = {}
+
     def init_execute(self, context):
+        module = self.get_rig_module(context, 'limb')
+
+        if module:
+            self.prop_bone = module.holder
+            self.fk_bone_list = module.get_names('fk')
+            self.ik_bone_list = module.get_names('ik')
+            self.ctrl_bone_list = module.get_names('ctrl')
+            self.tail_bone_list = module.get_names('tail')
+            self.extra_ctrl_list = module.get_names('extra')
+            self.set_module_bones(
+                module, fk_bone_list='fk', ik_bone_list='ik', ctrl_bone_list='ctrl',
+                tail_bone_list='tail', extra_ctrl_list='extra',
+            )
+            return
+
         if self.fk_bones:
             self.fk_bone_list = json.loads(self.fk_bones)
         self.ik_bone_list = json.loads(self.ik_bones)
@@ -1046,10 +3638,10 @@ class RigifyLimbIk2FkBase:
         return self.pole_prop in bone and bone[self.pole_prop]
 
     def save_frame_state(self, context, obj):
-        return get_chain_transform_matrices(obj, self.fk_bone_list)
+        return get_chain_transform_matrices(obj, self.get_pose_bones(obj, 'fk_bone_list'))
 
     def compute_base_rotation(self, context, ik_bones, ctrl_bones, matrices, use_pole):
-        context.view_layer.update()
+        update_view_layer(context.view_layer)
 
         if use_pole:
             match_pole_target(
@@ -1059,26 +3651,42 @@ class RigifyLimbIk2FkBase:
             )
 
         else:
-            correct_rotation(context.view_layer, ik_bones[0], matrices[0], ctrl_ik=ctrl_bones[0])
+            warm_start = None
+            if self.ik_warm_start is not None:
+                warm_start = self.ik_warm_start.setdefault(ctrl_bones[0].name, {})
+
+            correct_rotation(
+                context.view_layer, ik_bones[0], matrices[0],
+                ctrl_ik=ctrl_bones[0], warm_start=warm_start,
+            )
 
     def assign_middle_controls(self, context, obj, matrices, ik_bones, ctrl_bones, *, lock=False, keyflags=None):
-        for mat, ik, ctrl in reversed(list(zip(matrices[2:-1], ik_bones[2:-1], ctrl_bones[2:-1]))):
+        items = list(reversed(list(zip(matrices[2:-1], ik_bones[2:-1], ctrl_bones[2:-1]))))
+        if not items:
+            return
+
+        plan = self.get_bone_update_planner(obj).get_plan([ctrl.name for mat, ik, ctrl in items])
+
+        # Each control's inherit flags change right before it is assigned, as they affect the
+        # pose of the controls depending on it; those count as depending on an assigned bone
+        for (mat, ik, ctrl), need_update in zip(items, plan):
             ctrl.bone.use_inherit_rotation = not lock
             ctrl.bone.inherit_scale = 'NONE' if lock else 'FULL'
-            context.view_layer.update()
+            if need_update or ctrl is items[0][2]:
+                update_view_layer(context.view_layer)
             mat = convert_pose_matrix_via_rest_delta(mat, ik, ctrl)
-            set_transform_from_matrix(obj, ctrl.name, mat, keyflags=keyflags)
+            set_transform_from_matrix(obj, ctrl, mat, keyflags=keyflags)
 
     def assign_extra_controls(self, context, obj, all_matrices, ik_bones, ctrl_bones):
-        for extra in self.extra_ctrl_list:
+        for extra in self.get_pose_bones(obj, 'extra_ctrl_list'):
             set_transform_from_matrix(
                 obj, extra, Matrix.Identity(4), space='LOCAL', keyflags=self.keyflags
             )
 
     def apply_frame_state(self, context, obj, all_matrices):
-        ik_bones = [ obj.pose.bones[k] for k in self.ik_bone_list ]
-        ctrl_bones = [ obj.pose.bones[k] for k in self.ctrl_bone_list ]
-        tail_bones = [ obj.pose.bones[k] for k in self.tail_bone_list ]
+        ik_bones = self.get_pose_bones(obj, 'ik_bone_list')
+        ctrl_bones = self.get_pose_bones(obj, 'ctrl_bone_list')
+        tail_bones = self.get_pose_bones(obj, 'tail_bone_list')
 
         assert len(all_matrices) >= len(ik_bones) + len(tail_bones)
 
@@ -1090,13 +3698,13 @@ class RigifyLimbIk2FkBase:
         # Remove foot heel transform, if present
         self.assign_extra_controls(context, obj, all_matrices, ik_bones, ctrl_bones)
 
-        context.view_layer.update()
+        update_view_layer(context.view_layer)
 
         # Set the end control position
         end_mat = convert_pose_matrix_via_pose_delta(matrices[-1], ik_bones[-1], ctrl_bones[-1])
 
         set_transform_from_matrix(
-            obj, self.ctrl_bone_list[-1], end_mat, keyflags=self.keyflags,
+            obj, ctrl_bones[-1], end_mat, keyflags=self.keyflags,
             undo_copy_scale=True,
         )
 
@@ -1104,7 +3712,7 @@ class RigifyLimbIk2FkBase:
         ctrl_bones[0].matrix_basis = Matrix.Identity(4)
 
         set_transform_from_matrix(
-            obj, self.ctrl_bone_list[0], matrices[0],
+            obj, ctrl_bones[0], matrices[0],
             no_scale=True, no_rot=use_pole,
         )
 
@@ -1121,19 +3729,19 @@ class RigifyLimbIk2FkBase:
 
         # Assign tail control transforms
         for mat, ctrl in zip(tail_matrices, tail_bones):
-            context.view_layer.update()
-            set_transform_from_matrix(obj, ctrl.name, mat, keyflags=self.keyflags)
+            update_view_layer(context.view_layer)
+            set_transform_from_matrix(obj, ctrl, mat, keyflags=self.keyflags)
 
         # Keyframe controls
         if self.keyflags is not None:
             if use_pole:
                 keyframe_transform_properties(
-                    obj, self.ctrl_bone_list[1], self.keyflags,
+                    obj, ctrl_bones[1], self.keyflags,
                     no_rot=True, no_scale=True,
                 )
 
             keyframe_transform_properties(
-                obj, self.ctrl_bone_list[0], self.keyflags,
+                obj, ctrl_bones[0], self.keyflags,
                 no_rot=use_pole,
             )
 
@@ -1147,17 +3755,30 @@ class POSE_OT_rigify_limb_ik2fk_bake(RigifyLimbIk2FkBase, RigifyBakeKeyframesMix
     bl_label = "Apply Snap IK->FK To Keyframes"
     bl_description = "Snap the IK chain keyframes to FK result"
 
+    bake_supports_incremental = True
+    bake_supports_adaptive = True
+
     def execute_scan_curves(self, context, obj):
         self.bake_add_bone_frames(self.fk_bone_list, TRANSFORM_PROPS_ALL)
         if self.extra_ctrl_list == "":
             self.extra_ctrl_list = []
         return self.bake_get_all_bone_curves(self.ctrl_bone_list + self.extra_ctrl_list, TRANSFORM_PROPS_ALL)
 
+    def bake_get_input_bones(self):
+        return self.fk_bone_list
+
+    def bake_get_output_bones(self):
+        return self.ctrl_bone_list + self.extra_ctrl_list
+
+    def bake_get_offline_state_bones(self):
+        return self.fk_bone_list
+
 ########################
 ## Finger Snap IK to FK ##
 ########################
 
 class RigifyFingerFk2IkBase:
+    module:          StringProperty(name="Rig Module")
     ik_control:      StringProperty(name="IK Control")
     ik_chain:        StringProperty(name="IK output chain")
     constraint_bone: StringProperty(name="Bone With the IK Constraint")
@@ -1165,9 +3786,24 @@ class RigifyFingerFk2IkBase:
     fk_chain:        StringProperty(name="FK Bone Chain")
     axis:            StringProperty(name="Main Rotation Axis", default="+X")
 
+    # FK master pose bone, resolved by the rig module
+    fk_master_bone = None
+
     def init_execute(self, context):
-        self.ik_chain_list = json.loads(self.ik_chain)
-        self.fk_chain_list = json.loads(self.fk_chain)
+        module = self.get_rig_module(context, 'finger')
+
+        if module:
+            self.ik_control = module.chains['ik_control'][0]
+            self.fk_master = module.chains['fk_master'][0]
+            self.constraint_bone = module.values['constraint_bone']
+            self.axis = module.values['axis']
+            self.ik_chain_list = module.get_names('ik_chain')
+            self.fk_chain_list = module.get_names('fk_chain')
+            self.set_module_bones(module, ik_chain_list='ik_chain', fk_chain_list='fk_chain')
+            self.fk_master_bone, = module.get_bones('fk_master')
+        else:
+            self.ik_chain_list = json.loads(self.ik_chain)
+            self.fk_chain_list = json.loads(self.fk_chain)
 
     # Extracting the IK state - requires forcing IK on temporarily
     def find_constraint_drivers(self, obj):
@@ -1177,7 +3813,7 @@ class RigifyFingerFk2IkBase:
         if self.constraint_bone:
             bone = obj.pose.bones[self.constraint_bone]
             self.ik_constraint = con = bone.constraints['FingerIK']
-            self.driver_fcurves = DriverCurveTable(obj).get_prop_curves(con, 'influence')
+            self.driver_fcurves = get_driver_curve_table(obj).get_prop_curves(con, 'influence')
 
     def before_save_state(self, context, obj):
         self.find_constraint_drivers(obj)
@@ -1188,29 +3824,29 @@ class RigifyFingerFk2IkBase:
 
             self.ik_constraint.influence = 1
 
-            context.view_layer.update()
+            update_view_layer(context.view_layer)
 
     def get_fk_axis_angles(self, obj):
         options = self.axis_options[self.axis]
         angles = []
 
-        for bone in self.fk_chain_list[1:-1]:
-            matrix = obj.pose.bones[bone].matrix_basis
+        for bone in self.get_pose_bones(obj, 'fk_chain_list')[1:-1]:
+            matrix = bone.matrix_basis
             eulers = matrix.to_euler(options['order'])
             angles.append(eulers[options['axis']])
 
         return angles
 
     def get_ik_original_matrix(self, obj):
-        bone = obj.pose.bones[self.ik_chain_list[0]]
+        bone = self.get_pose_bones(obj, 'ik_chain_list')[0]
 
         if len(bone.constraints) == 1 and bone.constraints[0].type == 'COPY_TRANSFORMS':
             target = bone.constraints[0].subtarget
             return obj.pose.bones[target].matrix
 
     def save_frame_state(self, context, obj):
-        matrices = get_chain_transform_matrices(obj, self.ik_chain_list)
-        fk_matrices = get_chain_transform_matrices(obj, self.fk_chain_list)
+        matrices = get_chain_transform_matrices(obj, self.get_pose_bones(obj, 'ik_chain_list'))
+        fk_matrices = get_chain_transform_matrices(obj, self.get_pose_bones(obj, 'fk_chain_list'))
         angles = self.get_fk_axis_angles(obj)
         ik_original = self.get_ik_original_matrix(obj)
         return (matrices, fk_matrices, angles, ik_original)
@@ -1220,7 +3856,7 @@ class RigifyFingerFk2IkBase:
             for fcu in self.driver_fcurves.values():
                 fcu.mute = False
 
-            context.view_layer.update()
+            update_view_layer(context.view_layer)
 
     # Applying the state
     axis_options = {
@@ -1235,8 +3871,8 @@ class RigifyFingerFk2IkBase:
     def apply_frame_state(self, context, obj, state):
         matrices, fk_matrices, old_angles, ik_original = state
 
-        fk_master = obj.pose.bones[self.fk_master]
-        fk_chain = [ obj.pose.bones[k] for k in self.fk_chain_list ]
+        fk_master = self.fk_master_bone or obj.pose.bones[self.fk_master]
+        fk_chain = self.get_pose_bones(obj, 'fk_chain_list')
 
         # Set the master control position and rotation.
         master_mat = matrices[0]
@@ -1254,22 +3890,23 @@ class RigifyFingerFk2IkBase:
         )
         master_mat.translation = matrices[0].translation
 
-        set_transform_from_matrix(obj, self.fk_master, master_mat)
+        set_transform_from_matrix(obj, fk_master, master_mat)
 
         fk_master.scale = (1, 1, 1)
 
         if self.keyflags is not None:
-            keyframe_transform_properties(obj, self.fk_master, self.keyflags)
+            keyframe_transform_properties(obj, fk_master, self.keyflags)
 
-        context.view_layer.update()
+        update_view_layer(context.view_layer)
 
         # Apply the detail controls
         set_chain_transforms_from_matrices(
-            context, obj, self.fk_chain_list[:-1], matrices, keyflags=self.keyflags,
+            context, obj, fk_chain[:-1], matrices, keyflags=self.keyflags,
+            planner=self.get_bone_update_planner(obj),
         )
 
         set_transform_from_matrix(
-            obj, self.fk_chain_list[-1], Matrix.Identity(4), space='LOCAL', keyflags=self.keyflags
+            obj, fk_chain[-1], Matrix.Identity(4), space='LOCAL', keyflags=self.keyflags
         )
 
         # Compute the master scale from average control angle, biased by original
@@ -1281,13 +3918,14 @@ class RigifyFingerFk2IkBase:
         fk_master.scale[1] = 1 - avg_angle * options['sign'] / pi
 
         if self.keyflags is not None:
-            keyframe_transform_properties(obj, self.fk_master, self.keyflags)
+            keyframe_transform_properties(obj, fk_master, self.keyflags)
 
-        context.view_layer.update()
+        update_view_layer(context.view_layer)
 
         # Re-apply the rest of the detail controls
         set_chain_transforms_from_matrices(
-            context, obj, self.fk_chain_list[1:-1], matrices[1:], keyflags=self.keyflags,
+            context, obj, fk_chain[1:-1], matrices[1:], keyflags=self.keyflags,
+            planner=self.get_bone_update_planner(obj),
         )
 
 class POSE_OT_rigify_finger_fk2ik(RigifyFingerFk2IkBase, RigifySingleUpdateMixin, bpy.types.Operator):
@@ -1305,6 +3943,12 @@ class POSE_OT_rigify_finger_fk2ik_bake(RigifyFingerFk2IkBase, RigifyBakeKeyframe
         self.bake_add_bone_frames(fk_bones + [self.ik_control], TRANSFORM_PROPS_ALL)
         return self.bake_get_all_bone_curves(fk_bones, TRANSFORM_PROPS_ALL)
 
+    def bake_get_input_bones(self):
+        return self.ik_chain_list + self.fk_chain_list
+
+    def bake_get_output_bones(self):
+        return [self.fk_master, *self.fk_chain_list]
+
 #######################
 ## Leg Snap IK to FK ##
 #######################
@@ -1322,10 +3966,11 @@ class RigifyLegRollIk2FkBase(RigifyLimbIk2FkBase):
     }
 
     def save_frame_state(self, context, obj):
-        return get_chain_transform_matrices(obj, self.fk_bone_list + self.ctrl_bone_list[-1:])
+        return get_chain_transform_matrices(
+            obj, self.get_pose_bones(obj, 'fk_bone_list') + self.get_pose_bones(obj, 'ctrl_bone_list')[-1:])
 
     def assign_extra_controls(self, context, obj, all_matrices, ik_bones, ctrl_bones):
-        for extra in self.extra_ctrl_list:
+        for extra in self.get_pose_bones(obj, 'extra_ctrl_list'):
             set_transform_from_matrix(
                 obj, extra, Matrix.Identity(4), space='LOCAL', keyflags=self.keyflags
             )
@@ -1417,12 +4062,22 @@ class POSE_OT_rigify_leg_roll_ik2fk_bake(
         return self.bake_get_all_bone_curves(
             self.ctrl_bone_list + self.extra_ctrl_list, TRANSFORM_PROPS_ALL)
 
+    def bake_get_input_bones(self):
+        return self.fk_bone_list + self.ctrl_bone_list[-1:]
+
+    def bake_get_output_bones(self):
+        return self.ctrl_bone_list + self.extra_ctrl_list + [self.heel_control]
+
+    def bake_get_offline_state_bones(self):
+        return self.fk_bone_list + self.ctrl_bone_list[-1:]
+
 
 ################################
 ## Switchable Parent operator ##
 ################################
 
 class RigifySwitchParentBase:
+    module:       StringProperty(name="Rig Module")
     bone:         StringProperty(name="Control Bone")
     prop_bone:    StringProperty(name="Property Bone")
     prop_id:      StringProperty(name="Property")
@@ -1446,7 +4101,7 @@ class RigifySwitchParentBase:
             keyflags=self.keyflags_switch
         )
 
-        context.view_layer.update()
+        update_view_layer(context.view_layer)
 
         # Set the transforms to restore position
         set_transform_from_matrix(
@@ -1454,17 +4109,28 @@ class RigifySwitchParentBase:
             no_loc=self.locks[0], no_rot=self.locks[1], no_scale=self.locks[2]
         )
 
+    def init_execute(self, context):
+        module = self.get_rig_module(context, 'parent')
+
+        if module:
+            self.bone = module.chains['bone'][0]
+            self.prop_bone = module.holder
+            self.prop_id = module.values['prop_id']
+
+        return module
+
     def init_invoke(self, context):
         pose = context.active_object.pose
+        module = self.init_execute(context)
 
-        if (not pose or not self.parent_names
+        if (not pose or not (module or self.parent_names)
             or self.bone not in pose.bones
             or self.prop_bone not in pose.bones
             or self.prop_id not in pose.bones[self.prop_bone]):
             self.report({'ERROR'}, "Invalid parameters")
             return {'CANCELLED'}
 
-        parents = json.loads(self.parent_names)
+        parents = module.values['parent_names'] if module else json.loads(self.parent_names)
         parent_items = [(str(i), name, name) for i, name in enumerate(parents)]
 
         RigifySwitchParentBase.parent_items = parent_items
@@ -1494,9 +4160,390 @@ class POSE_OT_rigify_switch_parent_bake(RigifySwitchParentBase, RigifyBakeKeyfra
     def execute_before_apply(self, context, obj, range, range_raw):
         self.bake_replace_custom_prop_keys_constant(self.prop_bone, self.prop_id, int(self.selected))
 
+    def bake_get_input_bones(self):
+        return [self.bone]
+
+    def bake_get_output_bones(self):
+        return [self.bone, self.prop_bone]
+
     def draw(self, context):
         self.layout.prop(self, 'selected', text='')
 
+#########################
+## Batch bake operator ##
+#########################
+
+BAKE_JOB_PROPERTY_DEFAULTS = {
+    bpy.props.StringProperty: '',
+    bpy.props.BoolProperty: False,
+    bpy.props.IntProperty: 0,
+    bpy.props.FloatProperty: 0.0,
+}
+
+class RigifyBakeJob(RigifyBakeKeyframesMixin):
+    """One bake of a batch: runs the code of a bake operator outside of the operator,
+    with the property values taken from a dictionary instead of operator properties."""
+
+    operator = None
+
+    def __init__(self, batch, rig, props):
+        self.batch = batch
+        self.bake_rig = rig
+
+        annotations = get_property_annotations(type(self))
+
+        for name, prop in annotations.items():
+            keywords = getattr(prop, 'keywords', {})
+            if 'default' in keywords:
+                setattr(self, name, keywords['default'])
+            else:
+                setattr(self, name, BAKE_JOB_PROPERTY_DEFAULTS.get(getattr(prop, 'function', None)))
+
+        for name, value in props.items():
+            if name not in annotations:
+                raise ValueError(f"Unknown property '{name}' for {self.operator}")
+            setattr(self, name, value)
+
+    def report(self, type, message):
+        self.batch.report(type, f"{self.bake_rig.name} ({self.operator}): {message}")
+
+def make_bake_job_class(op_class, base_class):
+    "Create a batch job class reusing the bake specific methods of the operator class."
+    namespace = {'operator': op_class.bl_idname}
+
+    for name in ('execute_scan_curves', 'execute_before_apply', 'bake_get_input_bones', 'bake_get_output_bones',
+                 'bake_get_offline_state_bones'):
+        if name in vars(op_class):
+            namespace[name] = vars(op_class)[name]
+
+    return type(op_class.__name__ + '_job', (base_class, RigifyBakeJob), namespace)
+
+BAKE_JOB_CLASSES = {
+    op_class.bl_idname: make_bake_job_class(op_class, base_class)
+    for op_class, base_class in [
+        (POSE_OT_rigify_generic_snap_bake, RigifyGenericSnapBase),
+        (POSE_OT_rigify_limb_ik2fk_bake, RigifyLimbIk2FkBase),
+        (POSE_OT_rigify_leg_roll_ik2fk_bake, RigifyLegRollIk2FkBase),
+        (POSE_OT_rigify_finger_fk2ik_bake, RigifyFingerFk2IkBase),
+        (POSE_OT_rigify_switch_parent_bake, RigifySwitchParentBase),
+    ]
+}
+
+def get_bake_job_stages(jobs):
+    """Split the jobs into consecutive stages, so that the jobs within a stage don't read or
+    write bones affected by other jobs of the same stage and can share the frame sweeps.
+    Returns a list of (jobs, frames, can_stream) tuples."""
+    dependency_maps = {}
+    object_dependencies = {}
+
+    def get_dependency_map(rig):
+        if rig not in dependency_maps:
+            dependency_maps[rig] = get_bone_dependency_map(rig)
+        return dependency_maps[rig]
+
+    def get_dependencies(rig):
+        if rig not in object_dependencies:
+            object_dependencies[rig] = get_object_dependencies(rig)
+        return object_dependencies[rig]
+
+    def conflict(a, b):
+        if a.bake_rig != b.bake_rig:
+            return a.bake_rig in get_dependencies(b.bake_rig) or b.bake_rig in get_dependencies(a.bake_rig)
+
+        a_in, a_out = a.bake_get_input_bones(), a.bake_get_output_bones()
+        b_in, b_out = b.bake_get_input_bones(), b.bake_get_output_bones()
+
+        if not (a_in and a_out and b_in and b_out):
+            return True
+
+        dependencies = get_dependency_map(a.bake_rig)
+        return (bones_depend_on(dependencies, a_in + a_out, b_out) or
+                bones_depend_on(dependencies, b_in + b_out, a_out))
+
+    job_stages = []
+
+    for i, job in enumerate(jobs):
+        stage = 0
+        for j in range(i):
+            if job_stages[j] >= stage and conflict(jobs[j], job):
+                stage = job_stages[j] + 1
+        job_stages.append(stage)
+
+    stages = []
+
+    for stage in range(max(job_stages) + 1):
+        stage_jobs = [job for job, job_stage in zip(jobs, job_stages) if job_stage == stage]
+        frames = sorted(set().union(*(job.bake_frames for job in stage_jobs)))
+        stages.append((stage_jobs, frames, all(job.bake_can_stream() for job in stage_jobs)))
+
+    return stages
+
+def is_toanimate_rig(obj):
+    return obj is not None and obj.type == 'ARMATURE' and bool(obj.data.get("is_toanimate_rig"))
+
+def get_selected_rigs(context):
+    "Returns the selected TOAnimate rigs, starting with the active one."
+    rigs = [context.active_object] if is_toanimate_rig(context.active_object) else []
+    for obj in context.selected_objects:
+        if is_toanimate_rig(obj) and obj not in rigs:
+            rigs.append(obj)
+    return rigs
+
+class POSE_OT_rigify_batch_bake(RigifyBakeRunnerMixin, bpy.types.Operator):
+    bl_idname = "pose.rigify_batch_bake"
+    bl_label = "Batch Apply Snap To Keyframes"
+    bl_description = "Apply snapping to the keyframes of many limbs and rigs at once, sharing the frame sweeps"
+
+    jobs: StringProperty(
+        name="Jobs",
+        description="JSON list of jobs, each a dictionary with the bake operator 'operator', its 'props' "
+                    "and optionally the 'rig' name. If empty, jobs are built from the limb and finger "
+                    "settings bones of all selected rigs"
+    )
+    direction: bpy.props.EnumProperty(
+        name="Direction",
+        items=[
+            ('IK2FK', "IK -> FK", "Snap the IK controls to the FK result"),
+            ('FK2IK', "FK -> IK", "Snap the FK controls to the IK result"),
+        ],
+        default='IK2FK'
+    )
+    use_limbs:   bpy.props.BoolProperty(name="Limbs", default=True)
+    use_fingers: bpy.props.BoolProperty(name="Fingers", default=True)
+
+    @classmethod
+    def poll(cls, context):
+        return any(find_action(rig) for rig in get_selected_rigs(context))
+
+    def draw(self, context):
+        layout = self.layout
+
+        if not self.jobs:
+            layout.row().prop(self, 'direction', expand=True)
+            row = layout.row(align=True)
+            row.prop(self, 'use_limbs', toggle=True)
+            row.prop(self, 'use_fingers', toggle=True)
+
+        RigifyBakeKeyframesMixin.draw_common_bake_ui(context, layout)
+
+    def get_bone_jobs(self, bone):
+        "Returns the (operator, props) pairs for the settings bone, matching the panel buttons."
+        if self.use_limbs and "settings" in bone.name and bone.get("fk_bones") and bone.get("ik_bones"):
+            if not ("arm" in bone.name or "leg" in bone.name or "thigh" in bone.name):
+                return []
+
+            if self.direction == 'IK2FK':
+                return [('pose.rigify_limb_ik2fk_bake', dict(
+                    prop_bone=bone.name,
+                    fk_bones=json.dumps(bone["fk_bones"]),
+                    ik_bones=json.dumps(bone["ik_bones"]),
+                    ctrl_bones=json.dumps(bone["ctrl_bones"]),
+                    tail_bones='[]',
+                    extra_ctrls=json.dumps(bone["extra_ctrls"]),
+                ))]
+            else:
+                return [('pose.rigify_generic_snap_bake', dict(
+                    output_bones=json.dumps(bone["fk_bones"]),
+                    input_bones=json.dumps(bone["ik_bones"]),
+                    ctrl_bones=json.dumps(bone["ctrl_bones"]),
+                ))]
+
+        if self.use_fingers and "master" in bone.name and bone.get("fk_chain") and bone.get("ik_control"):
+            if self.direction == 'IK2FK':
+                return [('pose.rigify_generic_snap_bake', dict(
+                    output_bones=json.dumps([bone['ik_control']]),
+                    input_bones=json.dumps([bone['fk_chain'][-1]]),
+                    ctrl_bones=json.dumps([bone["fk_master"]] + bone["fk_chain"]),
+                    locks=(False, True, True),
+                    tooltip='IK to FK',
+                ))]
+            else:
+                return [('pose.rigify_finger_fk2ik_bake', dict(
+                    fk_master=bone["fk_master"],
+                    fk_chain=json.dumps(bone["fk_chain"]),
+                    ik_chain=json.dumps(bone["ik_chain"]),
+                    ik_control=bone["ik_control"],
+                    constraint_bone=bone["constraint_bone"],
+                    axis=bone["axis"],
+                ))]
+
+        return []
+
+    def create_jobs(self, context):
+        if self.jobs:
+            jobs = []
+
+            for item in json.loads(self.jobs):
+                rig = context.active_object
+                if item.get('rig'):
+                    rig = bpy.data.objects[item['rig']]
+
+                jobs.append(BAKE_JOB_CLASSES[item['operator']](self, rig, item.get('props', {})))
+
+            return jobs
+
+        return [
+            BAKE_JOB_CLASSES[operator](self, rig, props)
+            for rig in get_selected_rigs(context)
+            for bone in rig.pose.bones
+            for operator, props in self.get_bone_jobs(bone)
+        ]
+
+    def bake_get_rigs(self):
+        return list(dict.fromkeys(job.bake_rig for job in self.bake_jobs))
+
+    def bake_start(self, context):
+        self.bake_current_frame = context.scene.frame_current
+        self.bake_init_timing()
+
+        try:
+            jobs = self.create_jobs(context)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.report({'ERROR'}, 'Invalid bake jobs: ' + str(e))
+            return False
+
+        set_bake_phase('execute_scan_curves')
+
+        for job in jobs:
+            job.init_execute(context)
+            job.bake_init(context, job.bake_rig)
+            job.bake_curves = job.execute_scan_curves(context, job.bake_rig)
+            job.bake_add_frames_done()
+            job.bake_frame_lookup = set(job.bake_frames)
+
+        self.bake_jobs = [job for job in jobs if not job.is_bake_empty()]
+
+        if not self.bake_jobs:
+            self.report({'WARNING'}, 'No keys to bake.')
+            return False
+
+        self.bake_stages = get_bake_job_stages(self.bake_jobs)
+        self.bake_frames = sorted(set().union(*(job.bake_frames for job in self.bake_jobs)))
+        self.bake_total_steps = sum(
+            len(frames) * (1 if stream else 2) for _, frames, stream in self.bake_stages
+        )
+        self.bake_generator = self.bake_steps(context)
+        return True
+
+    def bake_save_stage(self, context, jobs, frames):
+        "Scans the frames of the stage, collecting data for all jobs."
+        jobs = [job for job in jobs if not job.bake_compute_offline_state()]
+
+        if not jobs:
+            self.bake_total_steps -= len(frames)
+            return context
+
+        set_bake_phase('bake_save_state')
+        started = []
+
+        try:
+            for job in jobs:
+                job.before_save_state(context, job.bake_rig)
+                started.append(job)
+
+            for frame in frames:
+                self.bake_frame_set(context.scene, frame)
+
+                for job in jobs:
+                    if frame in job.bake_frame_lookup:
+                        job.bake_state[frame] = job.save_frame_state(context, job.bake_rig)
+
+                context = yield
+
+        finally:
+            for job in reversed(started):
+                job.after_save_state(context, job.bake_rig)
+
+        return context
+
+    def bake_clean_stage(self, context, jobs):
+        "Deletes the keys of all jobs of the stage in their bake ranges."
+        for job in jobs:
+            range, range_raw = job.bake_clean_curves_in_range(context, job.bake_curves)
+            job.execute_before_apply(context, job.bake_rig, range, range_raw)
+
+    def bake_apply_stage(self, context, jobs, frames):
+        "Scans the frames of the stage, applying all jobs."
+        set_bake_phase('bake_apply_state')
+        with KeyframeBatchWriter(context) as writer:
+            for frame in frames:
+                self.bake_frame_set(context.scene, frame)
+
+                for job in jobs:
+                    if frame in job.bake_frame_lookup:
+                        job.apply_frame_state(context, job.bake_rig, job.bake_state.get(frame))
+
+                writer.flush()
+
+                with writer.suspended():
+                    context = yield
+
+        return context
+
+    def bake_stream_stage(self, context, jobs, frames):
+        "Scans the frames of the stage once, saving and immediately applying all jobs."
+        self.bake_clean_stage(context, jobs)
+
+        set_bake_phase('bake_stream_state')
+
+        started = []
+
+        try:
+            for job in jobs:
+                job.before_save_state(context, job.bake_rig)
+                started.append(job)
+
+            with KeyframeBatchWriter(context) as writer:
+                for frame in frames:
+                    self.bake_frame_set(context.scene, frame)
+
+                    for job in jobs:
+                        if frame in job.bake_frame_lookup:
+                            state = job.save_frame_state(context, job.bake_rig)
+                            job.apply_frame_state(context, job.bake_rig, state)
+
+                    writer.flush()
+
+                    with writer.suspended():
+                        context = yield
+
+        finally:
+            for job in reversed(started):
+                job.after_save_state(context, job.bake_rig)
+
+        return context
+
+    def bake_steps(self, context):
+        "Runs all stages as a generator yielding after every processed frame."
+        with self.bake_evaluation_scope(context):
+            for jobs, frames, stream in self.bake_stages:
+                if stream:
+                    context = yield from self.bake_stream_stage(context, jobs, frames)
+
+                else:
+                    context = yield from self.bake_save_stage(context, jobs, frames)
+
+                    self.bake_clean_stage(context, jobs)
+
+                    context = yield from self.bake_apply_stage(context, jobs, frames)
+
+            set_bake_phase('clean_action_empty_curves')
+
+            for rig in self.bake_get_rigs():
+                clean_action_empty_curves(rig)
+
+            # Fingerprints left by earlier incremental bakes of the same bones are stale now
+            for job in self.bake_jobs:
+                job.bake_store_fingerprints()
+
+            scene_frame_set(context.scene, self.bake_current_frame)
+
+        self.report(
+            {'INFO'},
+            f"Baked {len(self.bake_jobs)} jobs on {len(self.bake_get_rigs())} rigs "
+            f"in {len(self.bake_stages)} stages over {len(self.bake_frames)} frames"
+        )
+
 class POSE_OT_rig_change_resolution(bpy.types.Operator):
     bl_idname = "pose.rig_change_resolution"
     bl_label = "Change Rig Resolution"
@@ -1559,6 +4606,309 @@ class POSE_OT_rig_set_mask(bpy.types.Operator):
 
         return {"FINISHED"}
 
+##########################
+## Panel layout caching ##
+##########################
+
+# The rig panel is redrawn many times per second while scrubbing, so everything it derives
+# from the custom properties of the active bone and the bone collections is computed once
+# into a layout plan, and reused until the properties or the collections change.
+
+# Button of the panel: operator, text, icon and the (name, value) pairs of its properties
+ButtonSpec = collections.namedtuple('ButtonSpec', ['operator', 'text', 'icon', 'args'])
+
+def draw_button(layout, spec):
+    "Draw the operator button described by the ButtonSpec."
+    props = layout.operator(spec.operator, text=spec.text, icon=spec.icon)
+    for name, value in spec.args:
+        setattr(props, name, value)
+    return props
+
+def get_module_args(bone, module_id, args):
+    """Operator arguments selecting the module of the rig manifest, or the given arguments
+    listing the bones if the manifest doesn't have the module."""
+    if module_id in get_rig_manifest(bone.id_data).modules:
+        return (('module', module_id),)
+    return args
+
+def get_panel_prop_name(prop):
+    "Display name of a custom property in the panel."
+    return prop.replace("_", " ").title().replace("Ik", "IK").replace("Fk", "FK")
+
+def get_panel_value_key(value):
+    """Part of the panel fingerprint for a custom property value. The layout only tests numbers
+    for being zero, so they matter by type and truthiness, and dragging a slider keeps the plan."""
+    if isinstance(value, (str, list)):
+        return value
+    if isinstance(value, (int, float)):
+        return (type(value), bool(value))
+    return type(value)
+
+def get_panel_prop_description(bone, prop):
+    "UI description of the custom property, which hides it from the panel if it is 'ignore'."
+    try:
+        return bone.id_properties_ui(prop).as_dict().get('description')
+    except TypeError:
+        return None
+
+def get_panel_bone_fingerprint(bone):
+    """Summary of the custom properties of the bone that decide the layout of the panel. Reading
+    the UI descriptions is too slow for every redraw, so an 'ignore' description only takes
+    effect when the set of properties changes, or after undo or reload."""
+    return [(key, get_panel_value_key(value)) for key, value in bone.items()]
+
+def get_plain_properties_plan(bone):
+    return {
+        'kind': 'settings',
+        'props': [
+            (prop, get_panel_prop_name(prop))
+            for prop in bone.keys() if isinstance(bone.get(prop), (float, int))
+        ],
+    }
+
+def get_limb_settings_plan(bone):
+    if "arm" in bone.name:
+        limb = "Arm"
+    elif "leg" in bone.name or "thigh" in bone.name:
+        limb = "Leg"
+    else:
+        return get_plain_properties_plan(bone)
+
+    side_letter = bone.name[-1]
+    side = "Left" if side_letter == "L" else "Right"
+    fk_bones = json.dumps(bone["fk_bones"])
+    ik_bones = json.dumps(bone["ik_bones"])
+    ctrl_bones = json.dumps(bone["ctrl_bones"])
+    extra_ctrls = json.dumps(bone["extra_ctrls"])
+
+    snap_args = get_module_args(bone, bone.name, (
+        ('output_bones', fk_bones), ('input_bones', ik_bones), ('ctrl_bones', ctrl_bones),
+    ))
+    ik2fk_args = get_module_args(bone, bone.name, (
+        ('prop_bone', bone.name), ('fk_bones', fk_bones), ('ik_bones', ik_bones),
+        ('ctrl_bones', ctrl_bones), ('tail_bones', '[]'), ('extra_ctrls', extra_ctrls),
+    ))
+    ik_parent_args = get_module_args(bone, f"{bone.name}/IK_parent", (
+        ('bone', bone["ik_parentswitch_ctrlbone"]), ('prop_bone', bone.name), ('prop_id', 'IK_parent'),
+        ('parent_names', json.dumps(bone["ik_parentswitch_parentnames"])),
+    )) + (('locks', (False, False, False)),)
+    pole_parent_args = get_module_args(bone, f"{bone.name}/pole_parent", (
+        ('bone', bone["ik_poleparentswitch_ctrlbone"]), ('prop_bone', bone.name), ('prop_id', 'pole_parent'),
+        ('parent_names', json.dumps(bone["ik_poleparentswitch_parentnames"])),
+    )) + (('locks', (False, True, True)),)
+
+    ignore = ['IK_FK', 'IK_parent', 'pole_parent', 'pole_vector']
+    props = [
+        (prop, get_panel_prop_name(prop), type(bone[prop]) == bool)
+        for prop in sorted(bone.keys())
+        if isinstance(bone.get(prop), (float, int)) and prop not in ignore
+    ]
+
+    return {
+        'kind': 'limb',
+        'title': f"{side} {limb} Settings",
+        'fk2ik': ButtonSpec('pose.rigify_generic_snap', f'FK->IK ({limb}.{side_letter})', 'SNAP_ON', snap_args),
+        'fk2ik_bake': ButtonSpec('pose.rigify_generic_snap_bake', 'Action', 'ACTION_TWEAK', snap_args),
+        'fk_clear': ButtonSpec('pose.rigify_clear_keyframes', 'Clear', 'CANCEL', (('bones', fk_bones),)),
+        'ik2fk': ButtonSpec('pose.rigify_limb_ik2fk', f'IK->FK ({limb}.{side_letter})', 'SNAP_ON', ik2fk_args),
+        'ik2fk_bake': ButtonSpec('pose.rigify_limb_ik2fk_bake', 'Action', 'ACTION_TWEAK', ik2fk_args),
+        'ik_clear': ButtonSpec('pose.rigify_clear_keyframes', 'Clear', 'CANCEL', (('bones', ik_bones),)),
+        'ik_parent': ButtonSpec('pose.rigify_switch_parent', 'IK Parent', 'DOWNARROW_HLT', ik_parent_args),
+        'ik_parent_bake': ButtonSpec('pose.rigify_switch_parent_bake', '', 'ACTION_TWEAK', ik_parent_args),
+        'pole_parent': ButtonSpec('pose.rigify_switch_parent', 'Pole Parent', 'DOWNARROW_HLT', pole_parent_args),
+        'pole_parent_bake': ButtonSpec('pose.rigify_switch_parent_bake', '', 'ACTION_TWEAK', pole_parent_args),
+        'props': props,
+    }
+
+def get_general_settings_plan(bone):
+    if "sub" in bone.name:
+        return {'kind': None}
+
+    keys = bone.keys()
+    has_masks = any("HIDE" in prop for prop in keys)
+    masks = []
+
+    if has_masks:
+        for prop in sorted(keys):
+            if type(bone[prop]) == list:
+                name = prop.split("_")[2].replace("-", " ").title()
+                masks.append((name, not name[-1] == "R", (('mask', prop), ('objects', json.dumps(bone[prop])))))
+
+    return {
+        'kind': 'general',
+        'res_switching': not bone.get("no_res_switching"),
+        'subdiv': not bone.get("no_subdiv"),
+        'masks': masks if has_masks else None,
+    }
+
+def get_parent_space_plan(bone, label, text, locks):
+    args = get_module_args(bone, f"{bone.name}/parent_space", (
+        ('bone', bone.name), ('prop_bone', bone.name), ('prop_id', 'parent_space'),
+        ('parent_names', json.dumps(bone["parent_names"])),
+    ))
+    if locks is not None:
+        args += (('locks', locks),)
+
+    return {
+        'kind': 'parent_space',
+        'label': label,
+        'switch': ButtonSpec('pose.rigify_switch_parent', text, 'DOWNARROW_HLT', args),
+        'bake': ButtonSpec('pose.rigify_switch_parent_bake', '', 'ACTION_TWEAK', args),
+    }
+
+def get_finger_settings_plan(bone):
+    title = bone.name.title().replace(".01", "")
+    fk_chain = bone["fk_chain"]
+    fk_ctrls = json.dumps([bone["fk_master"]] + fk_chain)
+    ik_control = json.dumps([bone['ik_control']])
+
+    fk2ik_args = get_module_args(bone, bone.name, (
+        ('fk_master', bone["fk_master"]), ('fk_chain', json.dumps(fk_chain)),
+        ('ik_chain', json.dumps(bone["ik_chain"])), ('ik_control', bone["ik_control"]),
+        ('constraint_bone', bone["constraint_bone"]), ('axis', bone["axis"]),
+    ))
+    snap_options = (('locks', (False, True, True)), ('tooltip', 'IK to FK'))
+    ik2fk_args = get_module_args(bone, bone.name, (
+        ('output_bones', ik_control), ('input_bones', json.dumps([fk_chain[-1]])), ('ctrl_bones', fk_ctrls),
+    )) + snap_options
+    ik2fk_bake_args = get_module_args(bone, bone.name, (
+        ('output_bones', ik_control), ('input_bones', json.dumps([fk_chain])), ('ctrl_bones', fk_ctrls),
+    )) + snap_options
+    ik_parent_args = get_module_args(bone, f"{bone.name}/IK_parent", (
+        ('bone', bone["ik_control"]), ('prop_bone', bone.name), ('prop_id', 'IK_parent'),
+        ('parent_names', json.dumps(bone["ik_parentswitch_parentnames"])),
+    )) + (('locks', (False, False, False)),)
+
+    return {
+        'kind': 'finger',
+        'fk2ik': ButtonSpec('pose.rigify_finger_fk2ik', f'FK->IK ({title})', 'SNAP_ON', fk2ik_args),
+        'fk2ik_bake': ButtonSpec('pose.rigify_finger_fk2ik_bake', 'Action', 'ACTION_TWEAK', fk2ik_args),
+        'fk_clear': ButtonSpec('pose.rigify_clear_keyframes', 'Clear', 'CANCEL', (('bones', fk_ctrls),)),
+        'ik2fk': ButtonSpec('pose.rigify_generic_snap', f'IK->FK ({title})', 'SNAP_ON', ik2fk_args),
+        'ik2fk_bake': ButtonSpec('pose.rigify_generic_snap_bake', 'Action', 'ACTION_TWEAK', ik2fk_bake_args),
+        'ik_clear': ButtonSpec('pose.rigify_clear_keyframes', 'Clear', 'CANCEL', (('bones', ik_control),)),
+        'ik_parent': ButtonSpec('pose.rigify_switch_parent', 'IK Parent', 'DOWNARROW_HLT', ik_parent_args),
+    }
+
+EYE_PARENT_ARGS = (
+    ('bone', 'eye_common'), ('prop_bone', 'eye_common'), ('prop_id', 'parent_switch'),
+    ('parent_names', json.dumps(EYE_PARENT_NAMES)),
+)
+
+def get_bone_properties_plan(bone):
+    keys = bone.keys()
+    ignore_props = []
+
+    for prop in keys:
+        if get_panel_prop_description(bone, prop) == "ignore":
+            ignore_props.append(prop)
+        if prop == "rigify_parameters":
+            ignore_props.append(prop)
+
+    if len(ignore_props) == len(keys):
+        return {'kind': None}
+
+    return {
+        'kind': 'properties',
+        'props': [
+            (prop, get_panel_prop_name(prop))
+            for prop in sorted(keys)
+            if isinstance(bone.get(prop), (float, int)) and prop not in ignore_props
+        ],
+    }
+
+def build_bone_panel_plan(bone):
+    "Decide what the panel shows for the active pose bone, and prepare the operator arguments."
+    if "settings" in bone.name and bone.get("fk_bones") and bone.get("ik_bones"):
+        return get_limb_settings_plan(bone)
+
+
+    elif "God" in bone.name or "root" in bone.name:
+        return get_general_settings_plan(bone)
+
+    elif bone.name == "head" and bone.get("parent_names"):
+        return get_parent_space_plan(bone, "Head Parent Space (Rotational)", 'Head Parent', (False, True, True))
+
+    elif bone.get("parent_names") or bone.get("parent_names") == 0 and bone.get("parent_space"):
+        return get_parent_space_plan(bone, "Parent Space", 'Parent', None)
+
+    elif "master" in bone.name and bone.get("fk_chain") and bone.get("ik_control"):
+        return get_finger_settings_plan(bone)
+
+    elif "eye_common" in bone.name and bone.get("parent_switch"):
+        args = get_module_args(bone, "eye_common/parent_switch", EYE_PARENT_ARGS) + (('locks', (False, False, False)),)
+        return {
+            'kind': 'eye',
+            'switch': ButtonSpec('pose.rigify_switch_parent', 'Parent (eye_common)', 'DOWNARROW_HLT', args),
+            'bake': ButtonSpec('pose.rigify_switch_parent_bake', '', 'ACTION_TWEAK', args),
+        }
+
+    elif len(bone.keys()) > 0:
+        return get_bone_properties_plan(bone)
+
+    return {'kind': None}
+
+def build_collection_rows(armature):
+    """Returns the rows of bone collection buttons as lists of (collection name, title),
+    with None for the empty rows between them."""
+    row_table = collections.defaultdict(list)
+    for coll in armature.collections:
+        row_id = coll.get('rigify_ui_row', 0)
+        if row_id > 0:
+            row_table[row_id].append((coll.name, coll.get('rigify_ui_title')))
+
+    if not row_table:
+        return []
+
+    return [row_table.get(row_id) for row_id in range(min(row_table), 1 + max(row_table))]
+
+def get_collection_rows_fingerprint(armature):
+    "Summary of the bone collection properties that decide the rows of buttons."
+    return [
+        (coll.name, coll.get('rigify_ui_row'), coll.get('rigify_ui_title'))
+        for coll in armature.collections
+    ]
+
+# Cached plans, keyed by the armature object pointer and the bone name (None for the collections)
+_panel_layout_plans = {}
+
+def get_panel_layout_plan(obj, bone=None):
+    "Returns the cached layout plan of the panel for the bone, or the bone collection rows."
+    key = (obj.as_pointer(), bone.name if bone else None)
+
+    if bone:
+        fingerprint = get_panel_bone_fingerprint(bone)
+    else:
+        fingerprint = get_collection_rows_fingerprint(obj.data)
+
+    entry = _panel_layout_plans.get(key)
+
+    if entry is None or entry[0] != fingerprint:
+        plan = build_bone_panel_plan(bone) if bone else build_collection_rows(obj.data)
+        entry = _panel_layout_plans[key] = (fingerprint, plan)
+
+    return entry[1]
+
+def invalidate_panel_layout_plans():
+    _panel_layout_plans.clear()
+
+def draw_collection_rows(layout, obj):
+    "Draw the bone collection visibility buttons, arranged in rows."
+    bone_collections = obj.data.collections
+
+    for row_buttons in get_panel_layout_plan(obj):
+        row = layout.row()
+        if row_buttons:
+            for name, title in row_buttons:
+                coll = bone_collections.get(name)
+                if coll is None:
+                    # Renamed since the plan was made, rebuild it on the next redraw
+                    _panel_layout_plans.pop((obj.as_pointer(), None), None)
+                    continue
+                row.prop(coll, 'is_visible', toggle=True, text=title or coll.name)
+        else:
+            row.separator()
+
 class VIEW3D_PT_TORigUI(bpy.types.Panel):
     
     bl_space_type = 'VIEW_3D'
@@ -1607,284 +4957,129 @@ class VIEW3D_PT_TORigUI(bpy.types.Panel):
         # row.operator('wm.url_open', text="Teachable", icon="EVENT_T").url = "toanimate.teachable.com"
 
         layout.label(text="Bone Layers", icon="ALIGN_JUSTIFY")
-        row_table = collections.defaultdict(list)
-        for coll in context.active_object.data.collections:
-            row_id = coll.get('rigify_ui_row', 0)
-            if row_id > 0:
-                row_table[row_id].append(coll)
         box = layout.box()
-        col = box.column()
-        for row_id in range(min(row_table.keys()), 1 + max(row_table.keys())):
-            row = col.row()
-            # row.scale_y = 1.2
-            row_buttons = row_table[row_id]
-            if row_buttons:
-                for coll in row_buttons:
-                    title = coll.get('rigify_ui_title') or coll.name
-                    row.prop(coll, 'is_visible', toggle=True, text=title)
-            else:
-                row.separator()
+        draw_collection_rows(box.column(), context.active_object)
 
         if context.active_pose_bone:
             bone = context.active_pose_bone
-            if "settings" in bone.name and \
-                bone.get("fk_bones") and \
-                bone.get("ik_bones"): # display specific layout and buttons for settings controls
-
-                bone_name = None
-                if "arm" in bone.name:
-                    bone_name = "Arm"
-                    side = ""
-                    if bone.name[-1] == "L":
-                        side = "Left"
-                    else:
-                        side = "Right"
-                    layout.label(text=f"{side} Arm Settings", icon="SETTINGS")
-
-                elif "leg" in bone.name or "thigh" in bone.name:
-                    bone_name = "Leg"
-                    side = ""
-                    if bone.name[-1] == "L":
-                        side = "Left"
-                    else:
-                        side = "Right"
-                    layout.label(text=f"{side} Leg Settings", icon="SETTINGS")
-
-                if bone_name:
-                    box = layout.box()
-                    col = box.column(align=True)
+            plan = get_panel_layout_plan(context.active_object, bone)
+            kind = plan['kind']
 
-                    col.label(text="IK/FK Switch")
-                    row = col.row(align=True)
-                    row.scale_y = 1.5
+            if kind == 'limb': # display specific layout and buttons for settings controls
+                layout.label(text=plan['title'], icon="SETTINGS")
 
-                    row.prop(bone, '["IK_FK"]', slider=True, text="IK -> FK")
+                box = layout.box()
+                col = box.column(align=True)
 
-                    col = box.column(align=True)
-                    col.label(text="IK/FK Snapping")
-                    row = col.row(align=True)
-                    row.scale_y = 1.5
+                col.label(text="IK/FK Switch")
+                row = col.row(align=True)
+                row.scale_y = 1.5
 
-                    # FK to IK snap
-                    props = row.operator('pose.rigify_generic_snap', text=f'FK->IK ({bone_name}.{bone.name[-1]})', icon='SNAP_ON')
-                    props.output_bones = json.dumps(bone["fk_bones"])
-                    props.input_bones = json.dumps(bone["ik_bones"])
-                    props.ctrl_bones = json.dumps(bone["ctrl_bones"])
+                row.prop(bone, '["IK_FK"]', slider=True, text="IK -> FK")
 
-                    row = col.row(align=True)
+                col = box.column(align=True)
+                col.label(text="IK/FK Snapping")
+                row = col.row(align=True)
+                row.scale_y = 1.5
 
-                    props = row.operator('pose.rigify_generic_snap_bake', text='Action', icon='ACTION_TWEAK')
-                    props.output_bones = json.dumps(bone["fk_bones"])
-                    props.input_bones = json.dumps(bone["ik_bones"])
-                    props.ctrl_bones = json.dumps(bone["ctrl_bones"])
+                # FK to IK snap
+                draw_button(row, plan['fk2ik'])
 
-                    props = row.operator('pose.rigify_clear_keyframes', text='Clear', icon='CANCEL')
-                    props.bones = json.dumps(bone["fk_bones"])
+                row = col.row(align=True)
+                draw_button(row, plan['fk2ik_bake'])
+                draw_button(row, plan['fk_clear'])
 
-                    # IK to FK snap
-                    col.separator()
-                    row = col.row(align=True)
-                    row.scale_y = 1.5
+                # IK to FK snap
+                col.separator()
+                row = col.row(align=True)
+                row.scale_y = 1.5
 
-                    props = row.operator('pose.rigify_limb_ik2fk', text=f'IK->FK ({bone_name}.{bone.name[-1]})', icon='SNAP_ON')
-                    props.prop_bone = bone.name
-                    props.fk_bones = json.dumps(bone["fk_bones"])
-                    props.ik_bones = json.dumps(bone["ik_bones"])
-                    props.ctrl_bones = json.dumps(bone["ctrl_bones"])
-                    props.tail_bones = '[]'
-                    props.extra_ctrls =json.dumps(bone["extra_ctrls"]) 
+                draw_button(row, plan['ik2fk'])
 
-                    row = col.row(align=True)
+                row = col.row(align=True)
+                draw_button(row, plan['ik2fk_bake'])
+                draw_button(row, plan['ik_clear'])
 
-                    props = row.operator('pose.rigify_limb_ik2fk_bake', text='Action', icon='ACTION_TWEAK')
-                    props.prop_bone = bone.name
-                    props.fk_bones = json.dumps(bone["fk_bones"])
-                    props.ik_bones = json.dumps(bone["ik_bones"])
-                    props.ctrl_bones = json.dumps(bone["ctrl_bones"])
-                    props.tail_bones = '[]'
-                    props.extra_ctrls =json.dumps(bone["extra_ctrls"]) 
+                col.separator()
 
-                    props = row.operator('pose.rigify_clear_keyframes', text='Clear', icon='CANCEL')
-                    props.bones = json.dumps(bone["ik_bones"])
+                # Parent Spaces
+                box = layout.box()
+                col = box.column(align=True)
+                col.label(text="Parent Spaces")
+                group1 = col.row(align=True)
+                group2 = group1.split(factor=0.75, align=True)
+                draw_button(group2, plan['ik_parent'])
+                group2.prop(bone, '["IK_parent"]', text='')
+                draw_button(group1, plan['ik_parent_bake'])
 
-                    col.separator()
+                group1 = col.row(align=True)
+                group2 = group1.split(factor=0.75, align=True)
+                draw_button(group2, plan['pole_parent'])
+                group2.prop(bone, '["pole_parent"]', text='')
+                draw_button(group1, plan['pole_parent_bake'])
 
-                    # Parent Spaces
-                    box = layout.box()
-                    col = box.column(align=True)
-                    col.label(text="Parent Spaces")
-                    group1 = col.row(align=True)
-                    group2 = group1.split(factor=0.75, align=True)
-
-                    props = group2.operator('pose.rigify_switch_parent', text='IK Parent', icon='DOWNARROW_HLT')
-                    props.bone = bone["ik_parentswitch_ctrlbone"]
-                    props.prop_bone = bone.name
-                    props.prop_id = 'IK_parent'
-                    props.parent_names = json.dumps(bone["ik_parentswitch_parentnames"])
-                    props.locks = (False, False, False)
-
-                    group2.prop(bone, '["IK_parent"]', text='')
-
-                    props = group1.operator('pose.rigify_switch_parent_bake', text='', icon='ACTION_TWEAK')
-                    props.bone = bone["ik_parentswitch_ctrlbone"]
-                    props.prop_bone = bone.name
-                    props.prop_id = 'IK_parent'
-                    props.parent_names = json.dumps(bone["ik_parentswitch_parentnames"])
-                    props.locks = (False, False, False)
-
-                    # col.separator()
-
-                    group1 = col.row(align=True)
-                    group2 = group1.split(factor=0.75, align=True)
-                    props = group2.operator('pose.rigify_switch_parent', text='Pole Parent', icon='DOWNARROW_HLT')
-                    props.bone = bone["ik_poleparentswitch_ctrlbone"]
-                    props.prop_bone = bone.name
-                    props.prop_id = 'pole_parent'
-                    props.parent_names = json.dumps(bone["ik_poleparentswitch_parentnames"])
-                    props.locks = (False, True, True)
-
-                    group2.prop(bone, '["pole_parent"]', text='')
-
-                    props = group1.operator('pose.rigify_switch_parent_bake', text='', icon='ACTION_TWEAK')
-                    props.bone = bone["ik_poleparentswitch_ctrlbone"]
-                    props.prop_bone = bone.name
-                    props.prop_id = 'pole_parent'
-                    props.parent_names = json.dumps(bone["ik_poleparentswitch_parentnames"])
-                    props.locks = (False, True, True)
+                box = layout.box()
+                col = box.column(align=True)
+                col.label(text="Properties")
 
-                    box = layout.box()
-                    col = box.column(align=True)
-                    col.label(text="Properties")
-
-                    for prop in sorted(bone.keys()):
-                        if isinstance(bone.get(prop), float) or \
-                        isinstance(bone.get(prop), int):
-                            name = prop.replace("_", " ").title()
-
-                            if "Ik" in name:
-                                name = name.replace("Ik", "IK")
-                            if "Fk" in name:
-                                name = name.replace("Fk", "FK")
-
-                            row = col.row()
-                            ignore = ['IK_FK', 'IK_parent', 'pole_parent', 'pole_vector']
-                            if not prop in ignore:
-                                if type(bone[prop]) == bool:
-                                    row.separator()
-                                    row = col.row()
-                                    row.prop(bone, f'["{prop}"]', text='', icon="HIDE_OFF")
-                                    row.label(text=name)
-                                else:
-                                    row.prop(bone, f'["{prop}"]', slider=True, text=name)
-                else:
-                    layout.label(text="Bone Properties", icon="PROPERTIES")
-                    for prop in bone.keys():
-                        if isinstance(bone.get(prop), float) or \
-                        isinstance(bone.get(prop), int):
-                            col = layout.column()
-                            name = prop.replace("_", " ").title()
-
-                            if "Ik" in name:
-                                name = name.replace("Ik", "IK")
-                            if "Fk" in name:
-                                name = name.replace("Fk", "FK")
-
-                            row = col.row()
-                            row.prop(bone, f'["{prop}"]', slider=True, text=name)
-
-            elif "God" in bone.name or "root" in bone.name : # display specific buttons for god/root control
-                if "sub" in bone.name:
-                    return
+                for prop, name, is_bool in plan['props']:
+                    row = col.row()
+                    if is_bool:
+                        row.separator()
+                        row = col.row()
+                        row.prop(bone, f'["{prop}"]', text='', icon="HIDE_OFF")
+                        row.label(text=name)
+                    else:
+                        row.prop(bone, f'["{prop}"]', slider=True, text=name)
 
-                has_masks = False
-                for prop in bone.keys():
-                    if "HIDE" in prop:
-                        has_masks = True
-                        break
+            elif kind == 'settings':
+                layout.label(text="Bone Properties", icon="PROPERTIES")
+                for prop, name in plan['props']:
+                    row = layout.column().row()
+                    row.prop(bone, f'["{prop}"]', slider=True, text=name)
 
-                if not bone.get("no_res_switching") or not bone.get("no_subdiv") or has_masks:
+            elif kind == 'general': # display specific buttons for god/root control
+                if plan['res_switching'] or plan['subdiv'] or plan['masks'] is not None:
                     layout.label(text="General Rig Settings", icon="SETTINGS")
 
-                if not bone.get("no_res_switching") or not bone.get("no_subdiv"):
+                if plan['res_switching'] or plan['subdiv']:
                     box = layout.box()
                     col = box.column(align=True)
                     col.label(text="Set Rig Resolution (Viewport)")
-                if not bone.get("no_res_switching"):
+                if plan['res_switching']:
                     row = col.row(align=True)
                     row.scale_y = 2
-                    # row.enabled = not bone.get("no_res_switching")
                     row.operator('pose.rig_change_resolution', text="Low Res", icon="MESH_PLANE").resolution = "low"
                     row.operator('pose.rig_change_resolution', text="Medium Res", icon="MOD_REMESH").resolution = "medium"
                     row.operator('pose.rig_change_resolution', text="High Res", icon="MESH_UVSPHERE").resolution = "high"
-                if not bone.get("no_subdiv"):
+                if plan['subdiv']:
                     col.separator()
                     row = col.row(align=True)
                     row.scale_y = 1.5
                     row.operator('pose.rig_change_resolution', text="Toggle Subdivision", icon="MOD_SUBSURF").resolution = "subdiv"
 
-
-                if not has_masks:
+                if plan['masks'] is None:
                     return
                 box = layout.box()
                 col = box.column()
                 col.label(text="Toggle Mesh Pieces (Viewport)")
                 row = col.row()
-                for prop in sorted(bone.keys()):
-                    if type(bone[prop]) == list:
-                        name = prop.split("_")[2].replace("-", " ").title()
-
-                        if not name[-1] == "R":
-                            row = col.row()
-                        op = row.operator("pose.rig_set_mask", text=name)
-                        op.mask = prop
-                        op.objects = json.dumps(bone[prop])
-
-            elif bone.name == "head" and bone.get("parent_names"): # add parent space switch for head
-                box = layout.box()
-                col = box.column()
-                col.label(text="Head Parent Space (Rotational)")
-                group1 = col.row(align=True)
-                group2 = group1.split(factor=0.75, align=True)
-                props = group2.operator('pose.rigify_switch_parent', text='Head Parent', icon='DOWNARROW_HLT')
-                props.bone = bone.name
-                props.prop_bone = bone.name
-                props.prop_id = 'parent_space'
-                props.parent_names = json.dumps(bone["parent_names"])
-                props.locks = (False, True, True)
-
-                group2.prop(bone, '["parent_space"]', text='')
-
-                props = group1.operator('pose.rigify_switch_parent_bake', text='', icon='ACTION_TWEAK')
-                props.bone = bone.name
-                props.prop_bone = bone.name
-                props.prop_id = 'parent_space'
-                props.parent_names = json.dumps(bone["parent_names"])
-                props.locks = (False, True, True)
+                for name, new_row, args in plan['masks']:
+                    if new_row:
+                        row = col.row()
+                    draw_button(row, ButtonSpec("pose.rig_set_mask", name, 'NONE', args))
 
-            elif bone.get("parent_names") or bone.get("parent_names") == 0 and bone.get("parent_space"): # generic bone with arbitrary parent spaces
+            elif kind == 'parent_space': # add parent space switch for head or any other bone
                 box = layout.box()
                 col = box.column()
-                col.label(text="Parent Space")
+                col.label(text=plan['label'])
                 group1 = col.row(align=True)
                 group2 = group1.split(factor=0.75, align=True)
-                props = group2.operator('pose.rigify_switch_parent', text='Parent', icon='DOWNARROW_HLT')
-                props.bone = bone.name
-                props.prop_bone = bone.name
-                props.prop_id = 'parent_space'
-                props.parent_names = json.dumps(bone["parent_names"])
-
+                draw_button(group2, plan['switch'])
                 group2.prop(bone, '["parent_space"]', text='')
+                draw_button(group1, plan['bake'])
 
-                props = group1.operator('pose.rigify_switch_parent_bake', text='', icon='ACTION_TWEAK')
-                props.bone = bone.name
-                props.prop_bone = bone.name
-                props.prop_id = 'parent_space'
-                props.parent_names = json.dumps(bone["parent_names"])
-
-            elif "master" in bone.name and \
-                bone.get("fk_chain") and \
-                bone.get("ik_control"): # display specific layout and buttons for finger settings controls
-
+            elif kind == 'finger': # display specific layout and buttons for finger settings controls
                 layout.label(text='Finger Settings', icon="SETTINGS")
 
                 box = layout.box()
@@ -1902,52 +5097,22 @@ class VIEW3D_PT_TORigUI(bpy.types.Panel):
                 row.scale_y = 1.5
 
                 # FK to IK snap
-                props = row.operator('pose.rigify_finger_fk2ik', text=f'FK->IK ({bone.name.title().replace(".01", "")})', icon='SNAP_ON')
-                props.fk_master = bone["fk_master"]
-                props.fk_chain = json.dumps(bone["fk_chain"])
-                props.ik_chain = json.dumps(bone["ik_chain"])
-                props.ik_control = bone["ik_control"]
-                props.constraint_bone = bone["constraint_bone"]
-                props.axis = bone["axis"]
+                draw_button(row, plan['fk2ik'])
 
                 row = col.row(align=True)
-
-                props = row.operator('pose.rigify_finger_fk2ik_bake', text='Action', icon='ACTION_TWEAK')
-                props.fk_master = bone["fk_master"]
-                props.fk_chain = json.dumps(bone["fk_chain"])
-                props.ik_chain = json.dumps(bone["ik_chain"])
-                props.ik_control = bone["ik_control"]
-                props.constraint_bone = bone["constraint_bone"]
-                props.axis = bone["axis"]
-
-                props = row.operator('pose.rigify_clear_keyframes', text='Clear', icon='CANCEL')
-                props.bones = json.dumps([bone["fk_master"]] + bone["fk_chain"])
-
+                draw_button(row, plan['fk2ik_bake'])
+                draw_button(row, plan['fk_clear'])
 
                 col.separator()
                 row = col.row(align=True)
                 row.scale_y = 1.5
 
                 # IK to FK snap
-                props = row.operator('pose.rigify_generic_snap', text=f'IK->FK ({bone.name.title().replace(".01", "")})', icon='SNAP_ON')
-                props.output_bones = json.dumps([bone['ik_control']])
-                props.input_bones = json.dumps([bone['fk_chain'][-1]])
-                props.ctrl_bones = json.dumps([bone["fk_master"]] + bone["fk_chain"])
-                props.locks = (False, True, True)
-                props.tooltip = 'IK to FK'
+                draw_button(row, plan['ik2fk'])
 
                 row = col.row(align=True)
-
-                props = row.operator('pose.rigify_generic_snap_bake', text='Action', icon='ACTION_TWEAK')
-                props.output_bones = json.dumps([bone['ik_control']])
-                props.input_bones = json.dumps([bone['fk_chain']])
-                props.ctrl_bones = json.dumps([bone["fk_master"]] + bone["fk_chain"])
-                props.locks = (False, True, True)
-                props.tooltip = 'IK to FK'
-
-
-                props = row.operator('pose.rigify_clear_keyframes', text='Clear', icon='CANCEL')
-                props.bones = json.dumps([bone['ik_control']])
+                draw_button(row, plan['ik2fk_bake'])
+                draw_button(row, plan['ik_clear'])
 
                 # Parent Spaces
                 box = layout.box()
@@ -1955,14 +5120,7 @@ class VIEW3D_PT_TORigUI(bpy.types.Panel):
                 col.label(text="Parent Spaces")
                 group1 = col.row(align=True)
                 group2 = group1.split(factor=0.75, align=True)
-
-                props = group2.operator('pose.rigify_switch_parent', text='IK Parent', icon='DOWNARROW_HLT')
-                props.bone = bone["ik_control"]
-                props.prop_bone = bone.name
-                props.prop_id = 'IK_parent'
-                props.parent_names = json.dumps(bone["ik_parentswitch_parentnames"])
-                props.locks = (False, False, False)
-
+                draw_button(group2, plan['ik_parent'])
                 group2.prop(bone, '["IK_parent"]', text='')
 
                 box = layout.box()
@@ -1971,7 +5129,7 @@ class VIEW3D_PT_TORigUI(bpy.types.Panel):
                 row = col.row()
                 row.prop(bone, '["finger_curve"]', slider=True, text="Finger Curve")
 
-            elif "eye_common" in bone.name and bone.get("parent_switch"): # eye settings
+            elif kind == 'eye': # eye settings
                 bones = context.active_object.pose.bones
                 col = layout.column(align=True)
                 row = col.split(factor=0.66, align=True)
@@ -1990,49 +5148,32 @@ class VIEW3D_PT_TORigUI(bpy.types.Panel):
 
                 group1 = layout.row(align=True)
                 group2 = group1.split(factor=0.75, align=True)
-                props = group2.operator('pose.rigify_switch_parent', text='Parent (eye_common)', icon='DOWNARROW_HLT')
-                props.bone = 'eye_common'
-                props.prop_bone = 'eye_common'
-                props.prop_id = 'parent_switch'
-                props.parent_names = '["None", "God", "COG", "Hips", "Chest", "Head", "head_bend_upper"]'
-                props.locks = (False, False, False)
+                draw_button(group2, plan['switch'])
                 group2.prop(bones['eye_common'], '["parent_switch"]', text='')
-                props = group1.operator('pose.rigify_switch_parent_bake', text='', icon='ACTION_TWEAK')
-                props.bone = 'eye_common'
-                props.prop_bone = 'eye_common'
-                props.prop_id = 'parent_switch'
-                props.parent_names = '["None", "God", "COG", "Hips", "Chest", "Head", "head_bend_upper"]'
-                props.locks = (False, False, False)
-
-            elif not list(bone.keys()) == []: # for all other bones, simply display the custom property if there is one
-                ignore_props = []
-                for prop in bone.keys():
-                    try:
-                        if bone.id_properties_ui(prop).as_dict().get('description') == "ignore":
-                            ignore_props.append(prop)
-                    except TypeError:
-                        pass
-                    if prop == "rigify_parameters":
-                        ignore_props.append(prop)
-                    
-                if not len(ignore_props) == len(bone.keys()):
-                    layout.label(text="Bone Properties", icon="PROPERTIES")
-
-                    for prop in sorted(bone.keys()):
-                        if isinstance(bone.get(prop), float) or \
-                        isinstance(bone.get(prop), int):
-                            col = layout.column(align=True)
-                            name = prop.replace("_", " ").title()
-                            
-                            if "Ik" in name:
-                                name = name.replace("Ik", "IK")
-                            if "Fk" in name:
-                                name = name.replace("Fk", "FK")
-
-                            # try:
-                            if not bone.id_properties_ui(prop).as_dict().get("description") == "ignore":
-                                row = col.row()
-                                row.prop(bone, f'["{prop}"]', slider=True, text=name)
-                            # except KeyError:
-                            #         row = col.row()
-                            #         row.prop(bone, f'["{prop}"]', slider=True, text=name)
+                draw_button(group1, plan['bake'])
+
+            elif kind == 'properties': # for all other bones, simply display the custom property if there is one
+                layout.label(text="Bone Properties", icon="PROPERTIES")
+
+                for prop, name in plan['props']:
+                    row = layout.column(align=True).row()
+                    row.prop(bone, f'["{prop}"]', slider=True, text=name)
+
+class VIEW3D_PT_TORigUI_BakeSettings(bpy.types.Panel):
+
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = 'TO Rig UI'
+    bl_label = "Bake Settings"
+    bl_parent_id = "VIEW3D_PT_TORigUI"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        RigifyBakeKeyframesMixin.draw_common_bake_ui(context, layout)
+
+        col = layout.column(align=True)
+        col.label(text="Selected Rigs")
+        row = col.row(align=True)
+        row.operator('pose.rigify_batch_bake', text='Bake All IK->FK', icon='ACTION_TWEAK').direction = 'IK2FK'
+        row.operator('pose.rigify_batch_bake', text='Bake All FK->IK', icon='ACTION_TWEAK').direction = 'FK2IK'
@@ -1,5 +1,7 @@
 import bpy
 
+from .ui_panel import can_nest_bone_collections, get_visibility_set, setup_visibility_sets
+
 class POSE_OT_VehicleTogglePath(bpy.types.Operator):
     """Toggles path for vehicle"""
     bl_idname = "pose.toggle_vehicle_path"
@@ -7,18 +9,48 @@ class POSE_OT_VehicleTogglePath(bpy.types.Operator):
     
     def execute(self,context):
         ob = context.active_object
-        spline_object = ob.data["vehicle_spline_object"]
-        tangents_list = ob.data["vehicle_path_tangents"]
-        armature = bpy.context.active_object.data.bones
-        for bone in tangents_list:
-            if armature[bone].hide == True:
-                bpy.data.objects[spline_object].hide_viewport = False
-                armature[bone].hide = False       
-            else:
-                bpy.data.objects[spline_object].hide_viewport = True
-                armature[bone].hide = True    
+        spline_object = bpy.data.objects[ob.data["vehicle_spline_object"]]
+        tangents = get_visibility_set(ob.data, "vehicle_path")
+
+        # The path is shown or hidden as a whole, and the spline object follows it once
+        if tangents is not None:
+            visible = not tangents.is_visible
+            tangents.is_visible = visible
+        else:
+            bones = [bone for bone in map(ob.data.bones.get, ob.data["vehicle_path_tangents"]) if bone is not None]
+            visible = any(bone.hide for bone in bones)
+            for bone in bones:
+                bone.hide = not visible
+
+        spline_object.hide_viewport = not visible
         
         return {'FINISHED'}
+
+
+class POSE_OT_VehicleSetupPathVisibility(bpy.types.Operator):
+    """Move the path tangent bones into their own bone collection, nested under the
+    collection they are in, so that toggling the path only changes that collection.
+    Needs Blender 4.1 or later and is done once per rig; nothing is migrated automatically,
+    so rigs that are not set up (and all rigs on 4.0) keep toggling the bone hide flags"""
+    bl_idname = "pose.vehicle_setup_path_visibility"
+    bl_label = "Set Up Path Visibility"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        ob = context.active_object
+        return (ob is not None and ob.type == 'ARMATURE' and "vehicle_path_tangents" in ob.data
+                and can_nest_bone_collections())
+
+    def execute(self, context):
+        data = context.active_object.data
+        done, skipped = setup_visibility_sets(data, {"vehicle_path": list(data["vehicle_path_tangents"])})
+
+        if skipped:
+            self.report({'WARNING'}, "The path tangents are not all in the same single collection, kept hide flags")
+        else:
+            self.report({'INFO'}, "Set up the path visibility")
+        return {'FINISHED'}
     
     
 class POSE_OT_VehicleSetFloor(bpy.types.Operator):